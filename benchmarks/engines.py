@@ -0,0 +1,148 @@
+"""Speed benchmark for the execution engines.
+
+Runs a set of BLAST programs on every engine of the Interpreter, checks that all
+engines give identical results, printed output and errors, and reports the time
+each engine takes and its speedup over the tree-walking engine. Some programs are
+also run by several threads at once on one Interpreter per engine, and every
+thread must get the result of the program run alone. The conformance of the
+engines is tested by ``tests/test_engines.py``.
+
+Run with ``python3 benchmarks/engines.py`` from the repository root. The exit
+status is 1 if any engine disagrees with the tree-walking engine.
+
+The times it prints are CPU times, of the best of ``--repeat`` runs; wall-clock
+times on a busy machine vary too much to tell a regression from noise.
+"""
+
+import contextlib
+import io
+import pathlib
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from blast.interpreter import Interpreter  # noqa: E402
+
+"""Programs checked for conformance and timed."""
+TIMED = {
+    'while loop': 'i : 0. s : 0. while i < 100000 do s : s + i * 2. i : i + 1. end. s.',
+    'recursion': 'routine fib(n) r : n. if n > 1 then r : fib(n - 1) + fib(n - 2). end. r. end. fib(18).',
+    'calls in a loop': 'routine sq(n) n * n. end. i : 0. t : 0. while i < 20000 do t : t + sq(i). i : i + 1. end. t.',
+    'early return': 'routine find(n) i : 0. while i < 1000 do if i * i >= n then return i. end. i : i + 1. end. -1. end. '
+                    'j : 0. s : 0. while j < 2000 do s : s + find(j). j : j + 1. end. s.',
+    'array transform': 'a : range(100000). sum(a * 2 + a % 7).',
+}
+
+"""Programs checked for giving the same result when run by several threads at once."""
+THREADED = {
+    'global loop': 'i : 0. s : 0. while i < 20000 do s : s + 1. i : i + 1. end. s.',
+    'recursion': TIMED['recursion'],
+    'calls in a loop': TIMED['calls in a loop'],
+    'early return': TIMED['early return'],
+    'dynamic scope': 'routine g() z * 2. end. routine f(z) g(). end. i : 0. t : 0. '
+                     'while i < 300 do t : t + f(i). i : i + 1. end. t.',
+}
+
+
+def run(source, engine):
+    """Runs a program and captures everything it does.
+
+    Args:
+        source (str): The source code of the program.
+        engine (str): The engine to run the program with.
+
+    Returns:
+        tuple[str, str, float]: The result (or error), the printed output and the
+            CPU time taken in seconds.
+    """
+    output = io.StringIO()
+    start = time.process_time()
+    with contextlib.redirect_stdout(output):
+        try:
+            # memoization would hide the cost of calls, which is what is measured
+            result = repr(Interpreter(engine, memo_size=None).evaluate(source))
+        except Exception as e:
+            result = f"{type(e).__name__}: {e}"
+    return result, output.getvalue(), time.process_time() - start
+
+
+def run_threads(source, engine, count):
+    """Runs a program in several threads at once, on the same Interpreter.
+
+    Args:
+        source (str): The source code of the program.
+        engine (str): The engine to run the program with.
+        count (int): The number of threads.
+
+    Returns:
+        list[str]: The result (or error) of each thread.
+    """
+    interpreter = Interpreter(engine, memo_size=None)
+    results = []
+
+    def target():
+        try:
+            results.append(repr(interpreter.evaluate(source)))
+        except Exception as e:
+            results.append(f"{type(e).__name__}: {e}")
+
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    # switch threads often, so that the runs interleave
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    return results
+
+
+def main():
+    argparser = ArgumentParser(description='Engine conformance and speed benchmark')
+    argparser.add_argument('--repeat', type=int, default=3,
+                           help='number of runs per timed program (best is kept)')
+    argparser.add_argument('--threads', type=int, default=8,
+                           help='number of threads running each threaded program')
+    args = argparser.parse_args()
+
+    failures = 0
+    for name, source in TIMED.items():
+        expected = run(source, 'tree')[:2]
+        for engine in Interpreter.ENGINES:
+            actual = run(source, engine)[:2]
+            if actual != expected:
+                failures += 1
+                print(f"MISMATCH {name!r} on {engine}: {actual!r} != {expected!r}")
+    print(f"{len(TIMED)} programs, {failures} mismatches")
+
+    threaded = 0
+    for name, source in THREADED.items():
+        expected = run(source, 'tree')[0]
+        for engine in Interpreter.ENGINES:
+            wrong = sum(result != expected for result in run_threads(source, engine, args.threads))
+            if wrong:
+                threaded += 1
+                print(f"MISMATCH {name!r} on {engine} in threads: {wrong} of {args.threads} threads")
+    print(f"{len(THREADED)} programs in {args.threads} threads, {threaded} mismatches")
+    failures += threaded
+
+    print(f"{'program':>16} " + " ".join(f"{engine:>14}" for engine in Interpreter.ENGINES))
+    for name, source in TIMED.items():
+        times = {engine: min(run(source, engine)[2] for _ in range(args.repeat))
+                 for engine in Interpreter.ENGINES}
+        print(f"{name:>16} " + " ".join(
+            f"{times[engine]:>7.3f}s {times['tree'] / times[engine]:>4.1f}x"
+            for engine in Interpreter.ENGINES))
+
+    if failures:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
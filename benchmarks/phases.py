@@ -0,0 +1,342 @@
+"""Phase benchmark for the scanner, the parser and the interpreter.
+
+Runs a suite of representative BLAST programs (the ``.blast`` files in
+``benchmarks/programs`` and a few generated ones) and times each phase of their
+execution separately: scanning (``Scanner.scan_tokens``), parsing
+(``Parser.parse``) and running the tree (``Interpreter.run``). For each phase it
+reports the throughput (tokens/s, nodes/s and statements run per second) and the
+peak memory it allocates.
+
+Each phase runs enough times in a row to take at least ``--min-time`` seconds,
+and the best of ``--repeat`` such measurements is kept, along with their spread
+(how much slower the median one was), which tells how noisy the machine is.
+
+The results can be saved as JSON with ``--output``, and compared with a saved run
+with ``--compare``: a phase that got slower by more than ``--threshold`` percent
+and more than the spreads of both runs, or allocates more memory by more than
+``--threshold`` percent, is reported as a regression.
+
+Run with ``python3 benchmarks/phases.py`` from the repository root. The exit
+status is 1 if any regression is found.
+"""
+
+import contextlib
+import json
+import os
+import pathlib
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from blast.ast import AST  # noqa: E402
+from blast.interpreter import Interpreter  # noqa: E402
+from blast.parser import Parser  # noqa: E402
+from blast.scanner import Scanner  # noqa: E402
+from scanner_scaling import generate  # noqa: E402
+
+"""The directory of the programs of the suite."""
+PROGRAMS = pathlib.Path(__file__).parent / "programs"
+
+"""The phases of the execution of a program, and the unit of their throughput."""
+PHASES = {"scan": "tokens", "parse": "nodes", "interpret": "ops"}
+
+
+def nested(depth, count):
+    """Generate a program evaluating deeply nested expressions in a loop.
+
+    Args:
+        depth (int): The nesting depth of each expression.
+        count (int): The number of expressions.
+
+    Returns:
+        str: The generated source code.
+    """
+    lines = ["x : 3.", "i : 0.", "while i < 200 do"]
+    for n in range(count):
+        expr = "x"
+        for d in range(depth):
+            expr = f"({expr} {'+-*%'[d % 4]} {(d + n) % 5 + 1})"
+        lines.append(f"    y : {expr}.")
+    lines += ["    i : i + 1.", "end.", "y."]
+    return "\n".join(lines) + "\n"
+
+
+def suite():
+    """Collect the programs of the suite.
+
+    Returns:
+        dict[str, str]: The source code of each program, by name.
+    """
+    programs = {path.stem: path.read_text() for path in sorted(PROGRAMS.glob("*.blast"))}
+    programs["nesting"] = nested(40, 20)
+    programs["large source"] = generate(256 * 1024)
+    return programs
+
+
+def count_nodes(ast):
+    """Count the nodes of an abstract syntax tree.
+
+    Args:
+        ast (AST): The root of the tree.
+
+    Returns:
+        int: The number of nodes.
+    """
+    count = 0
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        count += 1
+        for name in type(node).__slots__:
+            child = getattr(node, name, None)
+            if isinstance(child, AST):
+                stack.append(child)
+            elif isinstance(child, list):
+                stack.extend(item for item in child if isinstance(item, AST))
+    return count
+
+
+def count_ops(source, engine):
+    """Count the statements run by a program.
+
+    Args:
+        source (str): The source code of the program.
+        engine (str): The engine to run the program with.
+
+    Returns:
+        int: The number of statements run, as counted by the profiler.
+    """
+    interpreter = Interpreter(engine, memo_size=None, parse_cache=None, profile=True)
+    with quiet():
+        interpreter.execute(source)
+    return sum(stats.calls for stats in interpreter.profiler.statements.values())
+
+
+@contextlib.contextmanager
+def quiet():
+    """Discard what the programs print, which is not measured."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def phases(source, engine):
+    """Prepare the phases of the execution of a program.
+
+    Args:
+        source (str): The source code of the program.
+        engine (str): The engine to run the program with.
+
+    Returns:
+        dict[str, Callable[[], Callable[[], Any]]]: For each phase, a function
+            doing the work the phase needs (untimed) and returning the phase.
+    """
+    def scan():
+        return lambda: Scanner(source).scan_tokens()
+
+    def parse():
+        tokens = Scanner(source).scan_tokens()
+        return lambda: Parser(tokens=tokens).parse()
+
+    def interpret():
+        # the tree is parsed anew for each run, as the interpreter caches the code
+        # it compiles from a tree, which would make the later runs faster
+        ast = Parser(source).parse()
+        # memoization would hide the cost of calls, which is what is measured
+        interpreter = Interpreter(engine, memo_size=None, parse_cache=None)
+        return lambda: interpreter.run(ast, values=False)
+
+    return {"scan": scan, "parse": parse, "interpret": interpret}
+
+
+def calibrate(phase, min_time):
+    """Find how many runs of a phase take a given time, as timeit's autorange does.
+
+    Args:
+        phase (Callable[[], Callable[[], Any]]): The phase, as returned by phases().
+        min_time (float): The least number of seconds the runs should take.
+
+    Returns:
+        tuple[int, float]: The number of runs, and the seconds they took.
+    """
+    number = 1
+    while True:
+        seconds = _time(phase, number)
+        if seconds >= min_time:
+            return number, seconds
+        number = max(number * 2, int(number * min_time / max(seconds, 1e-9) * 1.2))
+
+
+def measure(phases, repeat, min_time):
+    """Time phases several times, and measure the memory they allocate.
+
+    The phases are timed in turn, once per round, so that a period in which the
+    machine is slower affects a little all of them rather than a few of them.
+
+    Args:
+        phases (dict[Any, Callable[[], Callable[[], Any]]]): The phases, as
+            returned by phases(), by key.
+        repeat (int): The number of measurements of each phase.
+        min_time (float): The least number of seconds of a measurement, which runs
+            the phase as many times as it takes.
+
+    Returns:
+        dict[Any, tuple[float, float, int]]: For each phase, the best time of a run
+            in seconds, the spread of the measurements (the median time minus the
+            best, in seconds), and the peak memory allocated in bytes (measured in
+            a separate run, as tracing slows it down).
+    """
+    with quiet():
+        numbers = {}
+        times = {}
+        for key, phase in phases.items():
+            numbers[key], seconds = calibrate(phase, min_time)
+            times[key] = [seconds / numbers[key]]
+        for _ in range(repeat - 1):
+            for key, phase in phases.items():
+                times[key].append(_time(phase, numbers[key]) / numbers[key])
+
+        results = {}
+        for key, phase in phases.items():
+            run = phase()
+            tracemalloc.start()
+            base = tracemalloc.get_traced_memory()[0]
+            try:
+                run()
+                peak = tracemalloc.get_traced_memory()[1] - base
+            finally:
+                tracemalloc.stop()
+            best = min(times[key])
+            results[key] = (best, statistics.median(times[key]) - best, peak)
+    return results
+
+
+def _time(phase, number):
+    # the processor time of number runs of a phase, in seconds, which the other
+    # processes of the machine do not add to as they do to the wall-clock time
+    runs = [phase() for _ in range(number)]
+    start = time.process_time()
+    for run in runs:
+        run()
+    return time.process_time() - start
+
+
+def benchmark(programs, engine, repeat, min_time):
+    """Measure every phase of programs.
+
+    Args:
+        programs (dict[str, str]): The source code of each program, by name.
+        engine (str): The engine to run the programs with.
+        repeat (int): The number of measurements per phase.
+        min_time (float): The least number of seconds of a measurement.
+
+    Returns:
+        dict[str, dict[str, dict]]: For each program and each of its phases, the
+            time of the phase in seconds and the spread of the times, the number
+            of items it handled, its throughput in items per second and its peak
+            memory in bytes.
+    """
+    counts = {}
+    prepared = {}
+    for program, source in programs.items():
+        counts[program, "scan"] = len(Scanner(source).scan_tokens())
+        counts[program, "parse"] = count_nodes(Parser(source).parse())
+        counts[program, "interpret"] = count_ops(source, engine)
+        for name, phase in phases(source, engine).items():
+            prepared[program, name] = phase
+
+    results = {program: {} for program in programs}
+    for (program, name), (seconds, spread, peak) in measure(prepared, repeat, min_time).items():
+        results[program][name] = {
+            "seconds": seconds,
+            "spread": spread,
+            "count": counts[program, name],
+            "rate": counts[program, name] / seconds,
+            "peak": peak,
+        }
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Compare results with a baseline.
+
+    Args:
+        results (dict): The results of this run.
+        baseline (dict): The results of an earlier run, as saved with --output.
+        threshold (float): The growth, in percent, above which a time or a peak
+            memory is a regression. A time must also grow by more than the
+            spreads of both runs, which are the noise of the measurements.
+
+    Returns:
+        list[str]: A description of each regression.
+    """
+    regressions = []
+    for program, measured in results["programs"].items():
+        for phase, now in measured.items():
+            before = baseline["programs"].get(program, {}).get(phase)
+            if before is None:
+                continue
+            for key, what in (("seconds", "time"), ("peak", "peak memory")):
+                if not before[key]:
+                    continue
+                allowed = before[key] * threshold / 100
+                if key == "seconds":
+                    noise = now.get("spread", 0) + before.get("spread", 0)
+                    allowed = max(allowed, noise)
+                if now[key] - before[key] > allowed:
+                    growth = (now[key] / before[key] - 1) * 100
+                    regressions.append(f"{program} {phase}: {what} +{growth:.1f}%")
+    return regressions
+
+
+def main():
+    argparser = ArgumentParser(description='Scanner, parser and interpreter benchmark')
+    argparser.add_argument('--engine', choices=Interpreter.ENGINES, default='tree',
+                           help='engine to run the programs with')
+    argparser.add_argument('--repeat', type=int, default=7,
+                           help='number of measurements per phase (best is kept)')
+    argparser.add_argument('--min-time', type=float, default=0.2,
+                           help='least number of seconds of a measurement')
+    argparser.add_argument('--output', metavar='FILE',
+                           help='save the results as JSON')
+    argparser.add_argument('--compare', metavar='FILE',
+                           help='compare the results with a run saved with --output')
+    argparser.add_argument('--threshold', type=float, default=5.0,
+                           help='growth in percent reported as a regression (a time must '
+                                'also grow by more than the spreads)')
+    args = argparser.parse_args()
+
+    results = {
+        "engine": args.engine,
+        "python": platform.python_version(),
+        "programs": benchmark(suite(), args.engine, args.repeat, args.min_time),
+    }
+    print(f"{'program':>14} {'phase':>10} {'seconds':>10} {'spread':>7} {'count':>10} "
+          f"{'rate':>18} {'peak KiB':>10}")
+    for name, measured in results["programs"].items():
+        for phase, row in measured.items():
+            spread = row['spread'] / row['seconds'] * 100
+            print(f"{name:>14} {phase:>10} {row['seconds']:>10.4f} {spread:>6.1f}% {row['count']:>10} "
+                  f"{row['rate']:>11.0f} {PHASES[phase] + '/s':<6} {row['peak'] / 1024:>10.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        print(f"{len(regressions)} regressions over {args.threshold:g}%")
+        if regressions:
+            exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Scaling benchmark for the scanner.
+
+Scans generated BLAST sources of doubling size and reports the throughput for
+each size. The scanner is linear if the time per byte stays flat as the source
+grows; the benchmark fails if the largest input is scanned more than
+``--tolerance`` times slower per byte than the smallest one.
+
+Run with ``python3 benchmarks/scanner_scaling.py`` from the repository root.
+"""
+
+import pathlib
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from blast.scanner import Scanner  # noqa: E402
+
+"""A snippet exercising every kind of token, repeated to build the sources."""
+SNIPPET = '''routine step_{i}(value limit)
+    total : value * 2 + limit ** 2 - value % 3.
+    if total >= limit then "over". else total / 4. end.
+end.
+counter_{i} : 0.
+while counter_{i} <> 10 do counter_{i} : counter_{i} + 1. end.
+print(step_{i}(counter_{i} 3.5)).
+'''
+
+
+def generate(size):
+    """Generate a BLAST source of at least the given size.
+
+    Args:
+        size (int): The minimum size of the source, in bytes.
+
+    Returns:
+        str: The generated source code.
+    """
+    parts = []
+    length = 0
+    i = 0
+    while length < size:
+        part = SNIPPET.format(i=i)
+        parts.append(part)
+        length += len(part)
+        i += 1
+    return "".join(parts)
+
+
+def measure(source, repeat):
+    """Scan the source several times and return the best time.
+
+    Args:
+        source (str): The source code to scan.
+        repeat (int): The number of times to scan the source.
+
+    Returns:
+        tuple[float, int]: The best time in seconds and the number of tokens.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = Scanner(source).scan_tokens()
+        best = min(best, time.perf_counter() - start)
+    return best, len(tokens)
+
+
+def main():
+    argparser = ArgumentParser(description='Scanner scaling benchmark')
+    argparser.add_argument('--min-size', type=int, default=64 * 1024,
+                           help='size of the smallest source, in bytes')
+    argparser.add_argument('--max-size', type=int, default=4 * 1024 * 1024,
+                           help='size of the largest source, in bytes')
+    argparser.add_argument('--repeat', type=int, default=3,
+                           help='number of runs per size (best is kept)')
+    argparser.add_argument('--tolerance', type=float, default=2.0,
+                           help='maximum allowed growth of the time per byte')
+    args = argparser.parse_args()
+
+    print(f"{'bytes':>10} {'tokens':>10} {'seconds':>10} {'MB/s':>8} {'ns/byte':>8}")
+    per_byte = []
+    size = args.min_size
+    while size <= args.max_size:
+        source = generate(size)
+        seconds, count = measure(source, args.repeat)
+        per_byte.append(seconds / len(source))
+        print(f"{len(source):>10} {count:>10} {seconds:>10.4f} "
+              f"{len(source) / seconds / 1e6:>8.2f} {per_byte[-1] * 1e9:>8.1f}")
+        size *= 2
+
+    growth = per_byte[-1] / per_byte[0]
+    print(f"time per byte grew {growth:.2f}x from smallest to largest input")
+    if growth > args.tolerance:
+        print("scanning is not linear in the size of the source")
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""Load test for the JSON-lines server of ``blast.py --serve``.
+
+Starts ``blast.py --serve`` on a Unix domain socket (or on its stdin/stdout with
+``--stdio``), sends it requests from several concurrent clients, each waiting for
+the response to a request before sending the next, and reports the throughput and
+the distribution of the latency of the requests. For comparison, it also times
+running the same program with ``blast.py -e`` in a fresh process.
+
+By default there are twice as many clients as workers, all connected at once,
+so the load test also checks that a worker serves several connections: it fails
+(instead of hanging) if a response does not come within ``--timeout`` seconds,
+or answers another request.
+
+Run with ``python3 benchmarks/server_load.py`` from the repository root.
+"""
+
+import json
+import pathlib
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+
+ROOT = pathlib.Path(__file__).parent.parent
+
+"""The program of the requests, unless another one is given."""
+PROGRAM = "x * 2 + 1."
+
+
+def percentile(values, fraction):
+    """Get a percentile of a list of values.
+
+    Args:
+        values (list[float]): The values, sorted.
+        fraction (float): The fraction of the values below the percentile.
+
+    Returns:
+        float: The percentile.
+    """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def client(reader, writer, program, count, latencies):
+    """Send requests one after the other, and time their responses.
+
+    Args:
+        reader (TextIO): The stream of the responses.
+        writer (TextIO): The stream of the requests.
+        program (str): The program of the requests.
+        count (int): The number of requests.
+        latencies (list[float]): The list to append the latency of each request to,
+            in seconds.
+    """
+    for index in range(count):
+        request = json.dumps({"id": index, "program": program, "bindings": {"x": index}})
+        start = time.perf_counter()
+        writer.write(request + "\n")
+        writer.flush()
+        response = json.loads(reader.readline())
+        latencies.append(time.perf_counter() - start)
+        if "error" in response:
+            raise Exception(f"Request failed: {response['error']}")
+        if response.get("id") != index:
+            raise Exception(f"Response to request {response.get('id')!r} instead of {index}")
+
+
+def connect(path, timeout=10.0):
+    """Connect to the socket of a server, once it listens.
+
+    Args:
+        path (str): The path of the socket.
+        timeout (float): The number of seconds to wait for the server.
+
+    Returns:
+        socket.socket: The connection.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(path)
+            return connection
+        except (FileNotFoundError, ConnectionRefusedError):
+            connection.close()
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def load_socket(program, connections, count, workers, timeout):
+    """Load a server listening on a Unix domain socket.
+
+    Args:
+        program (str): The program of the requests.
+        connections (int): The number of concurrent clients.
+        count (int): The number of requests per client.
+        workers (int): The number of worker processes of the server.
+        timeout (float): The number of seconds to wait for a response.
+
+    Returns:
+        tuple[list[float], float]: The latencies of the requests, and the time all
+            of them took, in seconds.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(pathlib.Path(directory) / "blast.sock")
+        server = subprocess.Popen([sys.executable, str(ROOT / "blast.py"), "--serve", path,
+                                   "--workers", str(workers)])
+        try:
+            sockets = [connect(path) for _ in range(connections)]
+            for sock in sockets:
+                sock.settimeout(timeout)
+            streams = [(sock.makefile("r"), sock.makefile("w")) for sock in sockets]
+            # one request per client first, so that every worker is running
+            for reader, writer in streams:
+                client(reader, writer, program, 1, [])
+
+            latencies = []
+            errors = []
+
+            def run(reader, writer):
+                try:
+                    client(reader, writer, program, count, latencies)
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=run, args=stream) for stream in streams]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            if errors:
+                raise errors[0]
+            for sock in sockets:
+                sock.close()
+        finally:
+            server.terminate()
+            server.wait()
+    return latencies, elapsed
+
+
+def load_stdio(program, count):
+    """Load a server reading its stdin and writing its stdout.
+
+    Args:
+        program (str): The program of the requests.
+        count (int): The number of requests.
+
+    Returns:
+        tuple[list[float], float]: The latencies of the requests, and the time all
+            of them took, in seconds.
+    """
+    server = subprocess.Popen([sys.executable, str(ROOT / "blast.py"), "--serve"],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        client(server.stdout, server.stdin, program, 1, [])
+        latencies = []
+        start = time.perf_counter()
+        client(server.stdout, server.stdin, program, count, latencies)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.stdin.close()
+        server.wait()
+    return latencies, elapsed
+
+
+def fresh_process(program, repeat):
+    """Time running a program with blast.py -e, in a new process each time.
+
+    Args:
+        program (str): The program.
+        repeat (int): The number of runs.
+
+    Returns:
+        list[float]: The time of each run, in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, str(ROOT / "blast.py"), "-e", program.replace("x", "1")],
+                       stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name, latencies, elapsed=None):
+    """Print the distribution of latencies.
+
+    Args:
+        name (str): The name of the measurement.
+        latencies (list[float]): The latencies, in seconds.
+        elapsed (float?): The time all the requests took, to report the throughput.
+    """
+    latencies = sorted(latencies)
+    rate = f"{len(latencies) / elapsed:>10.0f}" if elapsed else f"{'-':>10}"
+    print(f"{name:>14} {len(latencies):>9} {rate} "
+          + " ".join(f"{percentile(latencies, fraction) * 1e3:>8.3f}" for fraction in (0.5, 0.9, 0.99))
+          + f" {latencies[-1] * 1e3:>8.3f}")
+
+
+def main():
+    argparser = ArgumentParser(description='blast.py --serve load test')
+    argparser.add_argument('--program', default=PROGRAM,
+                           help='program of the requests (x is bound to the index of the request)')
+    argparser.add_argument('--requests', type=int, default=2000,
+                           help='number of requests per client')
+    argparser.add_argument('--connections', type=int, default=8,
+                           help='number of concurrent clients')
+    argparser.add_argument('--workers', type=int, default=4,
+                           help='number of worker processes of the server')
+    argparser.add_argument('--timeout', type=float, default=30.0,
+                           help='number of seconds to wait for a response')
+    argparser.add_argument('--stdio', action='store_true',
+                           help='serve on stdin/stdout (with a single client) instead of a socket')
+    argparser.add_argument('--baseline', type=int, default=10,
+                           help='number of runs of blast.py -e to compare with')
+    args = argparser.parse_args()
+
+    print(f"{'mode':>14} {'requests':>9} {'req/s':>10} {'p50 ms':>8} {'p90 ms':>8} "
+          f"{'p99 ms':>8} {'max ms':>8}")
+    if args.stdio:
+        latencies, elapsed = load_stdio(args.program, args.requests)
+        report("stdio", latencies, elapsed)
+    else:
+        latencies, elapsed = load_socket(args.program, args.connections, args.requests, args.workers,
+                                        args.timeout)
+        report("socket", latencies, elapsed)
+    if args.baseline:
+        report("blast.py -e", fresh_process(args.program, args.baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Startup benchmark for the .blastc program cache.
+
+Writes generated BLAST scripts of several sizes to a temporary directory and
+reports, for each one:
+
+- the time to parse the source, and the time to load its .blastc file instead,
+- the wall-clock time of running ``blast.py`` on it with ``--no-cache``, and
+  with a warm cache, in a fresh Python process each time.
+
+Run with ``python3 benchmarks/startup.py`` from the repository root.
+"""
+
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+ROOT = pathlib.Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+from blast.cache import ProgramCache  # noqa: E402
+from blast.interpreter import Interpreter  # noqa: E402
+from scanner_scaling import generate  # noqa: E402
+
+
+def best(function, repeat):
+    """Call a function several times and return the best time.
+
+    Args:
+        function (Callable[[], Any]): The function to call.
+        repeat (int): The number of calls.
+
+    Returns:
+        float: The best time in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_script(path, *flags):
+    """Run blast.py on a script in a new process, discarding its output.
+
+    Args:
+        path (pathlib.Path): The path of the script.
+        flags (str): Extra command line flags.
+    """
+    subprocess.run([sys.executable, str(ROOT / "blast.py"), *flags, str(path)],
+                   stdout=subprocess.DEVNULL, check=True)
+
+
+def main():
+    argparser = ArgumentParser(description='.blastc startup benchmark')
+    argparser.add_argument('--sizes', type=int, nargs='+', default=[1024, 16 * 1024, 256 * 1024],
+                           help='sizes of the generated scripts, in bytes')
+    argparser.add_argument('--repeat', type=int, default=10,
+                           help='number of runs per measurement (best is kept)')
+    args = argparser.parse_args()
+
+    print(f"{'bytes':>8} {'parse':>9} {'load':>9} {'speedup':>8}"
+          f" {'run --no-cache':>15} {'run cached':>11} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            source = generate(size)
+            path = pathlib.Path(directory) / f"script_{size}.blast"
+            path.write_text(source)
+
+            cache = ProgramCache()
+            cache.store(str(path), source, Interpreter().parse(source))
+            parse = best(lambda: Interpreter().parse(source), args.repeat)
+            load = best(lambda: cache.load(str(path), source), args.repeat)
+
+            uncached = best(lambda: run_script(path, "--no-cache"), args.repeat)
+            cached = best(lambda: run_script(path), args.repeat)
+
+            print(f"{len(source):>8} {parse * 1e3:>7.2f}ms {load * 1e3:>7.2f}ms {parse / load:>7.1f}x"
+                  f" {uncached * 1e3:>13.1f}ms {cached * 1e3:>9.1f}ms {uncached / cached:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Memory benchmark for the tokens of a large generated script.
+
+Scans a generated BLAST source and reports the memory held by its tokens, in
+bytes per token and in megabytes per megabyte of source, for:
+
+- the TokenBuffer returned by Scanner.scan_tokens(),
+- a list of the Token objects yielded by Scanner.iter_tokens(),
+- a list of dict-backed tokens with private lexeme copies, the layout tokens
+  had before they were slotted, for reference.
+
+Run with ``python3 benchmarks/token_memory.py`` from the repository root.
+"""
+
+import pathlib
+import sys
+import tracemalloc
+from argparse import ArgumentParser
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from blast.scanner import Scanner  # noqa: E402
+from scanner_scaling import generate  # noqa: E402
+
+
+class LegacyToken:
+    """A dict-backed token, as tokens were stored before they were slotted."""
+
+    def __init__(self, type, lexeme):
+        self.type = type
+        self.lexeme = lexeme
+
+
+def legacy_tokens(source):
+    """Scans the source into dict-backed tokens with private lexeme copies.
+
+    Args:
+        source (str): The source code to scan.
+
+    Returns:
+        list[LegacyToken]: The tokens.
+    """
+    # slicing the lexeme out of a longer string makes a private copy of it
+    return [LegacyToken(token.type, (token.lexeme + " ")[:-1])
+            for token in Scanner(source).iter_tokens()]
+
+
+def measure(build, source):
+    """Measures the memory held by the result of a build function.
+
+    Args:
+        build (Callable[[str], Sized]): The function building the tokens.
+        source (str): The source code to scan.
+
+    Returns:
+        tuple[int, int]: The number of tokens and the number of bytes they hold.
+    """
+    tracemalloc.start()
+    tokens = build(source)
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return len(tokens), held
+
+
+def main():
+    argparser = ArgumentParser(description='Token memory benchmark')
+    argparser.add_argument('--size', type=int, default=4 * 1024 * 1024,
+                           help='size of the generated source, in bytes')
+    args = argparser.parse_args()
+
+    source = generate(args.size)
+    megabytes = len(source) / 1e6
+    layouts = {
+        'TokenBuffer': lambda source: Scanner(source).scan_tokens(),
+        'list[Token]': lambda source: list(Scanner(source).iter_tokens()),
+        'legacy': legacy_tokens,
+    }
+
+    print(f"{len(source)} bytes of source")
+    print(f"{'layout':>12} {'tokens':>10} {'bytes/token':>12} {'MB/MB source':>13}")
+    for name, build in layouts.items():
+        count, held = measure(build, source)
+        print(f"{name:>12} {count:>10} {held / count:>12.1f} "
+              f"{held / 1e6 / megabytes:>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
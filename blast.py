@@ -1,7 +1,8 @@
 from typing import Iterable
 from blast.interpreter import Interpreter
 from argparse import ArgumentParser
-import itertools
+import os
+import sys
 
 
 def main():
@@ -15,23 +16,48 @@ def main():
                             action='store_true', help='run in interactive mode')
     mutex_args.add_argument('-e', '--expression',
                             type=str, help='execute an expression')
+    mutex_args.add_argument('--serve', nargs='?', const='-', metavar='SOCKET',
+                            help='answer JSON-lines requests on a Unix domain socket '
+                                 '(or on stdin/stdout, without SOCKET)')
+    argparser.add_argument('--engine', choices=Interpreter.ENGINES, default='tree',
+                           help='engine to run programs with (default: tree)')
+    argparser.add_argument('-O', '--optimize', action='count', default=0,
+                           help='optimize programs before running them (-O: fold constants, '
+                                '-OO: also eliminate dead branches)')
+    argparser.add_argument('--no-cache', action='store_true',
+                           help='do not load or save the parsed program in a .blastc file')
+    argparser.add_argument('--cache-dir', type=str,
+                           help='directory for .blastc files (default: next to the file)')
+    argparser.add_argument('--profile', action='store_true',
+                           help='print the time spent in each routine and statement to stderr')
+    argparser.add_argument('--profile-stacks', type=str, metavar='FILE',
+                           help='profile, and write collapsed stacks for flame graph tools to FILE')
+    argparser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                           help='number of worker processes of --serve SOCKET (default: one per CPU)')
 
     args = argparser.parse_args()
-
-    if args.interactive:
-        repl()
+    options = dict(engine=args.engine, optimize=args.optimize)
+    if args.profile or args.profile_stacks:
+        options.update(profile=True, stacks=args.profile_stacks)
+
+    if args.serve:
+        serve(args.serve, args.workers, engine=args.engine, optimize=args.optimize)
+    elif args.interactive:
+        repl(**options)
     elif args.expression:
-        expression(args.expression)
+        expression(args.expression, **options)
     else:
-        read(args.file)
+        from blast.cache import ProgramCache
+        cache = None if args.no_cache else ProgramCache(args.cache_dir)
+        read(args.file, cache=cache, **options)
 
 
-def repl():
+def repl(stacks=None, **options):
     print('BLAST interpreter')
     print('Type in multiple lines of code, then press Ctrl+D (or Enter then Ctrl+Z then Enter on Windows) to execute.')
     print('Press Ctrl+C to exit.')
 
-    interpreter = Interpreter()
+    interpreter = Interpreter(**options)
     while True:
         lines = []  # list of lines of input
         # input until EOF
@@ -51,50 +77,89 @@ def repl():
             except EOFError:
                 break
             except KeyboardInterrupt:
+                report(interpreter, stacks)
                 exit(0)
 
         try:
-            results = interpreter.evaluate('\n'.join(lines))
-            # check if empty list
-            if results:
-                # flatten list
-                results = flatten(results)
-                # print results
-                print(*results, sep='\n')
+            display(interpreter.iter_evaluate('\n'.join(lines)))
         except Exception as e:
             print(e)
 
 
-def expression(expr):
-    interpreter = Interpreter()
+def expression(expr, stacks=None, **options):
+    interpreter = Interpreter(**options)
     try:
-        results = interpreter.evaluate(expr)
-        # check if empty list
-        if results:
-            # flatten list
-            results = flatten(results)
-            # print results
-            print(*results, sep='\n')
+        display(interpreter.iter_evaluate(expr))
     except Exception as e:
         print(e)
+    report(interpreter, stacks)
+
+
+def display(results):
+    # print the results as each statement produces them (flattened)
+    for result in results:
+        for item in flatten([result]):
+            print(item)
+
+
+def serve(path, workers, **options):
+    # only the server imports the modules it needs
+    from blast.server import Server
+    server = Server(Interpreter(**options))
+    try:
+        if path == '-':
+            server.serve(sys.stdin, sys.stdout)
+        else:
+            server.serve_unix(path, workers)
+    except KeyboardInterrupt:
+        pass
 
 
-def read(file):
+def read(file, cache=None, stacks=None, **options):
+    interpreter = Interpreter(**options)
     try:
-        with open(file, 'r') as f:
-            Interpreter().evaluate(f.read())
+        run_file(interpreter, file, cache, options.get('optimize', 0))
     except FileNotFoundError:
         print(f'File {file} not found.')
         exit(1)
     except Exception as e:
         print(e)
+        report(interpreter, stacks)
         exit(2)
+    report(interpreter, stacks)
+
+
+def run_file(interpreter, file, cache, optimize):
+    with open(file, 'r') as f:
+        if cache is None:
+            # the file is scanned lazily while it is parsed, and the values of
+            # its statements are not kept
+            interpreter.execute(f)
+            return
+        source = f.read()
+    # load the parsed program from the cache, or parse it and save it
+    ast = cache.load(file, source, optimize)
+    if ast is None:
+        ast = interpreter.parse(source)
+        cache.store(file, source, ast, optimize)
+    interpreter.run(ast, values=False)
+
+
+def report(interpreter, stacks=None):
+    # print the profile of the interpreter, if it profiles, and save its stacks
+    if interpreter.profiler is None:
+        return
+    print(interpreter.profiler.report(), file=sys.stderr)
+    if stacks:
+        with open(stacks, 'w') as f:
+            f.write(interpreter.profiler.collapsed() + '\n')
 
 
 def flatten(items):
     """Yield items from any nested iterable; see Reference."""
+    from blast.arrays import Array
     for x in items:
-        if isinstance(x, Iterable) and not isinstance(x, (str, bytes)):
+        if isinstance(x, Iterable) and not isinstance(x, (str, bytes, Array)):
             for sub_x in flatten(x):
                 yield sub_x
         else:
@@ -0,0 +1,225 @@
+"""Arrays for the BLAST language.
+
+This module contains the Array class, the value of BLAST arrays: sequences of
+floating-point numbers whose arithmetic and comparison operators apply to all of
+their elements at once. The elements are stored in a NumPy array when NumPy is
+installed, and in an array of the standard array module otherwise; both give the
+same results.
+"""
+
+import array
+import math
+import operator
+from itertools import repeat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""The module storing the elements of arrays ("numpy" or "array")."""
+BACKEND = "numpy" if numpy is not None else "array"
+
+"""The symbols of the operators, for error messages."""
+SYMBOLS = {
+    operator.add: "+",
+    operator.sub: "-",
+    operator.mul: "*",
+    operator.truediv: "/",
+    operator.mod: "%",
+    operator.pow: "**",
+    operator.eq: "=",
+    operator.ne: "<>",
+    operator.lt: "<",
+    operator.le: "<=",
+    operator.gt: ">",
+    operator.ge: ">=",
+}
+
+"""The operators that compare their operands."""
+COMPARISONS = {operator.eq, operator.ne, operator.lt,
+               operator.le, operator.gt, operator.ge}
+
+
+def _pow(base, exponent):
+    # the power of two floats, as NumPy computes it: an overflow is infinite,
+    # and a result that is not a real number is nan
+    try:
+        return math.pow(base, exponent)
+    except OverflowError:
+        odd = exponent % 2 == 1
+        return -math.inf if base < 0 and odd else math.inf
+    except ValueError:
+        if base == 0:  # a negative power of zero
+            odd = exponent % 2 == 1
+            return -math.inf if math.copysign(1, base) < 0 and odd else math.inf
+        return math.nan
+
+
+class Array:
+    """An array of floating-point numbers.
+
+    The arithmetic (+ - * / % **) and comparison (= <> < <= > >=) operators apply
+    to the elements of two arrays of the same length pairwise, or to every element
+    of an array and a number. Comparisons give 1.0 where they hold, and 0.0
+    elsewhere. Division and modulo by zero are errors; other operations follow
+    IEEE 754 arithmetic (e.g. an overflow gives an infinity).
+
+    Arrays are immutable, and have no truth value: a condition must reduce an
+    array to a number first (e.g. with sum()).
+    """
+
+    __slots__ = ("_values",)
+
+    __hash__ = None
+
+    def __init__(self, values=()):
+        """Initialize the Array.
+
+        Args:
+            values (Iterable[float]): The elements of the array.
+        """
+        if numpy is not None:
+            self._values = numpy.array(values, dtype=numpy.float64)
+        else:
+            self._values = array.array("d", values)
+
+    @classmethod
+    def range(cls, count: int) -> "Array":
+        """Create the array of the numbers from 0 to count - 1.
+
+        Args:
+            count (int): The length of the array.
+
+        Returns:
+            Array: The array.
+        """
+        result = cls.__new__(cls)
+        if numpy is not None:
+            result._values = numpy.arange(count, dtype=numpy.float64)
+        else:
+            result._values = array.array("d", range(count))
+        return result
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, index):
+        return float(self._values[index])
+
+    def __iter__(self):
+        return iter(self._values.tolist())
+
+    def __repr__(self):
+        return f"array({' '.join(repr(value) for value in self)})"
+
+    def __bool__(self):
+        raise Exception("The truth value of an array is ambiguous")
+
+    def sum(self) -> float:
+        """Add the elements of the array.
+
+        Returns:
+            float: The sum, correctly rounded (so it does not depend on the order
+                of the elements).
+        """
+        return math.fsum(self._values.tolist() if numpy is not None else self._values)
+
+    def __neg__(self):
+        result = Array.__new__(Array)
+        result._values = -self._values if numpy is not None else array.array(
+            "d", map(operator.neg, self._values))
+        return result
+
+    def _apply(self, function, lhs, rhs):
+        # apply a binary operator to the elements of two arrays, or of an array
+        # and a number (lhs or rhs is self)
+        operands = []
+        for operand in (lhs, rhs):
+            if isinstance(operand, Array):
+                operands.append(operand._values)
+            elif isinstance(operand, (int, float)):
+                operands.append(float(operand))
+            else:
+                return NotImplemented
+        lhs, rhs = operands
+        if not isinstance(lhs, float) and not isinstance(rhs, float) and len(lhs) != len(rhs):
+            raise Exception(f"Cannot apply '{SYMBOLS[function]}' to arrays of lengths "
+                            f"{len(lhs)} and {len(rhs)}")
+        if function in (operator.truediv, operator.mod) and (
+                rhs == 0 if isinstance(rhs, float) else 0.0 in rhs):
+            raise ZeroDivisionError("division by zero")
+
+        result = Array.__new__(Array)
+        if numpy is not None:
+            with numpy.errstate(all="ignore"):
+                values = function(lhs, rhs)
+            if function in COMPARISONS:
+                values = values.astype(numpy.float64)
+            result._values = values
+            return result
+
+        if function is operator.pow:
+            function = _pow
+        count = len(lhs) if not isinstance(lhs, float) else len(rhs)
+        result._values = array.array("d", map(
+            function,
+            repeat(lhs, count) if isinstance(lhs, float) else lhs,
+            repeat(rhs, count) if isinstance(rhs, float) else rhs))
+        return result
+
+    def __add__(self, other):
+        return self._apply(operator.add, self, other)
+
+    def __radd__(self, other):
+        return self._apply(operator.add, other, self)
+
+    def __sub__(self, other):
+        return self._apply(operator.sub, self, other)
+
+    def __rsub__(self, other):
+        return self._apply(operator.sub, other, self)
+
+    def __mul__(self, other):
+        return self._apply(operator.mul, self, other)
+
+    def __rmul__(self, other):
+        return self._apply(operator.mul, other, self)
+
+    def __truediv__(self, other):
+        return self._apply(operator.truediv, self, other)
+
+    def __rtruediv__(self, other):
+        return self._apply(operator.truediv, other, self)
+
+    def __mod__(self, other):
+        return self._apply(operator.mod, self, other)
+
+    def __rmod__(self, other):
+        return self._apply(operator.mod, other, self)
+
+    def __pow__(self, other):
+        return self._apply(operator.pow, self, other)
+
+    def __rpow__(self, other):
+        return self._apply(operator.pow, other, self)
+
+    # a number compared with an array is the reflected comparison (e.g. 1 < a is
+    # a > 1), so comparisons need no reflected methods
+    def __eq__(self, other):
+        return self._apply(operator.eq, self, other)
+
+    def __ne__(self, other):
+        return self._apply(operator.ne, self, other)
+
+    def __lt__(self, other):
+        return self._apply(operator.lt, self, other)
+
+    def __le__(self, other):
+        return self._apply(operator.le, self, other)
+
+    def __gt__(self, other):
+        return self._apply(operator.gt, self, other)
+
+    def __ge__(self, other):
+        return self._apply(operator.ge, self, other)
@@ -12,8 +12,13 @@ class AST(ABC):
 
     This class is used to represent the abstract syntax tree of a BLAST
     program.  It is used by the parser and the interpreter.
+
+    Every node declares its fields in __slots__, so nodes have no __dict__ and
+    take as little memory as possible.
     """
 
+    __slots__ = ()
+
     def __repr__(self):
         raise NotImplementedError("Cannot repr a base AST node")
 
@@ -32,18 +37,21 @@ class AST(ABC):
 class ExprAST(AST):
     """Base class for all expression AST nodes.
     """
-    pass
+
+    __slots__ = ()
 
 
 class BinaryExprAST(ExprAST):
     """AST node representing a binary expression.
     """
 
+    __slots__ = ("op", "lhs", "rhs")
+
     def __init__(self, op, lhs, rhs):
         """Initialize a BinaryExprAST.
 
         Args:
-            op (Token): The operator.
+            op (TokenType): The type of the operator.
             lhs (ExprAST): The left-hand side expression.
             rhs (ExprAST): The right-hand side expression.
         """
@@ -70,11 +78,13 @@ class UnaryExprAST(ExprAST):
     """AST node representing a unary expression.
     """
 
+    __slots__ = ("op", "expr")
+
     def __init__(self, op, expr):
         """Initialize a UnaryExprAST.
 
         Args:
-            op (Token): The operator.
+            op (TokenType): The type of the operator.
             expr (ExprAST): The expression.
         """
         self.op = op
@@ -99,6 +109,8 @@ class NumberExprAST(ExprAST):
     """AST node representing a number.
     """
 
+    __slots__ = ("val",)
+
     def __init__(self, val):
         """Initialize a NumberExprAST.
 
@@ -126,6 +138,8 @@ class StringExprAST(ExprAST):
     """AST node representing a string.
     """
 
+    __slots__ = ("val",)
+
     def __init__(self, val):
         """Initialize a StringExprAST.
 
@@ -153,6 +167,8 @@ class VariableExprAST(ExprAST):
     """AST node representing a variable.
     """
 
+    __slots__ = ("name", "slot")
+
     def __init__(self, name):
         """Initialize a VariableExprAST.
 
@@ -160,6 +176,7 @@ class VariableExprAST(ExprAST):
             name (str): The name of the variable.
         """
         self.name = name
+        self.slot = None  # set by the resolver, for variables local to a routine
 
     def __repr__(self):
         return f"<{self.name!r}>"
@@ -180,6 +197,8 @@ class CallExprAST(ExprAST):
     """AST node representing a function call.
     """
 
+    __slots__ = ("name", "args")
+
     def __init__(self, name, args):
         """Initialize a CallExprAST.
 
@@ -207,21 +226,39 @@ class CallExprAST(ExprAST):
 
 class StmtAST(AST):
     """Base class for all statement AST nodes.
+
+    A statement stores the offset it starts at in the source code, and the line
+    index of the source code; its line is only looked up when asked for (e.g. by
+    the profiler, or to report an error).
     """
-    pass
+
+    __slots__ = ()
+
+    @property
+    def line(self):
+        """int?: The line the statement starts at in the source code, if known."""
+        if self.start is None or self.lines is None:
+            return None
+        return self.lines.line(self.start)
 
 
 class ExprStmtAST(StmtAST):
     """AST node representing an expression statement.
     """
 
-    def __init__(self, expr):
+    __slots__ = ("expr", "start", "lines")
+
+    def __init__(self, expr, start=None, lines=None):
         """Initialize an ExprStmtAST.
 
         Args:
             expr (ExprAST): The expression.
+            start (int?): The offset the statement starts at in the source code.
+            lines (LineIndex?): The line index of the source code.
         """
         self.expr = expr
+        self.start = start
+        self.lines = lines
 
     def __repr__(self):
         return f"<{self.expr!r}>"
@@ -242,13 +279,19 @@ class BlockStmtAST(StmtAST):
     """AST node representing a block statement.
     """
 
-    def __init__(self, stmts):
+    __slots__ = ("stmts", "start", "lines")
+
+    def __init__(self, stmts, start=None, lines=None):
         """Initialize a BlockStmtAST.
 
         Args:
             stmts (list[StmtAST]): The statements in the block.
+            start (int?): The offset the statement starts at in the source code.
+            lines (LineIndex?): The line index of the source code.
         """
         self.stmts = stmts
+        self.start = start
+        self.lines = lines
 
     def __repr__(self):
         return f"<{self.stmts!r}>"
@@ -269,7 +312,9 @@ class IfStmtAST(StmtAST):
     """AST node representing an if statement.
     """
 
-    def __init__(self, cond, then_block, else_block):
+    __slots__ = ("cond", "then_block", "else_block", "start", "lines")
+
+    def __init__(self, cond, then_block, else_block, start=None, lines=None):
         """Initialize an IfStmtAST.
 
         Args:
@@ -278,10 +323,14 @@ class IfStmtAST(StmtAST):
                 true.
             else_block (StmtAST): The block to execute if the condition is
                 false.
+            start (int?): The offset the statement starts at in the source code.
+            lines (LineIndex?): The line index of the source code.
         """
         self.cond = cond
         self.then_block = then_block
         self.else_block = else_block
+        self.start = start
+        self.lines = lines
 
     def __repr__(self):
         return f"<{self.cond!r} {self.then_block!r} {self.else_block!r}>"
@@ -302,15 +351,22 @@ class WhileStmtAST(StmtAST):
     """AST node representing a while statement.
     """
 
-    def __init__(self, cond, body):
+    # the code the engines compile from a loop is cached by weak reference to it
+    __slots__ = ("cond", "body", "start", "lines", "__weakref__")
+
+    def __init__(self, cond, body, start=None, lines=None):
         """Initialize a WhileStmtAST.
 
         Args:
             cond (ExprAST): The condition.
             body (StmtAST): The body of the loop.
+            start (int?): The offset the statement starts at in the source code.
+            lines (LineIndex?): The line index of the source code.
         """
         self.cond = cond
         self.body = body
+        self.start = start
+        self.lines = lines
 
     def __repr__(self):
         return f"<{self.cond!r} {self.body!r}>"
@@ -331,17 +387,27 @@ class RoutineStmtAST(StmtAST):
     """AST node representing a function declaration.
     """
 
-    def __init__(self, name, args, body):
+    # the code the engines compile from a routine is cached by weak reference to it
+    __slots__ = ("name", "args", "body", "layout", "size", "live", "start", "lines", "__weakref__")
+
+    def __init__(self, name, args, body, start=None, lines=None):
         """Initialize a FuncStmtAST.
 
         Args:
             name (str): The name of the function.
             args (list[str]): The arguments to the function.
             body (StmtAST): The body of the function.
+            start (int?): The offset the statement starts at in the source code.
+            lines (LineIndex?): The line index of the source code.
         """
         self.name = name
         self.args = args
         self.body = body
+        self.layout = None  # the slots of the local variables, set by the resolver
+        self.size = 0  # the number of slots
+        self.live = 0  # the first statement whose value may be the value, set by the resolver
+        self.start = start
+        self.lines = lines
 
     def __repr__(self):
         return f"<{self.name!r} {self.args!r} {self.body!r}>"
@@ -356,3 +422,36 @@ class RoutineStmtAST(StmtAST):
             Any: The result of the visitor's visit_func_stmt method.
         """
         return visitor.visit_routine_stmt(self)
+
+
+class ReturnStmtAST(StmtAST):
+    """AST node representing a return statement.
+    """
+
+    __slots__ = ("value", "start", "lines")
+
+    def __init__(self, value, start=None, lines=None):
+        """Initialize a ReturnStmtAST.
+
+        Args:
+            value (ExprAST?): The value to return, if any.
+            start (int?): The offset the statement starts at in the source code.
+            lines (LineIndex?): The line index of the source code.
+        """
+        self.value = value
+        self.start = start
+        self.lines = lines
+
+    def __repr__(self):
+        return f"<return {self.value!r}>"
+
+    def accept(self, visitor):
+        """Accept a visitor.
+
+        Args:
+            visitor (Any): The visitor to accept.
+
+        Returns:
+            Any: The result of the visitor's visit_return_stmt method.
+        """
+        return visitor.visit_return_stmt(self)
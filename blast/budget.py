@@ -0,0 +1,321 @@
+"""Execution budgets for the BLAST language.
+
+This module contains the Budget class, which holds the limits of the resources an
+evaluation may use, the Meter class, which measures what an evaluation uses while
+it runs on the virtual machine, and the BudgetExceeded error, which is raised when
+an evaluation goes over one of its limits.
+"""
+
+import operator
+import time
+from .arrays import Array
+from .builtins import Builtin, builtin
+from .compiler import BINARY_OPERATORS, Compiler
+
+"""The integers from which a value is large enough to be counted (see _size())."""
+LARGE = 1 << 72
+
+"""The approximate number of bytes of an item of a list (a pointer)."""
+ITEM = 8
+
+"""The approximate number of bytes of the frame of a routine call on the virtual
+machine, besides its slots."""
+FRAME = 512
+
+"""The number of bytes of a value from which the operation creating or reading it
+takes long enough for the time to be checked after it."""
+WORK = 1 << 16
+
+"""The functions of the operators whose value may be much larger than their operands."""
+GROWING = {operator.add, operator.mul, operator.pow}
+
+
+def _size(value):
+    # the approximate number of bytes of a value; numbers that fit in a machine
+    # word are not counted, as no program can exhaust memory with them alone
+    kind = type(value)
+    if kind is str:
+        return len(value)
+    if kind is int:
+        return value.bit_length() // 8 if not -LARGE < value < LARGE else 0
+    if kind is Array:
+        return 8 * len(value)
+    if kind is list:
+        return ITEM * len(value)
+    return 0
+
+
+def _estimate(function, lhs, rhs):
+    # the approximate size of the value of the operations whose value may be much
+    # larger than their operands, before they run
+    if function is operator.add:
+        if type(lhs) is str and type(rhs) is str:
+            return len(lhs) + len(rhs)
+        if type(lhs) is list and type(rhs) is list:
+            return ITEM * (len(lhs) + len(rhs))
+    elif function is operator.mul:
+        if type(lhs) is str and type(rhs) is int:
+            return len(lhs) * max(rhs, 0)
+        if type(lhs) is int and type(rhs) is str:
+            return max(lhs, 0) * len(rhs)
+        if type(lhs) is list and type(rhs) is int:
+            return ITEM * len(lhs) * max(rhs, 0)
+        if type(lhs) is int and type(rhs) is list:
+            return ITEM * max(lhs, 0) * len(rhs)
+        if type(lhs) is int and type(rhs) is int:
+            return _size(lhs) + _size(rhs)
+    elif function is operator.pow:
+        if type(lhs) is int and type(rhs) is int and rhs > 0:
+            return lhs.bit_length() * rhs // 8
+    return 0
+
+
+class BudgetExceeded(Exception):
+    """The error raised when an evaluation goes over its budget.
+
+    Attributes:
+        resource (str): The resource whose limit was exceeded ("steps", "seconds"
+            or "memory").
+        limit (float): The limit of the resource.
+        usage (dict[str, float]): What the evaluation had used of every resource
+            when it was stopped, by name (see Meter.usage()).
+    """
+
+    def __init__(self, resource: str, limit: float, usage: dict):
+        """Initialize the BudgetExceeded.
+
+        Args:
+            resource (str): The resource whose limit was exceeded.
+            limit (float): The limit of the resource.
+            usage (dict[str, float]): What the evaluation had used.
+        """
+        super().__init__(
+            f"Budget exceeded: {resource} over the limit of {limit} (used {usage['steps']} steps, "
+            f"{usage['seconds']:.3f} seconds, {usage['memory']} bytes)")
+        self.resource = resource
+        self.limit = limit
+        self.usage = usage
+
+
+class Budget:
+    """The limits of the resources an evaluation may use.
+
+    The resources are:
+        - steps: the number of loop iterations and routine calls, which are all a
+          program can repeat without bound
+        - seconds: the wall-clock time of the evaluation
+        - memory: the approximate number of bytes of the strings, arrays, lists
+          and large integers the program creates, in total (a list counts 8 bytes
+          per item, including the lists of the values of blocks and loops), and of
+          the frames of the routine calls running
+
+    Operations that would create a value too large for the memory left fail before
+    they run, so a program cannot exhaust memory with a single operation (e.g.
+    by repeating a string).
+    """
+
+    __slots__ = ("steps", "seconds", "memory")
+
+    def __init__(self, steps: int = None, seconds: float = None, memory: int = None):
+        """Initialize the Budget.
+
+        Args:
+            steps (int?): The number of steps allowed, or None for no limit.
+            seconds (float?): The number of seconds allowed, or None for no limit.
+            memory (int?): The number of bytes allowed, or None for no limit.
+        """
+        self.steps = steps
+        self.seconds = seconds
+        self.memory = memory
+
+    def __repr__(self):
+        return f"Budget(steps={self.steps}, seconds={self.seconds}, memory={self.memory})"
+
+
+class Meter:
+    """The use of a Budget by one evaluation.
+
+    The virtual machine counts the steps of a run, and suspends it regularly (see
+    VM.steps()); the steps and the time are checked at every suspension, with
+    spend(). The memory is checked as values are created, by the operators and
+    builtin functions of the meter, which the code of the run is compiled with,
+    as the values of blocks and loops are appended to their lists, and as the
+    virtual machine enters the frames of routine calls. The operators and builtin
+    functions also check the time after they handle a large value, as a single
+    one of them may take long.
+    """
+
+    def __init__(self, budget: Budget, clock=time.perf_counter):
+        """Initialize the Meter.
+
+        Args:
+            budget (Budget): The budget of the evaluation.
+            clock (Callable[[], float]): The clock measuring the time, in seconds.
+        """
+        self.budget = budget
+        self.steps = 0
+        self.memory = 0
+        self._clock = clock
+        self._start = clock()
+        self.operators = {token: self._operator(function)
+                          for token, function in BINARY_OPERATORS.items()}
+
+    def usage(self) -> dict:
+        """Get what the evaluation has used so far.
+
+        Returns:
+            dict[str, float]: The number of steps (as of the last check), seconds
+                and bytes used.
+        """
+        return {"steps": self.steps, "seconds": self._clock() - self._start,
+                "memory": self.memory}
+
+    def chunk(self, quantum: int) -> int:
+        """Get the number of steps to run before the next check.
+
+        Args:
+            quantum (int): The largest number of steps between two checks.
+
+        Returns:
+            int: The number of steps, which is one more than the steps left if
+                fewer are left, so that the step going over the budget is caught.
+        """
+        if self.budget.steps is None:
+            return quantum
+        return max(1, min(quantum, self.budget.steps - self.steps + 1))
+
+    def spend(self, steps: int):
+        """Count steps that have run, and check the steps and the time used.
+
+        Args:
+            steps (int): The number of steps run since the last check.
+
+        Raises:
+            BudgetExceeded: Too many steps have run, or the time is up.
+        """
+        self.steps += steps
+        budget = self.budget
+        if budget.steps is not None and self.steps > budget.steps:
+            raise BudgetExceeded("steps", budget.steps, self.usage())
+        self.check_time()
+
+    def check_time(self):
+        """Check the time used.
+
+        Raises:
+            BudgetExceeded: The time is up.
+        """
+        budget = self.budget
+        if budget.seconds is not None and self._clock() - self._start > budget.seconds:
+            raise BudgetExceeded("seconds", budget.seconds, self.usage())
+
+    def allocate(self, size: int):
+        """Count the memory of a new value.
+
+        Args:
+            size (int): The approximate number of bytes of the value.
+
+        Raises:
+            BudgetExceeded: The memory used goes over the budget.
+        """
+        self.memory += size
+        if self.budget.memory is not None and self.memory > self.budget.memory:
+            raise BudgetExceeded("memory", self.budget.memory, self.usage())
+
+    def enter(self, size: int) -> int:
+        """Count the memory of the frame of a routine call, until it returns.
+
+        Args:
+            size (int): The number of slots of the frame.
+
+        Returns:
+            int: The approximate number of bytes of the frame, to release() when
+                the call returns.
+
+        Raises:
+            BudgetExceeded: The memory used goes over the budget.
+        """
+        size = FRAME + ITEM * size
+        self.allocate(size)
+        return size
+
+    def release(self, size: int):
+        """Stop counting memory that was freed (e.g. the frame of a call).
+
+        Args:
+            size (int): The approximate number of bytes freed.
+        """
+        self.memory -= size
+
+    def reserve(self, size: int):
+        """Check that a value can be created, before it is.
+
+        Args:
+            size (int): The approximate number of bytes of the value.
+
+        Raises:
+            BudgetExceeded: The value would not fit in the memory left.
+        """
+        if self.budget.memory is not None and self.memory + size > self.budget.memory:
+            usage = self.usage()
+            usage["memory"] += size
+            raise BudgetExceeded("memory", self.budget.memory, usage)
+
+    def compiler(self) -> Compiler:
+        """Create a compiler for the code of the evaluation.
+
+        Returns:
+            Compiler: A compiler whose code creates values with the operators of
+                the meter.
+        """
+        return Compiler(self.operators, self._append)
+
+    def builtin(self, name: str, argc: int) -> Builtin:
+        """Get the builtin function a call refers to, counting what it creates.
+
+        Args:
+            name (str): The name of the function.
+            argc (int): The number of arguments of the call.
+
+        Returns:
+            Builtin: The builtin function (see blast.builtins.builtin()).
+        """
+        func = builtin(name, argc)
+
+        def metered(*args):
+            if func.name == "range" and type(args[0]) is int:
+                self.reserve(8 * args[0])
+            value = func(*args)
+            size = _size(value)
+            self.allocate(size)
+            if size >= WORK or any(_size(arg) >= WORK for arg in args):
+                self.check_time()
+            return value
+        return Builtin(func.name, metered, func.argc)
+
+    def _operator(self, function):
+        # wrap the function of a binary operator to count the values it creates
+        growing = function in GROWING
+
+        def metered(lhs, rhs):
+            if growing:
+                estimate = _estimate(function, lhs, rhs)
+                if estimate:
+                    self.reserve(estimate)
+            value = function(lhs, rhs)
+            kind = type(value)
+            if kind is str or kind is Array or kind is list or kind is int and not -LARGE < value < LARGE:
+                size = _size(value)
+                self.allocate(size)
+                if size >= WORK:
+                    self.check_time()
+            return value
+        return metered
+
+    def _append(self, value, results):
+        # append the value of a statement or iteration to the list of the values
+        # of its block or loop, counting the item
+        if value is not None:
+            self.allocate(ITEM)
+            results.append(value)
+        return results
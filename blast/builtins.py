@@ -0,0 +1,109 @@
+"""Builtin functions of the BLAST language.
+
+This module contains the Builtin class, which represents the functions built into
+the language, and the builtin() function, which is used by every engine to find
+the builtin function a call refers to. A call refers to a builtin function only if
+no routine has its name, so programs can still define routines of the same names.
+
+print() is not a builtin function: it is compiled specially by every engine, and
+cannot be redefined.
+"""
+
+from .arrays import Array
+
+
+class Builtin:
+    """A function built into the BLAST language."""
+
+    __slots__ = ("name", "function", "argc")
+
+    def __init__(self, name: str, function, argc: int = None):
+        """Initialize the Builtin.
+
+        Args:
+            name (str): The name of the function.
+            function (Callable): The Python function implementing it.
+            argc (int?): The number of arguments it takes, or None if it takes any
+                number.
+        """
+        self.name = name
+        self.function = function
+        self.argc = argc
+
+    def __repr__(self):
+        return f"<builtin {self.name}>"
+
+    def __call__(self, *args):
+        return self.function(*args)
+
+
+def _number(value, name):
+    # check that a value is a number (the comparisons give booleans)
+    if type(value) not in (int, float, bool):
+        raise Exception(f"Invalid argument for function '{name}': expected a number, got {value!r}")
+    return value
+
+
+def _array(*values):
+    return Array([_number(value, "array") for value in values])
+
+
+def _range(count):
+    if type(count) is not int or count < 0:
+        raise Exception(f"Invalid argument for function 'range': expected a length, got {count!r}")
+    return Array.range(count)
+
+
+def _len(value):
+    if not isinstance(value, (Array, str)):
+        raise Exception(f"Invalid argument for function 'len': expected an array or a string, got {value!r}")
+    return len(value)
+
+
+def _at(value, index):
+    if not isinstance(value, (Array, str)):
+        raise Exception(f"Invalid argument for function 'at': expected an array or a string, got {value!r}")
+    if type(index) is not int:
+        raise Exception(f"Invalid argument for function 'at': expected an index, got {index!r}")
+    if not 0 <= index < len(value):
+        raise Exception(f"Index out of range: {index}")
+    return value[index]
+
+
+def _sum(value):
+    if not isinstance(value, Array):
+        raise Exception(f"Invalid argument for function 'sum': expected an array, got {value!r}")
+    return value.sum()
+
+
+"""The builtin functions, by name."""
+BUILTINS = {builtin.name: builtin for builtin in (
+    Builtin("array", _array),  # array(x y ...): the array of the numbers given
+    Builtin("range", _range, 1),  # range(n): the array of 0 to n - 1
+    Builtin("len", _len, 1),  # len(a): the length of an array or a string
+    Builtin("at", _at, 2),  # at(a i): the element of an array (or string) at index i
+    Builtin("sum", _sum, 1),  # sum(a): the sum of the elements of an array
+)}
+
+
+def builtin(name: str, argc: int) -> Builtin:
+    """Get the builtin function a call refers to, when no routine has its name.
+
+    Args:
+        name (str): The name of the function.
+        argc (int): The number of arguments of the call.
+
+    Returns:
+        Builtin: The builtin function.
+
+    Raises:
+        Exception: No builtin function has the name, or it does not take argc
+            arguments.
+    """
+    func = BUILTINS.get(name)
+    if func is None:
+        raise Exception(f"Undefined function '{name}'")
+    if func.argc is not None and func.argc != argc:
+        raise Exception(
+            f"Invalid number of arguments for function '{name}': expected {func.argc}, got {argc}")
+    return func
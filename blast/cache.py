@@ -0,0 +1,117 @@
+"""On-disk cache of parsed programs for the BLAST language.
+
+This module contains the ProgramCache class, which is used to save the abstract
+syntax tree of a source file to a .blastc file, so that later runs of the same file
+can load it instead of scanning and parsing the source again.
+"""
+
+import hashlib
+import os
+import pickle
+from .ast import AST
+
+"""The bytes every .blastc file starts with."""
+MAGIC = b"BLASTC"
+
+"""The version of the format of .blastc files.
+
+It MUST be increased whenever the AST classes change, so that files written by an
+older version are ignored instead of loaded.
+"""
+FORMAT_VERSION = 7
+
+
+class ProgramCache:
+    """The on-disk cache of parsed programs.
+
+    The tree of a source file is saved next to it (e.g. prog.blast is cached in
+    prog.blastc), or in a cache directory if one is given. A .blastc file is made of
+    a header and the pickled tree; the header holds the format version, the
+    optimization level the tree was optimized at, and the SHA-256 hash of the
+    source. A file is only loaded if its header matches, so an edited source is
+    parsed again.
+
+    Failing to read or write a cache file is not an error: the program is parsed
+    from the source, as if there was no cache.
+
+    Notes:
+        Loading a .blastc file unpickles it, so cache files must be trusted as much
+        as the source files they are created from.
+    """
+
+    def __init__(self, directory: str = None):
+        """Initialize the ProgramCache.
+
+        Args:
+            directory (str?): The directory to write cache files to. If not
+                provided, they are written next to the source files.
+        """
+        self._directory = directory
+
+    def path(self, source_path: str) -> str:
+        """Get the path of the cache file of a source file.
+
+        Args:
+            source_path (str): The path of the source file.
+
+        Returns:
+            str: The path of the cache file.
+        """
+        if self._directory is None:
+            return os.path.splitext(source_path)[0] + ".blastc"
+        # files with the same name in different directories are kept apart
+        digest = hashlib.sha256(os.path.abspath(source_path).encode()).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(source_path))[0]
+        return os.path.join(self._directory, f"{name}.{digest}.blastc")
+
+    def load(self, source_path: str, source: str, optimize: int = 0) -> AST:
+        """Load the cached tree of a source file.
+
+        Args:
+            source_path (str): The path of the source file.
+            source (str): The source code in the file.
+            optimize (int): The optimization level of the tree.
+
+        Returns:
+            AST?: The cached tree, or None if there is no valid cache file.
+        """
+        header = self._header(source, optimize)
+        try:
+            with open(self.path(source_path), "rb") as f:
+                if f.read(len(header)) != header:
+                    return None
+                ast = pickle.load(f)
+        except Exception:
+            return None  # missing, unreadable or corrupt
+        return ast if isinstance(ast, AST) else None
+
+    def store(self, source_path: str, source: str, ast: AST, optimize: int = 0):
+        """Save the tree of a source file to its cache file.
+
+        Args:
+            source_path (str): The path of the source file.
+            source (str): The source code in the file.
+            ast (AST): The tree parsed (and optimized) from the source code, before
+                it runs.
+            optimize (int): The optimization level of the tree.
+        """
+        path = self.path(source_path)
+        try:
+            data = self._header(source, optimize) + pickle.dumps(ast, pickle.HIGHEST_PROTOCOL)
+            directory = os.path.dirname(path) or "."
+            os.makedirs(directory, exist_ok=True)
+            # write to a temporary file first, so a cache file is never partial
+            temp = f"{path}.{os.getpid()}.tmp"
+            try:
+                with open(temp, "wb") as f:
+                    f.write(data)
+                os.replace(temp, path)
+            except BaseException:
+                os.unlink(temp)
+                raise
+        except (OSError, RecursionError, pickle.PicklingError):
+            pass  # e.g. a read-only directory; the cache is only an optimization
+
+    def _header(self, source, optimize):
+        digest = hashlib.sha256(source.encode("utf-8", "surrogatepass")).digest()
+        return MAGIC + FORMAT_VERSION.to_bytes(2, "big") + bytes([optimize & 0xFF]) + digest
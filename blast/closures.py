@@ -0,0 +1,513 @@
+"""Closure compiler for the BLAST language.
+
+This module contains the ClosureCompiler class, which is used to turn an abstract
+syntax tree into nested Python closures. Running the program then only calls the
+closures, without dispatching on the nodes of the tree again.
+"""
+
+from .token import TokenType
+from .ast import *
+from .compiler import BINARY_OPERATORS
+from .symtab import _MISSING, _Return, Frame, SymbolType
+from .resolver import resolve_layout
+from .purity import memo_key
+from .builtins import builtin
+
+"""The binary operators that compare their operands."""
+COMPARISONS = {TokenType.EQ, TokenType.NE, TokenType.LT,
+               TokenType.LE, TokenType.GT, TokenType.GE}
+
+
+def _lookup(symtab, key):
+    # look a variable up in the enclosing symbol tables
+    try:
+        return symtab.get(*key)
+    except KeyError:
+        raise Exception(f"Undefined variable '{key[0]}'")
+
+
+def _returns(stmt):
+    # whether a return statement may leave the routine from within a statement
+    if isinstance(stmt, ReturnStmtAST):
+        return True
+    if isinstance(stmt, BlockStmtAST):
+        return any(_returns(statement) for statement in stmt.stmts)
+    if isinstance(stmt, IfStmtAST):
+        return _returns(stmt.then_block) or bool(stmt.else_block) and _returns(stmt.else_block)
+    if isinstance(stmt, WhileStmtAST):
+        return _returns(stmt.body)
+    return False
+
+
+class ClosureCompiler:
+    """The closure compiler for the BLAST language.
+
+    This class walks the abstract syntax tree once, like the Interpreter does, but
+    instead of evaluating each node it returns a closure that evaluates it. Every
+    closure takes the Execution running the program (see blast.interpreter), whose
+    symbol table holds the state of the program, so compiled closures can be shared
+    between runs and interpreters.
+
+    Common shapes of nodes get specialized closures, e.g. a binary operation on a
+    variable and a constant, or a while loop whose condition is such a comparison.
+    Variables with a slot (see blast.resolver) are read and written by index.
+
+    A return statement evaluates to its value wrapped in a _Return, which the
+    closures of the blocks and loops around it pass up to the routine. Only the
+    closures of statements that contain a return statement check for it.
+    """
+
+    def compile(self, ast: AST, values: bool = True):
+        """Compile an abstract syntax tree into a closure.
+
+        Args:
+            ast (AST): The abstract syntax tree to compile.
+            values (bool): Whether the closure returns the value of the tree. If
+                False, the values of its statements are not kept, and the closure
+                returns None.
+
+        Returns:
+            Callable[[Execution], Any]: The closure, which returns the value of the
+                tree when called with the running Execution.
+        """
+        return ast.accept(self) if values else self._execute(ast)
+
+    def compile_routine(self, stmt: RoutineStmtAST):
+        """Compile the body of a routine.
+
+        Args:
+            stmt (RoutineStmtAST): The routine to compile.
+
+        Returns:
+            Callable[[Execution], Any]: The closure running the body, which returns
+                the value of the routine (the last value of the body that is not
+                None).
+        """
+        resolve_layout(stmt)
+        # the statements before stmt.live cannot give the value of the routine
+        statements = stmt.body.stmts
+        executed = tuple(self._execute(statement) for statement in statements[:stmt.live])
+        evaluated = tuple(statement.accept(self) for statement in statements[stmt.live:])
+
+        if _returns(stmt.body):
+            def body(interp):
+                for statement in executed:
+                    result = statement(interp)
+                    if type(result) is _Return:
+                        return result.value
+                value = None
+                for statement in evaluated:
+                    result = statement(interp)
+                    if result is not None:
+                        if type(result) is _Return:
+                            return result.value
+                        value = result
+                return value
+            return body
+
+        def body(interp):
+            for statement in executed:
+                statement(interp)
+            value = None
+            for statement in evaluated:
+                result = statement(interp)
+                if result is not None:
+                    value = result
+            return value
+        return body
+
+    def _execute(self, stmt):
+        # compile a statement whose value is not needed, without building the lists
+        # of the values of its blocks and loops
+        if isinstance(stmt, BlockStmtAST):
+            statements = tuple(self._execute(statement) for statement in stmt.stmts)
+            if len(statements) == 1:
+                return statements[0]
+
+            if _returns(stmt):
+                def block(interp):
+                    for statement in statements:
+                        result = statement(interp)
+                        if type(result) is _Return:
+                            return result
+                return block
+
+            def block(interp):
+                for statement in statements:
+                    statement(interp)
+            return block
+        if isinstance(stmt, IfStmtAST):
+            cond = stmt.cond.accept(self)
+            then_block = self._execute(stmt.then_block)
+            else_block = self._execute(stmt.else_block) if stmt.else_block else None
+
+            def if_stmt(interp):
+                # the value of a branch only matters if it is a _Return
+                if cond(interp):
+                    return then_block(interp)
+                elif else_block is not None:
+                    return else_block(interp)
+            return if_stmt
+        if isinstance(stmt, WhileStmtAST):
+            return self._loop(stmt, self._execute(stmt.body), False)
+        return stmt.accept(self)
+
+    def _operand(self, expr):
+        # returns ("const", value), ("slot", (slot, key)), ("var", key) or ("any", closure)
+        if isinstance(expr, (NumberExprAST, StringExprAST)):
+            return "const", expr.val
+        if isinstance(expr, VariableExprAST):
+            if expr.slot is not None:
+                return "slot", (expr.slot, (expr.name, SymbolType.VARIABLE))
+            return "var", (expr.name, SymbolType.VARIABLE)
+        return "any", expr.accept(self)
+
+    def visit_binary_expr(self, expr: BinaryExprAST):
+        if expr.op == TokenType.COLON:
+            return self._assignment(expr)
+
+        function = BINARY_OPERATORS[expr.op]
+        lhs_kind, lhs = self._operand(expr.lhs)
+        rhs_kind, rhs = self._operand(expr.rhs)
+
+        if lhs_kind == "slot" and rhs_kind == "const":
+            slot, key = lhs
+
+            def binary(interp):
+                symtab = interp._symtab
+                value = symtab.slots[slot]
+                if value is _MISSING:
+                    value = _lookup(symtab, key)
+                return function(value, rhs)
+            return binary
+
+        # other local variables are read by the closures of _evaluator()
+        if lhs_kind == "slot":
+            lhs_kind, lhs = "any", self._evaluator(lhs_kind, lhs)
+        if rhs_kind == "slot":
+            rhs_kind, rhs = "any", self._evaluator(rhs_kind, rhs)
+
+        if lhs_kind == "var" and rhs_kind == "const":
+            def binary(interp):
+                symtab = interp._symtab
+                value = symtab._symbols.get(lhs, _MISSING)
+                if value is _MISSING:
+                    value = _lookup(symtab, lhs)
+                return function(value, rhs)
+        elif lhs_kind == "var" and rhs_kind == "var":
+            def binary(interp):
+                symtab = interp._symtab
+                symbols = symtab._symbols
+                # right-hand side first, as the interpreter does
+                right = symbols.get(rhs, _MISSING)
+                if right is _MISSING:
+                    right = _lookup(symtab, rhs)
+                left = symbols.get(lhs, _MISSING)
+                if left is _MISSING:
+                    left = _lookup(symtab, lhs)
+                return function(left, right)
+        elif lhs_kind == "var":
+            def binary(interp):
+                right = rhs(interp)
+                symtab = interp._symtab
+                left = symtab._symbols.get(lhs, _MISSING)
+                if left is _MISSING:
+                    left = _lookup(symtab, lhs)
+                return function(left, right)
+        elif lhs_kind == "const" and rhs_kind == "const":
+            def binary(interp):
+                return function(lhs, rhs)
+        elif lhs_kind == "const":
+            evaluate_rhs = self._evaluator(rhs_kind, rhs)
+
+            def binary(interp):
+                return function(lhs, evaluate_rhs(interp))
+        else:
+            evaluate_rhs = self._evaluator(rhs_kind, rhs)
+
+            def binary(interp):
+                right = evaluate_rhs(interp)
+                return function(lhs(interp), right)
+        return binary
+
+    def _evaluator(self, kind, operand):
+        # turn an operand from _operand() back into a closure
+        if kind == "any":
+            return operand
+        if kind == "const":
+            return lambda interp: operand
+        if kind == "slot":
+            slot, key = operand
+
+            def local(interp):
+                symtab = interp._symtab
+                value = symtab.slots[slot]
+                if value is _MISSING:
+                    value = _lookup(symtab, key)
+                return value
+            return local
+
+        def variable(interp):
+            symtab = interp._symtab
+            value = symtab._symbols.get(operand, _MISSING)
+            if value is _MISSING:
+                value = _lookup(symtab, operand)
+            return value
+        return variable
+
+    def _assignment(self, expr):
+        rhs = expr.rhs.accept(self)
+        if not isinstance(expr.lhs, VariableExprAST):
+            def assignment(interp):
+                rhs(interp)
+                raise Exception("Invalid assignment target")
+            return assignment
+
+        slot = expr.lhs.slot
+        if slot is not None:
+            def assignment(interp):
+                value = rhs(interp)
+                # if value is None, throw an error (can't assign None)
+                if value is None:
+                    raise Exception("Cannot assign None")
+                interp._symtab.slots[slot] = value
+                return value  # return the value assigned (for chaining)
+            return assignment
+
+        key = (expr.lhs.name, SymbolType.VARIABLE)
+
+        def assignment(interp):
+            value = rhs(interp)
+            # if value is None, throw an error (can't assign None)
+            if value is None:
+                raise Exception("Cannot assign None")
+            interp._symtab._symbols[key] = value
+            return value  # return the value assigned (for chaining)
+        return assignment
+
+    def visit_unary_expr(self, expr: UnaryExprAST):
+        operand = expr.expr.accept(self)
+        if expr.op == TokenType.MINUS:
+            return lambda interp: -operand(interp)
+        return operand
+
+    def visit_number_expr(self, expr: NumberExprAST):
+        value = expr.val
+        return lambda interp: value
+
+    def visit_string_expr(self, expr: StringExprAST):
+        value = expr.val
+        return lambda interp: value
+
+    def visit_variable_expr(self, expr: VariableExprAST):
+        return self._evaluator(*self._operand(expr))
+
+    def visit_call_expr(self, expr: CallExprAST):
+        args = [arg.accept(self) for arg in expr.args]
+
+        if expr.name == "print":
+            def call(interp):
+                print(*[arg(interp) for arg in args], sep=" ")
+            return call
+
+        name = expr.name
+        argc = len(args)
+        compile_routine = self.compile_routine
+
+        def call(interp):
+            symtab = interp._symtab
+            try:
+                func = symtab.get(name, SymbolType.FUNCTION)
+            except KeyError:
+                # no routine has the name; it may be a builtin function
+                return builtin(name, argc)(*[arg(interp) for arg in args])
+            if len(func.args) != argc:
+                raise Exception(
+                    f"Invalid number of arguments for function '{name}': expected {len(func.args)}, got {argc}")
+
+            values = [arg(interp) for arg in args]
+            key = None
+            if interp._memos:
+                # a pure routine may have been called with the same args already
+                memo = interp._memos.get(func)
+                if memo is not None:
+                    key = memo_key(values)
+                    if key is not None:
+                        value = memo.lookup(key)
+                        if value is not _MISSING:
+                            return value
+
+            layout = func.layout if func.layout is not None else resolve_layout(func)
+            callee = Frame(symtab, layout, func.size, values)
+
+            body = interp._closures.get(func)
+            if body is None:
+                body = interp._closure(func, compile_routine)
+
+            interp._symtab = callee
+            try:
+                result = body(interp)
+            finally:
+                interp._symtab = symtab
+            if key is not None:
+                memo.store(key, result)
+            return result
+        return call
+
+    def visit_expr_stmt(self, stmt: ExprStmtAST):
+        return stmt.expr.accept(self)
+
+    def visit_block_stmt(self, stmt: BlockStmtAST):
+        statements = tuple(statement.accept(self) for statement in stmt.stmts)
+
+        if _returns(stmt):
+            def block(interp):
+                results = []
+                for statement in statements:
+                    value = statement(interp)
+                    if value is not None:
+                        if type(value) is _Return:
+                            return value
+                        results.append(value)
+                return results
+            return block
+
+        def block(interp):
+            results = []
+            for statement in statements:
+                value = statement(interp)
+                if value is not None:
+                    results.append(value)
+            return results
+        return block
+
+    def visit_if_stmt(self, stmt: IfStmtAST):
+        cond = stmt.cond.accept(self)
+        then_block = stmt.then_block.accept(self)
+        else_block = stmt.else_block.accept(self) if stmt.else_block else None
+
+        def if_stmt(interp):
+            if cond(interp):
+                return then_block(interp)
+            elif else_block is not None:
+                return else_block(interp)
+        return if_stmt
+
+    def visit_while_stmt(self, stmt: WhileStmtAST):
+        return self._loop(stmt, stmt.body.accept(self), True)
+
+    def _loop(self, stmt: WhileStmtAST, body, values):
+        # the closure of a loop, which returns the list of the values of the body
+        # if values is True, and None otherwise (or the _Return of the body)
+        cond = stmt.cond
+
+        if _returns(stmt.body):
+            cond = cond.accept(self)
+
+            def while_stmt(interp):
+                results = [] if values else None
+                while cond(interp):
+                    result = body(interp)
+                    if type(result) is _Return:
+                        return result
+                    if values:
+                        results.append(result)
+                return results
+            return while_stmt
+
+        if (isinstance(cond, BinaryExprAST) and cond.op in COMPARISONS
+                and isinstance(cond.lhs, VariableExprAST)
+                and isinstance(cond.rhs, (NumberExprAST, StringExprAST))):
+            # a comparison of a variable with a constant, evaluated inline
+            function = BINARY_OPERATORS[cond.op]
+            key = (cond.lhs.name, SymbolType.VARIABLE)
+            value = cond.rhs.val
+            slot = cond.lhs.slot
+
+            # a version per kind of variable, and whether the values are kept, so
+            # that an iteration tests nothing else
+            if slot is not None and not values:
+                def while_stmt(interp):
+                    symtab = interp._symtab
+                    # calls in the body restore the symbol table before returning
+                    slots = symtab.slots
+                    while True:
+                        current = slots[slot]
+                        if current is _MISSING:
+                            current = _lookup(symtab, key)
+                        if not function(current, value):
+                            return None
+                        body(interp)
+                return while_stmt
+
+            if slot is not None:
+                def while_stmt(interp):
+                    results = []
+                    append = results.append
+                    symtab = interp._symtab
+                    slots = symtab.slots
+                    while True:
+                        current = slots[slot]
+                        if current is _MISSING:
+                            current = _lookup(symtab, key)
+                        if not function(current, value):
+                            return results
+                        append(body(interp))
+                return while_stmt
+
+            if not values:
+                def while_stmt(interp):
+                    symtab = interp._symtab
+                    symbols = symtab._symbols
+                    while True:
+                        current = symbols.get(key, _MISSING)
+                        if current is _MISSING:
+                            current = _lookup(symtab, key)
+                        if not function(current, value):
+                            return None
+                        body(interp)
+                return while_stmt
+
+            def while_stmt(interp):
+                results = []
+                append = results.append
+                symtab = interp._symtab
+                symbols = symtab._symbols
+                while True:
+                    current = symbols.get(key, _MISSING)
+                    if current is _MISSING:
+                        current = _lookup(symtab, key)
+                    if not function(current, value):
+                        return results
+                    append(body(interp))
+            return while_stmt
+
+        cond = cond.accept(self)
+
+        if not values:
+            def while_stmt(interp):
+                while cond(interp):
+                    body(interp)
+            return while_stmt
+
+        def while_stmt(interp):
+            results = []
+            while cond(interp):
+                results.append(body(interp))
+            return results
+        return while_stmt
+
+    def visit_return_stmt(self, stmt: ReturnStmtAST):
+        if stmt.value is None:
+            return lambda interp: _Return(None)
+        value = stmt.value.accept(self)
+        return lambda interp: _Return(value(interp))
+
+    def visit_routine_stmt(self, stmt: RoutineStmtAST):
+        body = self.compile_routine(stmt)
+        name = stmt.name
+
+        def routine_stmt(interp):
+            interp._closures[stmt] = interp._interpreter._closures[stmt] = body
+            interp._symtab.set(name, SymbolType.FUNCTION, stmt)
+        return routine_stmt
@@ -0,0 +1,373 @@
+"""Bytecode compiler for the BLAST language.
+
+This module contains the Compiler class, which is used to lower an abstract syntax
+tree into bytecode for the virtual machine in blast.vm, and the Code class, which
+represents a unit of compiled bytecode.
+"""
+
+import operator
+from enum import IntEnum, auto
+from .token import TokenType
+from .ast import *
+from .symtab import SymbolType
+from .resolver import resolve_layout
+
+
+class Op(IntEnum):
+    """Enum representing the opcodes of the virtual machine.
+
+    Every instruction is a pair of an opcode and an argument. The comments below
+    describe the argument and the effect of each instruction on the stack.
+    """
+    LOAD_CONST = auto()     # value; push the value
+    LOAD_VAR = auto()       # (name, SymbolType); push the value of the variable
+    STORE_VAR = auto()      # (name, SymbolType); assign the top of the stack
+    LOAD_SLOT = auto()      # (slot, key); push the value of a local variable
+    STORE_SLOT = auto()     # slot; assign the top of the stack to a local variable
+    BINARY = auto()         # function; pop lhs and rhs, push function(lhs, rhs)
+    NEGATE = auto()         # None; negate the top of the stack
+    JUMP = auto()           # target; jump to the target
+    JUMP_IF_FALSE = auto()  # target; pop a value, jump to the target if falsy
+    LOOP = auto()           # target; jump back to the start of a loop
+    NEW_LIST = auto()       # None; push a new, empty result list
+    APPEND = auto()         # None; pop a value, append it to the list below if not None
+    POP = auto()            # None; pop a value and discard it
+    DEFINE = auto()         # (RoutineStmtAST, Code); define a routine
+    FUNCTION = auto()       # (name, argc); push the routine called with argc args
+    CALL = auto()           # argc; pop the args and the routine, push its result
+    TAIL_CALL = auto()      # argc; CALL, returning its result (or the last value so far)
+    PRINT = auto()          # argc; pop and print the args, push None
+    LAST = auto()           # None; replace a result list by its last item (or None)
+    RETURN = auto()         # None; pop a value and return it to the caller
+    FAIL = auto()           # message; raise an error
+
+    # superinstructions, fusing common sequences of the instructions above
+    BINARY_VAR_CONST = auto()  # (function, key, value); push function(variable, value)
+    BINARY_VAR_VAR = auto()    # (function, key, key); push function(variable, variable)
+    STORE_APPEND = auto()      # key; STORE_VAR then APPEND
+    BINARY_SLOT_CONST = auto()  # (function, slot, key, value); BINARY_VAR_CONST on a slot
+    STORE_SLOT_APPEND = auto()  # slot; STORE_SLOT then APPEND
+    STORE_POP = auto()          # key; STORE_VAR then POP
+    STORE_SLOT_POP = auto()     # slot; STORE_SLOT then POP
+
+
+"""A dictionary of binary operators and the functions implementing them."""
+BINARY_OPERATORS = {
+    TokenType.PLUS: operator.add,
+    TokenType.MINUS: operator.sub,
+    TokenType.MUL: operator.mul,
+    TokenType.DIV: operator.truediv,
+    TokenType.MOD: operator.mod,
+    TokenType.EXP: operator.pow,
+    TokenType.EQ: operator.eq,
+    TokenType.NE: operator.ne,
+    TokenType.LT: operator.lt,
+    TokenType.LE: operator.le,
+    TokenType.GT: operator.gt,
+    TokenType.GE: operator.ge,
+}
+
+
+class Code:
+    """Class representing a unit of compiled bytecode.
+
+    A program and every routine in it are compiled into separate Code objects.
+    Code objects are immutable, so they can be shared between runs.
+    """
+
+    __slots__ = ("name", "instructions", "layout", "size")
+
+    def __init__(self, name, instructions, layout=None, size=0):
+        """Initialize a Code object.
+
+        Args:
+            name (str): The name of the routine, or "<program>".
+            instructions (tuple[tuple[int, Any], ...]): The instructions.
+            layout (dict[str, int]?): The slots of the local variables of the
+                routine (see blast.resolver).
+            size (int): The number of slots.
+        """
+        self.name = name
+        self.instructions = instructions
+        self.layout = layout
+        self.size = size
+
+    def __repr__(self):
+        return f"<code {self.name!r}: {len(self.instructions)} instructions>"
+
+    def disassemble(self) -> str:
+        """Return a human-readable listing of the instructions.
+
+        Returns:
+            str: One line per instruction.
+        """
+        lines = []
+        for index, (op, arg) in enumerate(self.instructions):
+            lines.append(f"{index:>4} {Op(op).name:<14} {'' if arg is None else repr(arg)}")
+        return "\n".join(lines)
+
+
+class Compiler:
+    """The bytecode compiler for the BLAST language.
+
+    This class walks the abstract syntax tree and emits instructions for the virtual
+    machine. The instructions evaluate exactly as the Interpreter does: operands are
+    evaluated right to left, and blocks and loops produce lists of the values of
+    their statements, unless their values are not needed.
+    """
+
+    def __init__(self, operators: dict = None, append=None):
+        """Initialize the Compiler.
+
+        Args:
+            operators (dict[TokenType, Callable]?): The functions implementing the
+                binary operators, by token; BINARY_OPERATORS by default.
+            append (Callable[[Any, list], list]?): A function appending a value to
+                a result list unless it is None, and returning the list, which the
+                code calls instead of the APPEND instruction (e.g. to count the
+                values the lists hold).
+        """
+        self._instructions = []
+        self._operators = operators if operators is not None else BINARY_OPERATORS
+        self._append = append
+
+    def compile(self, ast: AST, values: bool = True) -> Code:
+        """Compile a program.
+
+        Args:
+            ast (AST): The abstract syntax tree of the program.
+            values (bool): Whether the program returns its value. If False, the
+                values of its statements are not kept, and it returns None.
+
+        Returns:
+            Code: The compiled program, which returns the value of the program.
+        """
+        self._instructions = []
+        if values:
+            ast.accept(self)
+        else:
+            self._execute(ast)
+            self._emit(Op.LOAD_CONST, None)
+        self._emit(Op.RETURN)
+        return Code("<program>", tuple(self._instructions))
+
+    def compile_routine(self, stmt: RoutineStmtAST) -> Code:
+        """Compile the body of a routine.
+
+        Args:
+            stmt (RoutineStmtAST): The routine to compile.
+
+        Returns:
+            Code: The compiled body, which returns the last value of the body.
+        """
+        layout = resolve_layout(stmt)
+        instructions = self._instructions
+        self._instructions = []
+        # the statements before stmt.live cannot give the value of the routine
+        statements = stmt.body.stmts
+        for statement in statements[:stmt.live]:
+            self._execute(statement)
+        # a tail call returns by itself, unless its value is cached (see VM)
+        self._block(statements[stmt.live:], tail=True)
+        self._emit(Op.LAST)
+        self._emit(Op.RETURN)
+        code = Code(stmt.name, tuple(self._instructions), layout, stmt.size)
+        self._instructions = instructions
+        return code
+
+    def _emit(self, op, arg=None):
+        # append an instruction and return its index (for patching jumps)
+        self._instructions.append((op.value, arg))
+        return len(self._instructions) - 1
+
+    def _patch(self, index, target):
+        # point the jump at index to the target
+        op, _ = self._instructions[index]
+        self._instructions[index] = (op, target)
+
+    def visit_binary_expr(self, expr: BinaryExprAST):
+        # right-hand side first, as the interpreter does
+        expr.rhs.accept(self)
+
+        if expr.op == TokenType.COLON:
+            if not isinstance(expr.lhs, VariableExprAST):
+                self._emit(Op.FAIL, "Invalid assignment target")
+                return
+            if expr.lhs.slot is not None:
+                self._emit(Op.STORE_SLOT, expr.lhs.slot)
+                return
+            self._emit(Op.STORE_VAR, (expr.lhs.name, SymbolType.VARIABLE))
+            return
+
+        function = self._operators[expr.op]
+        if isinstance(expr.lhs, VariableExprAST):
+            # fuse the loads of simple operands into the operation
+            last_op, last_arg = self._instructions[-1]
+            key = (expr.lhs.name, SymbolType.VARIABLE)
+            if isinstance(expr.rhs, (NumberExprAST, StringExprAST)):
+                if expr.lhs.slot is not None:
+                    self._instructions[-1] = (Op.BINARY_SLOT_CONST.value,
+                                              (function, expr.lhs.slot, key, last_arg))
+                    return
+                self._instructions[-1] = (Op.BINARY_VAR_CONST.value, (function, key, last_arg))
+                return
+            if last_op == Op.LOAD_VAR and expr.lhs.slot is None:
+                self._instructions[-1] = (Op.BINARY_VAR_VAR.value, (function, key, last_arg))
+                return
+
+        expr.lhs.accept(self)
+        self._emit(Op.BINARY, function)
+
+    def visit_unary_expr(self, expr: UnaryExprAST):
+        expr.expr.accept(self)
+        if expr.op == TokenType.MINUS:
+            self._emit(Op.NEGATE)
+
+    def visit_number_expr(self, expr: NumberExprAST):
+        self._emit(Op.LOAD_CONST, expr.val)
+
+    def visit_string_expr(self, expr: StringExprAST):
+        self._emit(Op.LOAD_CONST, expr.val)
+
+    def visit_variable_expr(self, expr: VariableExprAST):
+        if expr.slot is not None:
+            self._emit(Op.LOAD_SLOT, (expr.slot, (expr.name, SymbolType.VARIABLE)))
+            return
+        self._emit(Op.LOAD_VAR, (expr.name, SymbolType.VARIABLE))
+
+    def visit_call_expr(self, expr: CallExprAST):
+        if expr.name == "print":
+            for arg in expr.args:
+                arg.accept(self)
+            self._emit(Op.PRINT, len(expr.args))
+            return
+
+        # the routine is looked up (and its arity checked) before the args run
+        self._emit(Op.FUNCTION, (expr.name, len(expr.args)))
+        for arg in expr.args:
+            arg.accept(self)
+        self._emit(Op.CALL, len(expr.args))
+
+    def visit_expr_stmt(self, stmt: ExprStmtAST):
+        stmt.expr.accept(self)
+
+    def visit_block_stmt(self, stmt: BlockStmtAST):
+        self._block(stmt.stmts)
+
+    def _block(self, statements, tail=False):
+        # emit a block; in the body of a routine (tail is True), a call as the last
+        # statement is a tail call
+        self._emit(Op.NEW_LIST)
+        for index, statement in enumerate(statements):
+            if tail and index == len(statements) - 1 and self._tail_call(statement):
+                return
+            statement.accept(self)
+            # routine declarations and return statements leave nothing to append
+            if isinstance(statement, (RoutineStmtAST, ReturnStmtAST)):
+                continue
+            last_op, last_arg = self._instructions[-1]
+            if self._append is not None:
+                self._emit_append()
+            elif last_op == Op.STORE_VAR:
+                self._instructions[-1] = (Op.STORE_APPEND.value, last_arg)
+            elif last_op == Op.STORE_SLOT:
+                self._instructions[-1] = (Op.STORE_SLOT_APPEND.value, last_arg)
+            else:
+                self._emit(Op.APPEND)
+
+    def _emit_append(self):
+        # append the value on the stack to the result list below it; the function
+        # given to the compiler runs as a binary operator on the two, which leaves
+        # the list in their place
+        if self._append is not None:
+            self._emit(Op.BINARY, self._append)
+        else:
+            self._emit(Op.APPEND)
+
+    def _execute(self, stmt):
+        # emit a statement whose value is not needed, without building the lists
+        # of the values of its blocks and loops; it leaves nothing on the stack
+        if isinstance(stmt, ExprStmtAST):
+            stmt.expr.accept(self)
+            last_op, last_arg = self._instructions[-1]
+            if last_op == Op.STORE_VAR:
+                self._instructions[-1] = (Op.STORE_POP.value, last_arg)
+            elif last_op == Op.STORE_SLOT:
+                self._instructions[-1] = (Op.STORE_SLOT_POP.value, last_arg)
+            else:
+                self._emit(Op.POP)
+        elif isinstance(stmt, BlockStmtAST):
+            for statement in stmt.stmts:
+                self._execute(statement)
+        elif isinstance(stmt, IfStmtAST):
+            stmt.cond.accept(self)
+            jump_else = self._emit(Op.JUMP_IF_FALSE)
+            self._execute(stmt.then_block)
+            if stmt.else_block:
+                jump_end = self._emit(Op.JUMP)
+                self._patch(jump_else, len(self._instructions))
+                self._execute(stmt.else_block)
+                self._patch(jump_end, len(self._instructions))
+            else:
+                self._patch(jump_else, len(self._instructions))
+        elif isinstance(stmt, WhileStmtAST):
+            start = len(self._instructions)
+            stmt.cond.accept(self)
+            jump_end = self._emit(Op.JUMP_IF_FALSE)
+            self._execute(stmt.body)
+            self._emit(Op.LOOP, start)
+            self._patch(jump_end, len(self._instructions))
+        else:
+            stmt.accept(self)  # a routine declaration or a return statement
+
+    def _tail_call(self, stmt):
+        # the value of the routine is the value of the call, unless it is None
+        if not (isinstance(stmt, ExprStmtAST) and isinstance(stmt.expr, CallExprAST)
+                and stmt.expr.name != "print"):
+            return False
+        expr = stmt.expr
+        self._emit(Op.FUNCTION, (expr.name, len(expr.args)))
+        for arg in expr.args:
+            arg.accept(self)
+        self._emit(Op.TAIL_CALL, len(expr.args))
+        return True
+
+    def visit_if_stmt(self, stmt: IfStmtAST):
+        stmt.cond.accept(self)
+        jump_else = self._emit(Op.JUMP_IF_FALSE)
+        stmt.then_block.accept(self)
+        jump_end = self._emit(Op.JUMP)
+
+        self._patch(jump_else, len(self._instructions))
+        if stmt.else_block:
+            stmt.else_block.accept(self)
+        else:
+            self._emit(Op.LOAD_CONST, None)
+        self._patch(jump_end, len(self._instructions))
+
+    def visit_while_stmt(self, stmt: WhileStmtAST):
+        self._emit(Op.NEW_LIST)
+        start = len(self._instructions)
+        stmt.cond.accept(self)
+        jump_end = self._emit(Op.JUMP_IF_FALSE)
+        stmt.body.accept(self)
+        self._emit_append()
+        self._emit(Op.LOOP, start)
+        self._patch(jump_end, len(self._instructions))
+
+    def visit_routine_stmt(self, stmt: RoutineStmtAST):
+        self._emit(Op.DEFINE, (stmt, self.compile_routine(stmt)))
+
+    def visit_return_stmt(self, stmt: ReturnStmtAST):
+        # the values on the stack are dropped with the frame of the routine
+        if stmt.value is None:
+            self._emit(Op.LOAD_CONST, None)
+        elif isinstance(stmt.value, CallExprAST) and stmt.value.name != "print":
+            # a tail call, with an empty list of the values so far: the value is the
+            # value of the call, unless it is None (see VM)
+            self._emit(Op.NEW_LIST)
+            self._tail_call(ExprStmtAST(stmt.value))
+            self._emit(Op.LAST)
+        else:
+            stmt.value.accept(self)
+        self._emit(Op.RETURN)
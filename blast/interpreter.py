@@ -1,61 +1,935 @@
 """The interpreter for the BLAST programming language.
 
-This module contains the Interpreter class, which is used to interpret a BLAST program.
+This module contains the Interpreter class, which is used to interpret a BLAST program,
+the Execution class, which holds the state of one run of a program, and the ParseCache
+class, which is used by interpreters to reuse the trees of source code they have
+already parsed.
 """
 
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Iterable
 from .token import Token, TokenType
 from .parser import Parser
 from .ast import *
-from .symtab import SymbolTable, SymbolType
+from .symtab import _MISSING, _Return, Frame, SymbolTable, SymbolType
+from .compiler import Compiler
+from .vm import VM
+from .closures import ClosureCompiler
+from .tiering import NativeCompiler
+from .optimizer import Optimizer
+from .resolver import Resolver, resolve_layout
+from .purity import Memo, PurityAnalysis, memo_key
+from .profiler import Profiler
+from .budget import Budget, Meter
+from .builtins import builtin
+
+
+def _tree_size(ast):
+    # estimate the memory held by a tree, in bytes (shared strings are counted
+    # once per use, so this is an upper bound)
+    size = 0
+    pending = [ast]
+    while pending:
+        node = pending.pop()
+        size += sys.getsizeof(node)
+        if isinstance(node, AST):
+            for name in type(node).__slots__:
+                value = getattr(node, name, None)
+                if isinstance(value, (AST, list, str, int, float)):
+                    pending.append(value)
+        elif isinstance(node, list):
+            pending.extend(node)
+    return size
+
+
+def _names(ast):
+    # the names of the routines called and of the variables read in a tree
+    calls = set()
+    variables = set()
+    pending = [ast]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, CallExprAST):
+            calls.add(node.name)
+        elif isinstance(node, VariableExprAST):
+            variables.add(node.name)
+        for name in type(node).__slots__:
+            value = getattr(node, name, None)
+            if isinstance(value, AST):
+                pending.append(value)
+            elif isinstance(value, list):
+                pending.extend(item for item in value if isinstance(item, AST))
+    return calls, variables
+
+
+_worker = None  # the (Interpreter, call tree, engine) of a parallel_map() worker
+
+
+def _start_worker(routines, variables, name, argc, options):
+    # set up a worker process of parallel_map(): declare the routines (which were
+    # resolved by the parent) and variables, and prepare a call of the routine
+    # whose arguments are read from variables that programs cannot name
+    global _worker
+    engine = options.pop("engine")
+    interpreter = Interpreter(engine, **options)
+    for routine in routines:
+        interpreter._symtab.set(routine.name, SymbolType.FUNCTION, routine)
+    for variable, value in variables.items():
+        interpreter._symtab.set(variable, SymbolType.VARIABLE, value)
+    params = [f"#{index}" for index in range(argc)]
+    call = BlockStmtAST([ExprStmtAST(CallExprAST(name, [VariableExprAST(param) for param in params]))])
+    interpreter._prepare(call, engine, params)
+    _worker = (interpreter, call, engine)
+
+
+def _call_worker(args):
+    # call the routine of a parallel_map() worker with a tuple of arguments
+    interpreter, call, engine = _worker
+    table = SymbolTable(interpreter._symtab)
+    for index, value in enumerate(args):
+        table.set(f"#{index}", SymbolType.VARIABLE, value)
+    results = interpreter._dispatch(call, engine, True, table)
+    return results[0] if results else None
+
+
+class ParseCache:
+    """A cache of the trees of parsed source code, shared between interpreters.
+
+    The cache maps source code (and the optimization level of the tree) to the
+    tree parsed from it. It holds at most max_bytes bytes of source code and
+    trees; when it is full, the least recently used trees are evicted. It can be
+    used from several threads at once.
+
+    The cached trees are shared by every interpreter that parses the same source,
+    so they MUST NOT be modified (the interpreters only annotate them). The code the
+    interpreters compile from the routines and loops of a tree is only cached as
+    long as the tree is alive, so evicting a tree frees it too, once no program
+    that still holds the tree (e.g. a routine defined in a symbol table) uses it.
+    """
+
+    """The default maximum size of a cache, in bytes."""
+    MAX_BYTES = 32 * 1024 * 1024
+
+    def __init__(self, max_bytes: int = MAX_BYTES):
+        """Initialize the ParseCache.
+
+        Args:
+            max_bytes (int): The maximum size of the cached source code and trees,
+                in bytes.
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (source, level) -> (tree, size), oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def bytes(self) -> int:
+        """The size of the cached source code and trees, in bytes."""
+        return self._bytes
+
+    def get(self, source: str, optimize: int = 0) -> AST:
+        """Get the cached tree of source code.
+
+        Args:
+            source (str): The source code.
+            optimize (int): The optimization level of the tree.
+
+        Returns:
+            AST?: The tree, or None if it is not cached.
+        """
+        key = (source, optimize)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, source: str, ast: AST, optimize: int = 0):
+        """Cache the tree of source code.
+
+        Args:
+            source (str): The source code.
+            ast (AST): The tree parsed (and optimized) from the source code.
+            optimize (int): The optimization level of the tree.
+        """
+        key = (source, optimize)
+        size = sys.getsizeof(source) + _tree_size(ast)
+        if size > self.max_bytes:
+            return  # would evict everything else
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (ast, size)
+            self._bytes += size
+            # evict the least recently used trees
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def clear(self):
+        """Remove all the trees from the cache, and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+"""The parse cache of the interpreters that are not given one."""
+PARSE_CACHE = ParseCache()
 
 
 class Interpreter:
-    """The interpreter for the BLAST programming language."""
+    """The interpreter for the BLAST programming language.
+
+    The interpreter can run a program with one of three engines:
+        - "tree": walk the abstract syntax tree (the default)
+        - "vm": compile the abstract syntax tree to bytecode and run it on the
+          virtual machine in blast.vm
+        - "closure": compile the abstract syntax tree to nested Python closures
+          with blast.closures, and call them
+
+    All engines give the same results and share the same global symbol table. Only
+    the "vm" engine keeps the frames of BLAST calls off the Python stack, so it is
+    the one to run deeply recursive programs with (it also eliminates tail calls).
+
+    Before a program runs, the resolver in blast.resolver gives the local variables
+    of every routine a slot, and reports the variables that can never be defined.
+
+    Values are only built where they can be used: the statements of a routine that
+    cannot give its value run without keeping the lists of the values of their
+    blocks and loops. A program can also run without keeping the values of its
+    statements at all (see execute()), or yield them one statement at a time
+    (see iter_evaluate()), so long-running scripts run in constant memory.
+
+    The routines whose value only depends on their arguments (see
+    blast.purity) are memoized: the values of their calls are cached, by
+    arguments, in a bounded cache per routine.
+
+    The "tree" engine is tiered: it counts the calls of every routine and the
+    iterations of every while loop in each run, and once a routine or a loop is
+    hot, it is translated into a Python function with blast.tiering and runs
+    natively from then on, in that run and in the later ones.
+
+    An Interpreter created with profile=True measures the time spent in every
+    routine and statement with a Profiler (see blast.profiler). Profiled programs
+    always run on the "tree" engine, without the native tier, so that the time of
+    every statement is attributed to it.
+
+    Tools such as coverage collectors and debuggers can follow the execution of
+    programs with a hook (see settrace()). Like profiling, tracing only changes the
+    runs of programs while a hook is set, so interpreters without one run at full
+    speed.
+
+    An Interpreter can run programs in several threads at once. Each run holds its
+    state in an execution context of its own (see Execution), and a program is not
+    changed once it has been prepared, so the runs share programs and their
+    compiled code without locks. The global variables and routines a run assigns
+    are kept in a table of its own, on top of the global symbol table as it was
+    when the run started; when the run ends, they are set in the global symbol
+    table (which is replaced rather than changed), so that the programs that run
+    later see them. Runs of evaluate_batch() are never set in it. Programs can also
+    run as asyncio tasks, yielding to the other tasks regularly (see
+    evaluate_async()), and within limits of steps, time and memory (see
+    blast.budget).
+    """
+
+    """The names of the available engines."""
+    ENGINES = ("tree", "vm", "closure")
+
+    """The default number of calls or iterations after which code is compiled."""
+    TIER_THRESHOLD = 100
+
+    """The default number of values cached per pure routine."""
+    MEMO_SIZE = 1024
+
+    """The default number of loop iterations and calls between two yields of
+    evaluate_async()."""
+    QUANTUM = 1000
+
+    def __init__(self, engine: str = "tree", tier_threshold: int = TIER_THRESHOLD,
+                 optimize: int = 0, parse_cache: ParseCache = PARSE_CACHE,
+                 memo_size: int = MEMO_SIZE, profile: bool = False):
+        """Initialize the Interpreter.
 
-    def __init__(self):
-        """Initialize the Interpreter."""
+        Args:
+            engine (str): The engine to run programs with (see ENGINES).
+            tier_threshold (int?): The number of calls of a routine, or iterations
+                of a loop, after which the "tree" engine compiles it to a Python
+                function. None disables the native tier.
+            optimize (int): The level of optimization applied to programs before
+                they run (see Optimizer).
+            parse_cache (ParseCache?): The cache of the trees of source code given
+                as strings; by default, the one shared by all interpreters in the
+                process. None disables caching.
+            memo_size (int?): The number of values cached per pure routine. None
+                or 0 disables memoization.
+            profile (bool): Whether to profile the programs that run (see
+                profiler).
+        """
+        if engine not in self.ENGINES:
+            raise Exception(f"Unknown engine '{engine}'")
 
         self._symtab = SymbolTable()
+        self._engine = engine
+        self._tier_threshold = tier_threshold if tier_threshold is not None else float("inf")
+        # the code compiled from the routines and loops of the trees is cached by
+        # weak reference to them, so it is dropped with the tree (e.g. once the
+        # parse cache evicts it and no run holds it); the ones Python cannot compile
+        # are cached as False
+        self._native = weakref.WeakKeyDictionary()  # natively compiled routines, and loops keeping their values
+        self._native_loops = weakref.WeakKeyDictionary()  # natively compiled loops not keeping their values
+        self._optimize = optimize
+        self._optimizer = Optimizer(optimize)
+        self._parse_cache = parse_cache
+        self._resolver = Resolver()
+        self._codes = weakref.WeakKeyDictionary()  # compiled routine bodies, for the vm engine
+        self._closures = weakref.WeakKeyDictionary()  # compiled routine bodies, for the closure engine
+        self._memo_size = memo_size or 0
+        self._purity = PurityAnalysis()
+        self._memos = {}  # the caches of the pure routines
+        self._compiled = None  # the last program compiled, as (key, program)
+        self._lock = threading.Lock()  # held while a program is prepared, or globals set
+        self.profiler = Profiler() if profile else None
+        self._trace = None
 
-    def evaluate(self, source: str = None, tokens: list[Token] = None, ast: AST = None):
+    def evaluate(self, source=None, tokens: Iterable[Token] = None, ast: AST = None,
+                 engine: str = None, budget: Budget = None):
         """Interpret the source code, tokens, or AST and return the result.
 
         Args:
-            source (str?): The source code to interpret.
-            tokens (list[Token]?): The list of tokens to interpret.
+            source (str | TextIO?): The source code to interpret, either as a string
+                or as a file object to read from.
+            tokens (Iterable[Token]?): The tokens to interpret.
             ast (AST?): The abstract syntax tree to interpret.
+            engine (str?): The engine to run the program with, instead of the one
+                the Interpreter was created with.
+            budget (Budget?): The limits of the resources the program may use (see
+                blast.budget). A program with a budget runs on the "vm" engine.
+
+        Raises:
+            BudgetExceeded: The program went over its budget.
 
         Notes:
             Only one of the arguments MUST be provided. If more than one is provided,
             the Interpreter will use the first one provided.
         """
-        if ast is not None:
-            self._ast = ast
-        elif tokens is not None:
-            self._ast = Parser(tokens=tokens).parse()
-        elif source is not None:
-            self._ast = Parser(source=source).parse()
+        return self.run(self._program(source, tokens, ast), engine, budget=budget)
+
+    def execute(self, source=None, tokens: Iterable[Token] = None, ast: AST = None,
+                engine: str = None, budget: Budget = None):
+        """Interpret the source code, tokens, or AST without keeping any values.
+
+        The statements of the program run for their effects only: the lists of the
+        values of its blocks and loops are never built, so a loop of any length
+        runs in constant memory.
+
+        Args:
+            source (str | TextIO?): The source code to interpret, either as a string
+                or as a file object to read from.
+            tokens (Iterable[Token]?): The tokens to interpret.
+            ast (AST?): The abstract syntax tree to interpret.
+            engine (str?): The engine to run the program with, instead of the one
+                the Interpreter was created with.
+            budget (Budget?): The limits of the resources the program may use (see
+                blast.budget). A program with a budget runs on the "vm" engine.
+
+        Raises:
+            BudgetExceeded: The program went over its budget.
+
+        Notes:
+            Only one of the arguments MUST be provided. If more than one is provided,
+            the Interpreter will use the first one provided.
+        """
+        self.run(self._program(source, tokens, ast), engine, values=False, budget=budget)
+
+    def iter_evaluate(self, source=None, tokens: Iterable[Token] = None, ast: AST = None,
+                      engine: str = None):
+        """Interpret the source code, tokens, or AST and yield the results lazily.
+
+        The program is parsed and resolved when the first result is requested, and
+        each top-level statement runs when the result before it has been consumed.
+        The results are the items of the list evaluate() would return, so only the
+        result being consumed is held in memory.
+
+        Args:
+            source (str | TextIO?): The source code to interpret, either as a string
+                or as a file object to read from.
+            tokens (Iterable[Token]?): The tokens to interpret.
+            ast (AST?): The abstract syntax tree to interpret.
+            engine (str?): The engine to run the program with, instead of the one
+                the Interpreter was created with.
+
+        Yields:
+            Any: The value of each top-level statement that is not None.
+
+        Notes:
+            Only one of the arguments MUST be provided. If more than one is provided,
+            the Interpreter will use the first one provided.
+        """
+        ast = self._program(source, tokens, ast)
+        engine = self._prepare(ast, engine)
+        statements = ast.stmts if isinstance(ast, BlockStmtAST) else [ast]
+        for statement in statements:
+            # a block of one statement evaluates to a list of its value, if any
+            results = self._dispatch(BlockStmtAST([statement]), engine, True)
+            if results:
+                yield results[0]
+
+    async def evaluate_async(self, source=None, tokens: Iterable[Token] = None,
+                             ast: AST = None, quantum: int = QUANTUM, budget: Budget = None):
+        """Interpret the source code, tokens, or AST without blocking the event loop.
+
+        The program runs on the "vm" engine, which can suspend a run anywhere, and
+        yields control to the event loop after every quantum loop iterations and
+        calls, so that other tasks run in between. If the task is cancelled, the
+        run stops when it next yields, and asyncio.CancelledError is raised as
+        usual; what the program did until then is kept.
+
+        Like a run in a thread, the task assigns global variables and routines in
+        a table of its own, on top of the global symbol table as it was when the
+        task started: tasks running at the same time do not see each other's
+        variables. The task's variables become global when it ends, for the
+        programs that start after that; if several tasks assign a variable, the
+        last one to end wins.
+
+        Args:
+            source (str | TextIO?): The source code to interpret, either as a string
+                or as a file object to read from.
+            tokens (Iterable[Token]?): The tokens to interpret.
+            ast (AST?): The abstract syntax tree to interpret.
+            quantum (int): The number of loop iterations and calls between two
+                yields. Smaller quanta let other tasks run sooner, at the cost of
+                more switches between tasks.
+            budget (Budget?): The limits of the resources the program may use (see
+                blast.budget).
+
+        Returns:
+            list: The result evaluate() would return.
+
+        Raises:
+            BudgetExceeded: The program went over its budget.
+
+        Notes:
+            Only one of the arguments MUST be provided. If more than one is provided,
+            the Interpreter will use the first one provided. Programs that run
+            asynchronously are neither profiled nor traced.
+        """
+        import asyncio  # only imported by the programs that run asynchronously
+
+        ast = self._program(source, tokens, ast)
+        self._prepare(ast, "vm")
+        table = SymbolTable(self._symtab)
+        if budget is not None:
+            steps = self._metered(ast, True, budget, table, quantum)
+        else:
+            code = self._compile(ast, "vm", True)
+            steps = VM(table, self._codes, self._memos).steps(code, quantum)
+        try:
+            while True:
+                next(steps)
+                await asyncio.sleep(0)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            steps.close()
+            self._commit(table)
+
+    def evaluate_batch(self, program, bindings: Iterable[dict], engine: str = None,
+                       budget: Budget = None) -> list:
+        """Interpret a program once for each set of bindings of its variables.
+
+        The program is parsed, resolved and compiled once, and the routines it
+        declares before its first other statement are declared once. Then, for each
+        dict of bindings, the rest of the program runs in a fresh symbol table that
+        holds the bindings as variables. The variables a run assigns are only seen
+        by that run, and the symbol table of the Interpreter is left unchanged.
+
+        Args:
+            program (str | TextIO | AST): The program, as source code (either as a
+                string or as a file object to read from) or as an abstract syntax
+                tree.
+            bindings (Iterable[dict[str, Any]]): The values of the variables of each
+                run, by name.
+            engine (str?): The engine to run the program with, instead of the one
+                the Interpreter was created with.
+            budget (Budget?): The limits of the resources each run may use (see
+                blast.budget). A program with a budget runs on the "vm" engine.
+
+        Returns:
+            list[list]: For each dict of bindings, the result evaluate() would give
+                for the program if the variables were assigned the bindings first.
+
+        Raises:
+            BudgetExceeded: A run went over its budget.
+        """
+        if isinstance(program, AST):
+            ast = self._optimizer.optimize(program)
         else:
+            ast = self.parse(program)
+        bindings = list(bindings)
+        names = set().union(*bindings)
+        engine = self._prepare(ast, engine, names)
+
+        statements = ast.stmts if isinstance(ast, BlockStmtAST) else [ast]
+        count = 0
+        while count < len(statements) and isinstance(statements[count], RoutineStmtAST):
+            count += 1
+        declarations = BlockStmtAST(statements[:count])
+        body = BlockStmtAST(statements[count:])
+
+        shared = SymbolTable(self._symtab)
+        self._dispatch(declarations, engine, False, shared)
+        results = []
+        for binding in bindings:
+            table = SymbolTable(shared)
+            for name, value in binding.items():
+                if value is None:
+                    raise Exception(f"Cannot assign None to '{name}'")
+                table.set(name, SymbolType.VARIABLE, value)
+            if budget is None:
+                results.append(self._dispatch(body, engine, True, table))
+                continue
+            steps = self._metered(body, True, budget, table)
+            try:
+                while True:
+                    next(steps)
+            except StopIteration as stop:
+                results.append(stop.value)
+            finally:
+                steps.close()
+        return results
+
+    def parallel_map(self, name: str, arguments: Iterable, workers: int = None,
+                     chunksize: int = None, engine: str = None) -> list:
+        """Call a routine with each tuple of arguments, in several processes.
+
+        The routine, the routines it calls and the variables they read are looked
+        up in the symbol table of the Interpreter, and sent once to each worker
+        process, which declares them in an Interpreter of its own; the calls are
+        then spread over the workers. The routines run as they would in this
+        Interpreter, except that the variables they assign, and the routines they
+        declare, are not seen by the other calls nor by this Interpreter.
+
+        Args:
+            name (str): The name of the routine.
+            arguments (Iterable[Sequence[Any]]): The arguments of each call.
+            workers (int?): The number of worker processes. By default, the number
+                of processors.
+            chunksize (int?): The number of calls sent to a worker at once. By
+                default, the calls are split in 4 chunks per worker.
+            engine (str?): The engine to run the calls with, instead of the one the
+                Interpreter was created with.
+
+        Returns:
+            list: The value of each call, in the order of arguments.
+
+        Notes:
+            The arguments, the variables read by the routines and the values of the
+            calls are pickled to be sent between processes, and what the routines
+            print is printed by the workers.
+        """
+        engine = engine or self._engine
+        if engine not in self.ENGINES:
+            raise Exception(f"Unknown engine '{engine}'")
+        try:
+            func = self._symtab.get(name, SymbolType.FUNCTION)
+        except KeyError:
+            raise Exception(f"Undefined function '{name}'")
+        arguments = [tuple(args) for args in arguments]
+        for args in arguments:
+            if len(args) != len(func.args):
+                raise Exception(
+                    f"Invalid number of arguments for function '{name}': expected {len(func.args)}, got {len(args)}")
+        if not arguments:
+            return []
+
+        # the routines that may be called, and the global variables they may read
+        routines = {}
+        read = set()
+        pending = [func]
+        while pending:
+            routine = pending.pop()
+            routines[routine.name] = routine
+            calls, variables = _names(routine.body)
+            read |= variables
+            for callee in calls - routines.keys():
+                try:
+                    pending.append(self._symtab.get(callee, SymbolType.FUNCTION))
+                except KeyError:
+                    pass  # a builtin function, or a routine declared by a routine
+        variables = {variable: self._symtab.get(variable, SymbolType.VARIABLE)
+                     for variable in read & self._symtab.names(SymbolType.VARIABLE)}
+
+        from concurrent.futures import ProcessPoolExecutor  # only imported by parallel maps
+
+        workers = workers or os.cpu_count() or 1
+        if chunksize is None:
+            chunksize = max(1, len(arguments) // (workers * 4))
+        options = dict(engine=engine, memo_size=self._memo_size or None,
+                       tier_threshold=self._tier_threshold if self._tier_threshold != float("inf") else None)
+        initargs = (list(routines.values()), variables, name, len(func.args), options)
+        with ProcessPoolExecutor(workers, initializer=_start_worker, initargs=initargs) as executor:
+            return list(executor.map(_call_worker, arguments, chunksize=chunksize))
+
+    def _program(self, source, tokens, ast):
+        # the tree of the program to run, from whichever argument was given
+        if ast is not None:
+            return self._optimizer.optimize(ast)
+        return self.parse(source, tokens)
+
+    def parse(self, source=None, tokens: Iterable[Token] = None) -> AST:
+        """Parse the source code or tokens, and optimize the program.
+
+        Args:
+            source (str | TextIO?): The source code to parse, either as a string or
+                as a file object to read from.
+            tokens (Iterable[Token]?): The tokens to parse.
+
+        Returns:
+            AST: The abstract syntax tree of the program, optimized at the level of
+                the Interpreter, ready to be passed to run().
+        """
+        if tokens is not None:
+            return self._optimizer.optimize(Parser(tokens=tokens).parse())
+        if source is None:
             raise Exception("No source code, parser, or AST provided.")
+        # only source code given as a string can be cached (files are streamed)
+        cache = self._parse_cache if isinstance(source, str) else None
+        if cache is not None:
+            ast = cache.get(source, self._optimize)
+            if ast is not None:
+                return ast
+        ast = self._optimizer.optimize(Parser(source=source).parse())
+        if cache is not None:
+            cache.put(source, ast, self._optimize)
+        return ast
+
+    def run(self, ast: AST, engine: str = None, values: bool = True, budget: Budget = None):
+        """Run a program returned by parse() and return the result.
+
+        Args:
+            ast (AST): The abstract syntax tree of the program.
+            engine (str?): The engine to run the program with, instead of the one
+                the Interpreter was created with.
+            values (bool): Whether to return the value of the program. If False,
+                the values of the statements are not kept (see execute()), and None
+                is returned.
+            budget (Budget?): The limits of the resources the program may use (see
+                blast.budget). A program with a budget runs on the "vm" engine.
+
+        Raises:
+            BudgetExceeded: The program went over its budget.
+        """
+        engine = self._prepare(ast, engine)
+        if budget is None:
+            return self._dispatch(ast, engine, values)
+        table = SymbolTable(self._symtab)
+        steps = self._metered(ast, values, budget, table)
+        try:
+            while True:
+                next(steps)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            self._commit(table)
+
+    def _metered(self, ast, values, budget, symtab, quantum=None):
+        # run a resolved tree on the vm engine within a budget, in the global symbol
+        # table symtab, checking the steps and the time every QUANTUM steps; with a
+        # quantum, the run is suspended (the generator yields) every quantum steps
+        # instead
+        meter = Meter(budget)
+        if budget.memory is None and budget.seconds is None:
+            # only the memory and the time of long operations are measured by the
+            # code itself
+            code = self._compile(ast, "vm", values)
+            vm = VM(symtab, self._codes, self._memos)
+        else:
+            code = meter.compiler().compile(ast, values)
+            # the routines are compiled again, with the operators of the meter
+            vm = VM(symtab, {}, self._memos, meter)
+        chunk = meter.chunk(quantum or self.QUANTUM)
+        steps = vm.steps(code, chunk)
+        try:
+            steps.send(None)
+            while True:
+                meter.spend(chunk)
+                if quantum is not None:
+                    yield
+                chunk = meter.chunk(quantum or self.QUANTUM)
+                steps.send(chunk)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            steps.close()
+
+    def _prepare(self, ast, engine, defined=()):
+        # check the engine, and resolve the program before any of it runs; defined
+        # are the names of variables defined besides those of the symbol table
+        engine = engine or self._engine
+        if engine not in self.ENGINES:
+            raise Exception(f"Unknown engine '{engine}'")
+
+        # the resolver and the purity analysis keep state while they run, so
+        # programs are prepared one at a time; a tree being run by another
+        # thread may be resolved again, which annotates it with the same slots
+        with self._lock:
+            names = self._symtab.names(SymbolType.VARIABLE) | set(defined)
+            routines = [self._symtab.get(name, SymbolType.FUNCTION)
+                        for name in self._symtab.names(SymbolType.FUNCTION)]
+            self._resolver.resolve(ast, names, routines)
+            if self._memo_size:
+                self._find_pure_routines(ast, routines)
+        return engine
+
+    def _dispatch(self, ast, engine, values, symtab=None):
+        # run a resolved tree on an engine, in an execution context of its own;
+        # symtab is the global symbol table of the run, by default a table of its
+        # own on top of the Interpreter's, whose symbols are set in it at the end
+        if symtab is None:
+            symtab = SymbolTable(self._symtab)
+            try:
+                return self._dispatch(ast, engine, values, symtab)
+            finally:
+                self._commit(symtab)
+        profiler = self.profiler
+        if profiler is not None or self._trace is not None:
+            # observed programs are walked, so that every statement is seen
+            engine = "tree"
+        if engine == "vm":
+            code = self._compile(ast, engine, values)
+            return VM(symtab, self._codes, self._memos).run(code)
+        execution = Execution(self, symtab)
+        if profiler is not None:
+            profiler.enter_routine(None)
+        try:
+            if engine == "closure":
+                return self._compile(ast, engine, values)(execution)
+            if not values:
+                return execution._execute(ast)
+            return ast.accept(execution)
+        except RecursionError:
+            # these engines recurse on the Python stack; the vm engine does not
+            raise Exception("Maximum recursion depth exceeded (use the vm engine for deep recursion)")
+        finally:
+            if profiler is not None:
+                profiler.exit_routine()
+
+    def _commit(self, table):
+        # set the global symbols a run has assigned in the global symbol table; the
+        # table is replaced, so that the runs in progress keep the one they started
+        # with (when runs assign the same symbol, the last one to end wins)
+        if table._symbols:
+            with self._lock:
+                self._symtab = self._symtab.updated(table)
+
+    def _compile(self, ast, engine, values):
+        # compile a tree for the vm or closure engine; the last tree compiled is
+        # kept, so that running it again (e.g. in evaluate_batch()) is not slower
+        key = (ast, engine, values)
+        compiled = self._compiled
+        if compiled is not None and compiled[0] == key:
+            return compiled[1]
+        if engine == "vm":
+            program = Compiler().compile(ast, values)
+        else:
+            program = ClosureCompiler().compile(ast, values)
+        self._compiled = (key, program)
+        return program
+
+    def settrace(self, hook):
+        """Set a hook called on the events of the programs that run.
+
+        The hook is called as hook(event, node, symtab, arg, time), where:
+            - event is "statement" before a statement runs, "call" when a routine
+              starts running and "return" when it ends (but not when it raises)
+            - node is the statement or the routine (RoutineStmtAST)
+            - symtab is the current SymbolTable (for a routine, its own Frame)
+            - arg is the value of the routine for "return" events, and None
+              otherwise
+            - time is the time of the event, in nanoseconds (see
+              time.perf_counter_ns), so the duration of a call is the difference
+              between the times of its "return" and "call" events
+
+        While a hook is set, programs run on the "tree" engine without the native
+        tier, so that every statement is seen. Calls answered from the cache of a
+        memoized routine do not run, so they have no events. The hook applies to
+        the programs that start running after it is set.
+
+        Args:
+            hook (Callable?): The hook, or None to remove the current one.
+        """
+        self._trace = hook
+
+    def gettrace(self):
+        """Get the hook set with settrace().
+
+        Returns:
+            Callable?: The hook, or None if no hook is set.
+        """
+        return self._trace
+
+    def _find_pure_routines(self, ast, defined):
+        # the routines of the program may call the ones defined before, and
+        # redefine them; routines that are no longer pure lose their cache, and
+        # all of them do if the program shadows a builtin function (the values
+        # cached may have been those of the builtin function)
+        pure = self._purity.analyze(ast, defined)
+        memos = {} if self._purity.shadows_builtin(ast) else self._memos
+        self._memos = {routine: memos.get(routine) or Memo(self._memo_size)
+                       for routine in pure}
+
+
+class Execution:
+    """The execution context of a program run by an Interpreter.
+
+    An Execution holds all the state of one run of a program: the symbol table of
+    the routine running, and the caches of the Interpreter it uses, as they were
+    when the run started. It walks the tree of the program for the "tree" engine,
+    and the closures of the "closure" engine and the functions of the native tier
+    run with it.
+
+    The Interpreter creates an Execution for every program it runs, so runs never
+    share their state, and a run that raises leaves nothing behind. The calls of the
+    routines and the iterations of the loops are counted by each Execution; the
+    code compiled by the native tier is shared by all the runs of the Interpreter.
+    """
+
+    def __init__(self, interpreter: Interpreter, symtab: SymbolTable):
+        """Initialize the Execution.
+
+        Args:
+            interpreter (Interpreter): The Interpreter running the program.
+            symtab (SymbolTable): The global symbol table of the run.
+        """
+        self._interpreter = interpreter
+        self._symtab = symtab
+        self._memos = interpreter._memos
+        # the code compiled for the routines and loops this run has used, taken
+        # from the caches of the Interpreter the first time
+        self._closures = {}  # the closures of the routines, for the closure engine
+        self._native = {}  # the native code, by routine or loop, or (loop, None) for a loop not keeping its values
+        self._counts = {}  # the calls of the routines and iterations of the loops
+        if interpreter.profiler is None and interpreter._trace is None:
+            self._tiered = True
+            self._tier_threshold = interpreter._tier_threshold
+            return
+
+        # natively compiled code would not report its statements
+        self._tiered = False
+        self._tier_threshold = float("inf")
+        if interpreter.profiler is not None:
+            self._profile(interpreter.profiler)
+        if interpreter._trace is not None:
+            self._settrace(interpreter._trace)
+
+    def _profile(self, profiler):
+        # wrap the methods that run routines and statements so that they report to
+        # the profiler; only this instance is changed, so executions that are not
+        # profiled pay nothing
+        body = self._body
+        execute = self._execute
+
+        def profiled_body(func):
+            profiler.enter_routine(func)
+            try:
+                return body(func)
+            finally:
+                profiler.exit_routine()
+
+        def profiled(method):
+            def statement(stmt):
+                profiler.enter_statement(stmt)
+                try:
+                    return method(stmt)
+                finally:
+                    profiler.exit_statement()
+            return statement
+
+        profiled_execute = profiled(execute)
+
+        def execute_statement(stmt):
+            # blocks are not measured, and the other statements are measured by
+            # their visit methods
+            if type(stmt) in (BlockStmtAST, RoutineStmtAST, ReturnStmtAST):
+                return execute(stmt)
+            return profiled_execute(stmt)
+
+        self._body = profiled_body
+        self._execute = execute_statement
+        for name in ("visit_expr_stmt", "visit_if_stmt", "visit_while_stmt",
+                     "visit_routine_stmt", "visit_return_stmt"):
+            setattr(self, name, profiled(getattr(self, name)))
+
+    def _settrace(self, hook):
+        # wrap the methods that run routines and statements so that they call the
+        # hook (see Interpreter.settrace()), as _profile() does
+        clock = time.perf_counter_ns
+        body = self._body
+        execute = self._execute
+
+        def traced_body(func):
+            symtab = self._symtab
+            hook("call", func, symtab, None, clock())
+            value = body(func)
+            hook("return", func, symtab, value, clock())
+            return value
+
+        def traced(method):
+            def statement(stmt):
+                hook("statement", stmt, self._symtab, None, clock())
+                return method(stmt)
+            return statement
+
+        traced_execute = traced(execute)
 
-        return self._ast.accept(self)
+        def execute_statement(stmt):
+            # blocks are not statements of their own, and the other statements
+            # are reported by their visit methods
+            if type(stmt) in (BlockStmtAST, RoutineStmtAST, ReturnStmtAST):
+                return execute(stmt)
+            return traced_execute(stmt)
+
+        self._body = traced_body
+        self._execute = execute_statement
+        for name in ("visit_expr_stmt", "visit_if_stmt", "visit_while_stmt",
+                     "visit_routine_stmt", "visit_return_stmt"):
+            setattr(self, name, traced(getattr(self, name)))
 
     def visit_binary_expr(self, expr: BinaryExprAST):
         rhs = expr.rhs.accept(self)
 
         # if assignment, add to symbol table
-        if expr.op.type == TokenType.COLON:
+        if expr.op == TokenType.COLON:
             if not isinstance(expr.lhs, VariableExprAST):
                 raise Exception("Invalid assignment target")
             # if rhs is None, throw an error (can't assign None)
             if rhs is None:
                 raise Exception("Cannot assign None")
-            self._symtab.set(expr.lhs.name, SymbolType.VARIABLE, rhs)
+            if expr.lhs.slot is not None:
+                self._symtab.slots[expr.lhs.slot] = rhs
+            else:
+                self._symtab.set(expr.lhs.name, SymbolType.VARIABLE, rhs)
             return rhs # return the value assigned (for chaining)
 
         lhs = expr.lhs.accept(self)
 
-        match expr.op.type:
+        match expr.op:
             case TokenType.PLUS:
                 return lhs + rhs
             case TokenType.MINUS:
@@ -83,7 +957,7 @@ class Interpreter:
 
     def visit_unary_expr(self, expr: UnaryExprAST):
         accept = expr.expr.accept(self)
-        if expr.op.type == TokenType.MINUS:
+        if expr.op == TokenType.MINUS:
             return -accept
         return accept
 
@@ -94,45 +968,94 @@ class Interpreter:
         return expr.val
 
     def visit_variable_expr(self, expr: VariableExprAST):
+        # a local variable is in its slot, once it has been assigned
+        if expr.slot is not None:
+            value = self._symtab.slots[expr.slot]
+            if value is not _MISSING:
+                return value
         try:
             return self._symtab.get(expr.name, SymbolType.VARIABLE)
         except KeyError:
             raise Exception(f"Undefined variable '{expr.name}'")
 
     def visit_call_expr(self, expr: CallExprAST):
-        try:
-            # if print function, print the args
-            if expr.name == "print":
-                print(*[arg.accept(self) for arg in expr.args], sep=" ")
-                return  # return nothing
+        # if print function, print the args
+        if expr.name == "print":
+            print(*[arg.accept(self) for arg in expr.args], sep=" ")
+            return  # return nothing
 
+        try:
             func = self._symtab.get(expr.name, SymbolType.FUNCTION)
-            # create new symbol table for function
-            symtab = SymbolTable(parent=self._symtab)
-            # func.args is a list of str (names of args); map to expr.args
-            # but first, check if the number of args is correct
-            if len(func.args) != len(expr.args):
-                raise Exception(
-                    f"Invalid number of arguments for function '{expr.name}': expected {len(func.args)}, got {len(expr.args)}")
-            # now, map the args
-            for arg, val in zip(func.args, expr.args):
-                symtab.set(arg, SymbolType.VARIABLE, val.accept(self))
+        except KeyError:
+            # no routine has the name; it may be a builtin function
+            func = builtin(expr.name, len(expr.args))
+            return func(*[arg.accept(self) for arg in expr.args])
+        # func.args is a list of str (names of args); map to expr.args
+        # but first, check if the number of args is correct
+        if len(func.args) != len(expr.args):
+            raise Exception(
+                f"Invalid number of arguments for function '{expr.name}': expected {len(func.args)}, got {len(expr.args)}")
 
-            # set the symbol table to the new one
-            old_symtab = self._symtab
-            self._symtab = symtab
+        return self._invoke(self._symtab, func, [arg.accept(self) for arg in expr.args])
 
-            # evaluate the function
-            result = func.body.accept(self)
+    def _invoke(self, caller: SymbolTable, func: RoutineStmtAST, values, memoize=True):
+        # call a routine from the given symbol table, with evaluated arguments
+        if memoize and self._memos:
+            memo = self._memos.get(func)
+            if memo is not None:
+                return self._memoized(memo, caller, func, values)
 
-            # set the symbol table back to the old one
+        # create new symbol table for function, with the args in the first slots
+        layout = func.layout if func.layout is not None else resolve_layout(func)
+        symtab = Frame(caller, layout, func.size, values)
+
+        native = self._native.get(func)
+        if native is None:
+            calls = self._counts[func] = self._counts.get(func, 0) + 1
+            if calls == 1 or calls >= self._tier_threshold:
+                # a routine compiled by an earlier run, or hot, runs natively from
+                # now on
+                native = self._native_code(func, func, calls)
+
+        # set the symbol table to the new one, and back to the old one even if the
+        # function raises
+        old_symtab = self._symtab
+        self._symtab = symtab
+        try:
+            # evaluate the function
+            return self._body(func) if native is None else native(self, symtab)
+        finally:
             self._symtab = old_symtab
 
-            # return last thing in the array
-            len_of = len(result)
-            return result[len_of - 1] if len_of > 0 else None
-        except KeyError:
-            raise Exception(f"Undefined function '{expr.name}'")
+    def _body(self, func: RoutineStmtAST):
+        # run the body of a routine and return the value of the return statement
+        # it leaves by, or its last value that is not None; the statements before
+        # func.live cannot give the latter, so they keep no values
+        live = func.live
+        value = None
+        for index, statement in enumerate(func.body.stmts):
+            if index < live:
+                result = self._execute(statement)
+                if result is not None:
+                    return result.value
+                continue
+            result = statement.accept(self)
+            if result is not None:
+                if type(result) is _Return:
+                    return result.value
+                value = result
+        return value
+
+    def _memoized(self, memo, caller, func, values):
+        # call a pure routine, unless it was already called with the same args
+        key = memo_key(values)
+        if key is None:
+            return self._invoke(caller, func, values, memoize=False)
+        result = memo.lookup(key)
+        if result is _MISSING:
+            result = self._invoke(caller, func, values, memoize=False)
+            memo.store(key, result)
+        return result
 
     def visit_expr_stmt(self, stmt: ExprStmtAST):
         return stmt.expr.accept(self)
@@ -143,6 +1066,8 @@ class Interpreter:
             accept = statement.accept(self)
             # only append if it returns something (not None or bool)
             if accept is bool or accept is not None:
+                if type(accept) is _Return:
+                    return accept  # leave the enclosing blocks, up to the routine
                 results.append(accept)
 
         return results
@@ -154,13 +1079,108 @@ class Interpreter:
             return stmt.else_block.accept(self)
 
     def visit_while_stmt(self, stmt: WhileStmtAST):
-        results = []
+        return self._loop(stmt, [])
+
+    def _loop(self, stmt: WhileStmtAST, results):
+        # run a loop, appending the values of its iterations to results unless it
+        # is None; a loop whose values are not kept has its own native version
+        key = stmt if results is not None else (stmt, None)
+        native = self._native.get(key)
+        counts = self._counts
+        if native is None and stmt not in counts:
+            # the loop may have been compiled by an earlier run
+            native = self._native_code(key, stmt, 0)
+        if native is not None:
+            return native(self, self._symtab, results)
+
+        threshold = self._tier_threshold
         while stmt.cond.accept(self):
-            accept = stmt.body.accept(self)
-            if accept is bool or accept is not None:
-                results.append(accept)
+            if results is None:
+                accept = self._execute(stmt.body)
+                if accept is not None:
+                    return accept  # a return statement
+            else:
+                accept = stmt.body.accept(self)
+                if type(accept) is _Return:
+                    return accept
+                if accept is bool or accept is not None:
+                    results.append(accept)
+
+            iterations = counts[stmt] = counts.get(stmt, 0) + 1
+            if iterations >= threshold:
+                # hot loop; run the remaining iterations natively
+                native = self._native_code(key, stmt, iterations)
+                if native is not None:
+                    return native(self, self._symtab, results)
+                threshold = float("inf")  # the loop cannot be compiled
 
         return results
 
+    def _native_code(self, key, stmt, count):
+        # get the native code of a routine or loop that has run count calls or
+        # iterations in this run, or None: the code compiled by an earlier run is
+        # used at once, and a hot routine or loop is compiled, once per Interpreter
+        # (a version compiled by another run in the meantime is used instead); key
+        # is the routine or loop, or (loop, None) for a loop not keeping its values.
+        # Code Python cannot compile (e.g. too deeply nested) is walked instead
+        if not self._tiered:
+            return None
+        interpreter = self._interpreter
+        values = key is stmt
+        cache = interpreter._native if values else interpreter._native_loops
+        native = cache.get(stmt)
+        if native is None:
+            if count < self._tier_threshold:
+                return None
+            with interpreter._lock:
+                native = cache.get(stmt)
+                if native is None:
+                    try:
+                        if type(stmt) is RoutineStmtAST:
+                            native = NativeCompiler().compile_routine(stmt)
+                        else:
+                            native = NativeCompiler().compile_loop(stmt, values)
+                    except (SyntaxError, RecursionError, MemoryError):
+                        native = False  # not compiled again
+                    cache[stmt] = native
+        if native is False:
+            return None
+        self._native[key] = native
+        return native
+
+    def _closure(self, func, compile_routine):
+        # get the closure of the body of a routine for this run, from the cache of
+        # the Interpreter, compiling it with compile_routine the first time
+        cache = self._interpreter._closures
+        body = cache.get(func)
+        if body is None:
+            body = cache[func] = compile_routine(func)
+        self._closures[func] = body
+        return body
+
+    def _execute(self, stmt: StmtAST):
+        # run a statement whose value is not needed, without building the lists of
+        # the values of its blocks and loops; only a return statement gives a value
+        kind = type(stmt)
+        if kind is ExprStmtAST:
+            stmt.expr.accept(self)
+        elif kind is BlockStmtAST:
+            for statement in stmt.stmts:
+                result = self._execute(statement)
+                if result is not None:
+                    return result
+        elif kind is IfStmtAST:
+            if stmt.cond.accept(self):
+                return self._execute(stmt.then_block)
+            elif stmt.else_block:
+                return self._execute(stmt.else_block)
+        elif kind is WhileStmtAST:
+            return self._loop(stmt, None)
+        else:
+            return stmt.accept(self)
+
     def visit_routine_stmt(self, stmt: RoutineStmtAST):
         self._symtab.set(stmt.name, SymbolType.FUNCTION, stmt)
+
+    def visit_return_stmt(self, stmt: ReturnStmtAST):
+        return _Return(stmt.value.accept(self) if stmt.value is not None else None)
@@ -0,0 +1,148 @@
+"""Optimizer for the BLAST language.
+
+This module contains the Optimizer class, which is used to simplify an abstract
+syntax tree between parsing and execution.
+"""
+
+from .token import TokenType
+from .ast import *
+from .compiler import BINARY_OPERATORS
+
+"""The largest string, or integer in bits, that constant folding produces."""
+MAX_FOLDED_SIZE = 4096
+
+
+def _literal(expr):
+    # return whether the expression is a literal
+    return isinstance(expr, (NumberExprAST, StringExprAST))
+
+
+def _make_literal(value):
+    # wrap a folded value in a literal node
+    if isinstance(value, str):
+        return StringExprAST(value)
+    return NumberExprAST(value)
+
+
+def _too_large(op, lhs, rhs):
+    # estimate whether folding would produce a huge value; such expressions are
+    # left to run time, where they may never be evaluated
+    if op == TokenType.EXP and isinstance(lhs, int) and isinstance(rhs, int):
+        return rhs * max(abs(lhs), 1).bit_length() > MAX_FOLDED_SIZE
+    if op == TokenType.MUL and isinstance(lhs, str) and isinstance(rhs, int):
+        return len(lhs) * rhs > MAX_FOLDED_SIZE
+    if op == TokenType.MUL and isinstance(lhs, int) and isinstance(rhs, str):
+        return lhs * len(rhs) > MAX_FOLDED_SIZE
+    return False
+
+
+class Optimizer:
+    """The optimizer for the BLAST language.
+
+    This class walks the abstract syntax tree and returns a simplified copy of it;
+    the original tree is not modified. The simplifications depend on the level:
+        - 0: none
+        - 1: constant folding: binary and unary expressions whose operands are
+          literals are replaced by their value
+        - 2: also dead-branch elimination: if statements with a literal condition
+          are replaced by the branch that runs, and while loops with a falsy
+          literal condition are removed
+
+    The optimized tree evaluates to exactly the same values as the original one.
+    Expressions that fail (e.g. a division by zero) are left to fail at run time.
+    """
+
+    """The highest optimization level."""
+    MAX_LEVEL = 2
+
+    def __init__(self, level: int = MAX_LEVEL):
+        """Initialize the Optimizer.
+
+        Args:
+            level (int): The optimization level, from 0 to MAX_LEVEL.
+        """
+        self._level = level
+
+    def optimize(self, ast: AST) -> AST:
+        """Optimize an abstract syntax tree.
+
+        Args:
+            ast (AST): The abstract syntax tree to optimize.
+
+        Returns:
+            AST: The optimized abstract syntax tree.
+        """
+        if self._level <= 0:
+            return ast
+        optimized = ast.accept(self)
+        # a tree must evaluate to something, so an eliminated root is kept as it is
+        return optimized if optimized is not None else ast
+
+    def visit_binary_expr(self, expr: BinaryExprAST):
+        lhs = expr.lhs.accept(self)
+        rhs = expr.rhs.accept(self)
+
+        if expr.op != TokenType.COLON and _literal(lhs) and _literal(rhs):
+            if not _too_large(expr.op, lhs.val, rhs.val):
+                try:
+                    return _make_literal(BINARY_OPERATORS[expr.op](lhs.val, rhs.val))
+                except Exception:
+                    pass  # e.g. division by zero; fail at run time instead
+
+        return BinaryExprAST(expr.op, lhs, rhs)
+
+    def visit_unary_expr(self, expr: UnaryExprAST):
+        operand = expr.expr.accept(self)
+        if expr.op == TokenType.MINUS and isinstance(operand, NumberExprAST):
+            return NumberExprAST(-operand.val)
+        return UnaryExprAST(expr.op, operand)
+
+    def visit_number_expr(self, expr: NumberExprAST):
+        return expr
+
+    def visit_string_expr(self, expr: StringExprAST):
+        return expr
+
+    def visit_variable_expr(self, expr: VariableExprAST):
+        # not shared, as the resolver annotates the variables of each tree
+        return VariableExprAST(expr.name)
+
+    def visit_call_expr(self, expr: CallExprAST):
+        return CallExprAST(expr.name, [arg.accept(self) for arg in expr.args])
+
+    def visit_expr_stmt(self, stmt: ExprStmtAST):
+        return ExprStmtAST(stmt.expr.accept(self), stmt.start, stmt.lines)
+
+    def visit_block_stmt(self, stmt: BlockStmtAST):
+        statements = []
+        for statement in stmt.stmts:
+            statement = statement.accept(self)
+            # eliminated statements (whose value was None) are left out
+            if statement is not None:
+                statements.append(statement)
+        return BlockStmtAST(statements, stmt.start, stmt.lines)
+
+    def visit_if_stmt(self, stmt: IfStmtAST):
+        cond = stmt.cond.accept(self)
+        then_block = stmt.then_block.accept(self)
+        else_block = stmt.else_block.accept(self) if stmt.else_block else None
+
+        if self._level >= 2 and _literal(cond):
+            # the value of the if statement is the value of the branch that runs
+            return then_block if cond.val else else_block
+        return IfStmtAST(cond, then_block, else_block, stmt.start, stmt.lines)
+
+    def visit_while_stmt(self, stmt: WhileStmtAST):
+        cond = stmt.cond.accept(self)
+        body = stmt.body.accept(self)
+
+        if self._level >= 2 and _literal(cond) and not cond.val:
+            # a loop that never runs evaluates to an empty list, as does an empty block
+            return BlockStmtAST([], stmt.start, stmt.lines)
+        return WhileStmtAST(cond, body, stmt.start, stmt.lines)
+
+    def visit_routine_stmt(self, stmt: RoutineStmtAST):
+        return RoutineStmtAST(stmt.name, stmt.args, stmt.body.accept(self), stmt.start, stmt.lines)
+
+    def visit_return_stmt(self, stmt: ReturnStmtAST):
+        return ReturnStmtAST(stmt.value.accept(self) if stmt.value is not None else None, stmt.start, stmt.lines)
@@ -4,8 +4,9 @@ This module contains the Parser class, which is used to parse the tokens collect
 by the scanner into an abstract syntax tree.
 """
 
+from typing import Iterable
 from .scanner import Scanner
-from .token import Token, TokenType
+from .token import Token, TokenStream, TokenType
 from .ast import *
 
 
@@ -16,26 +17,28 @@ class Parser:
     syntax tree.
     """
 
-    def __init__(self, source: str = None, tokens: list[Token] = None):
+    def __init__(self, source=None, tokens: Iterable[Token] = None):
         """Initialize a Parser using either:
-            - source code
-            - a list of tokens
+            - source code, as a string or a file object
+            - an iterable of tokens (e.g. a list, or a generator)
 
         Args:
-            source (str?): The source code to parse.
-            tokens (list[Token]?): The list of tokens to parse.
+            source (str | TextIO?): The source code to parse.
+            tokens (Iterable[Token]?): The tokens to parse.
 
         Notes:
             Only one of the arguments MUST be provided. If more than one is provided,
             the Parser will use the first one provided.
+
+            Tokens are pulled from the scanner on demand while parsing, so the
+            whole list of tokens is never held in memory at once.
         """
         if tokens is not None:
-            self._tokens = tokens
+            self._tokens = TokenStream(tokens)
         elif source is not None:
-            self._tokens = Scanner(source).scan_tokens()
+            self._tokens = TokenStream(Scanner(source).iter_tokens())
         else:
             raise Exception("No source code or tokens provided.")
-        self._current = 0
 
     def parse(self) -> AST:
         """Parse the tokens and return the abstract syntax tree.
@@ -46,28 +49,32 @@ class Parser:
         return self._program()
 
     def _check(self, types):
-        if self._is_at_end():
-            return False
-        # check if the current token is in the list of types
-        return self._tokens[self._current].type in types
+        token = self._tokens.current
+        # check if the current token (if any) is in the list of types
+        return token is not None and token.type in types
 
     def _consume(self, types):
         if self._check(types):
-            token = self._tokens[self._current]  # get the current token
-            self._advance()                     # advance the current token
-            return token                        # return the previous token
+            # advance the current token and return the previous one
+            return self._tokens.advance()
         # if at end, raise an EOF error
         if self._is_at_end():
             raise Exception("Unexpected end of file")
         # otherwise, raise an unexpected token error
-        raise Exception(f"Unexpected token: {self._tokens[self._current]}")
+        raise self._unexpected(self._tokens.current)
+
+    def _unexpected(self, token):
+        # include the position of the token if it is known
+        if token.line is None:
+            return Exception(f"Unexpected token: {token}")
+        return Exception(
+            f"Unexpected token: {token} at line {token.line}, column {token.column}")
 
     def _is_at_end(self):
-        return self._current >= len(self._tokens)
+        return self._tokens.at_end()
 
     def _advance(self):
-        if not self._is_at_end():
-            self._current += 1
+        self._tokens.advance()
 
     def _expression(self):
         return self._assignment()
@@ -78,7 +85,7 @@ class Parser:
         if self._check([TokenType.COLON]):
             operator = self._consume([TokenType.COLON])
             right = self._assignment()
-            return BinaryExprAST(operator, expr, right)
+            return BinaryExprAST(operator.type, expr, right)
         return expr
 
     def _equality(self):
@@ -87,7 +94,7 @@ class Parser:
         while self._check(types):
             operator = self._consume(types)
             right = self._relational()
-            expr = BinaryExprAST(operator, expr, right)
+            expr = BinaryExprAST(operator.type, expr, right)
         return expr
 
     def _relational(self):
@@ -96,7 +103,7 @@ class Parser:
         while self._check(types):
             operator = self._consume(types)
             right = self._addition()
-            expr = BinaryExprAST(operator, expr, right)
+            expr = BinaryExprAST(operator.type, expr, right)
         return expr
 
     def _addition(self):
@@ -108,7 +115,7 @@ class Parser:
             operator = self._consume(types)
             right = self._multiplication()
             # create a new binary expression with the left and right expressions
-            expr = BinaryExprAST(operator, expr, right)
+            expr = BinaryExprAST(operator.type, expr, right)
 
         return expr
 
@@ -119,7 +126,7 @@ class Parser:
         while self._check(types):
             operator = self._consume(types)
             right = self._exponent()
-            expr = BinaryExprAST(operator, expr, right)
+            expr = BinaryExprAST(operator.type, expr, right)
 
         return expr
 
@@ -130,7 +137,7 @@ class Parser:
         if self._check([TokenType.EXP]):
             operator = self._consume([TokenType.EXP])
             right = self._exponent()
-            expr = BinaryExprAST(operator, expr, right)
+            expr = BinaryExprAST(operator.type, expr, right)
 
         return expr
 
@@ -140,7 +147,7 @@ class Parser:
             operator = self._consume([TokenType.MINUS])  # consume the operator
             # right-recursively parse the next expression
             right = self._unary()
-            return UnaryExprAST(operator, right)
+            return UnaryExprAST(operator.type, right)
         return self._primary()  # if there is no unary operator, parse the next expression
 
     def _primary(self):
@@ -177,7 +184,9 @@ class Parser:
             expr = self._expression()
             self._consume([TokenType.RPAREN])
             return expr
-        raise Exception(f"Unexpected token: {self._tokens[self._current]}")
+        if self._is_at_end():
+            raise Exception("Unexpected end of file")
+        raise self._unexpected(self._tokens.current)
 
     def _program(self):
         # store all statements in a list
@@ -189,6 +198,10 @@ class Parser:
         return BlockStmtAST(statements)
 
     def _statement(self):
+        # the position of a statement is the position of its first token; its
+        # line is only looked up if needed, which saves indexing the source code
+        token = self._tokens.current
+
         # if current token is "if", parse an if statement
         if self._check([TokenType.IF]):
             expr = self._if_statement()
@@ -196,11 +209,14 @@ class Parser:
             expr = self._while_statement()
         elif self._check([TokenType.ROUTINE]):
             expr = self._routine_statement()
+        elif self._check([TokenType.RETURN]):
+            expr = self._return_statement()
         else:
             expr = self._expression_statement()
 
         # consume period
         self._consume([TokenType.PERIOD])
+        expr.start, expr.lines = token.start, token.lines
         return expr
 
     def _expression_statement(self):
@@ -256,6 +272,13 @@ class Parser:
 
         return RoutineStmtAST(name.lexeme, args, body)
 
+    def _return_statement(self):
+        self._consume([TokenType.RETURN])
+        # the value is optional
+        if self._check([TokenType.PERIOD]):
+            return ReturnStmtAST(None)
+        return ReturnStmtAST(self._expression())
+
     def _block_statement_until(self, types):
         statements = []
         while not self._is_at_end() and not self._check(types):
@@ -0,0 +1,184 @@
+"""Profiler for BLAST programs.
+
+This module contains the Profiler class, which is used by the interpreter to measure
+the time spent in every routine and statement of a program, and to report it as a
+table or as collapsed stacks for flame graph tools.
+"""
+
+import time
+from .ast import *
+
+"""The names of the kinds of statements, in reports."""
+STATEMENT_KINDS = {
+    ExprStmtAST: "expression",
+    BlockStmtAST: "block",
+    IfStmtAST: "if",
+    WhileStmtAST: "while",
+    RoutineStmtAST: "routine",
+    ReturnStmtAST: "return",
+}
+
+
+class Stats:
+    """The measurements of a routine or a statement.
+
+    Times are in nanoseconds. The inclusive time of a routine that is running
+    several times at once (i.e. recursively) only counts the outermost call, so
+    it is never more than the time of the program.
+    """
+
+    __slots__ = ("label", "calls", "inclusive", "exclusive")
+
+    def __init__(self, label: str):
+        """Initialize the Stats.
+
+        Args:
+            label (str): The name of the routine or statement, with its line.
+        """
+        self.label = label
+        self.calls = 0  # the number of times it ran
+        self.inclusive = 0  # the time it ran for, including what it called
+        self.exclusive = 0  # the time it ran for by itself
+
+    def __repr__(self):
+        return f"<{self.label}: {self.calls} calls, {self.inclusive} ns, {self.exclusive} ns>"
+
+
+class Profiler:
+    """The profiler for BLAST programs.
+
+    The interpreter tells the profiler when a routine or a statement starts and
+    ends running. The profiler keeps a Stats per routine (and one for the top level
+    of the programs, as the routine None) and per statement, and the time spent in
+    every stack of routines, which is what flame graphs show.
+
+    The time of a statement excludes the time of the statements run inside it,
+    including the statements of the routines it calls; the time of a routine
+    excludes the time of the routines it calls.
+    """
+
+    """The label of the top level of the programs."""
+    PROGRAM = "<program>"
+
+    def __init__(self, clock=time.perf_counter_ns):
+        """Initialize the Profiler.
+
+        Args:
+            clock (Callable[[], int]): The clock to measure time with, in
+                nanoseconds.
+        """
+        self.routines = {}  # RoutineStmtAST (or None) -> Stats
+        self.statements = {}  # StmtAST -> Stats
+        self._clock = clock
+        self._calls = []  # [Stats, start, time of the callees] of the running routines
+        self._running = []  # the same, for the running statements
+        self._path = []  # the labels of the running routines
+        self._stacks = {}  # path of labels -> exclusive time
+        self._active = {}  # Stats -> number of times it is running
+
+    def enter_routine(self, routine: RoutineStmtAST):
+        """Record that a routine starts running.
+
+        Args:
+            routine (RoutineStmtAST?): The routine, or None for the top level of a
+                program.
+        """
+        stats = self.routines.get(routine)
+        if stats is None:
+            stats = self.routines[routine] = Stats(self._routine_label(routine))
+        self._path.append(stats.label)
+        self._enter(self._calls, stats)
+
+    def exit_routine(self):
+        """Record that the last routine that started has ended."""
+        _, exclusive = self._exit(self._calls)
+        path = tuple(self._path)
+        self._stacks[path] = self._stacks.get(path, 0) + exclusive
+        self._path.pop()
+
+    def enter_statement(self, stmt: StmtAST):
+        """Record that a statement starts running.
+
+        Args:
+            stmt (StmtAST): The statement.
+        """
+        stats = self.statements.get(stmt)
+        if stats is None:
+            stats = self.statements[stmt] = Stats(self._statement_label(stmt))
+        self._enter(self._running, stats)
+
+    def exit_statement(self):
+        """Record that the last statement that started has ended."""
+        self._exit(self._running)
+
+    def report(self, limit: int = 20) -> str:
+        """Format the slowest routines and statements as tables.
+
+        Args:
+            limit (int?): The number of rows per table. None shows every row.
+
+        Returns:
+            str: The tables, sorted by exclusive time.
+        """
+        lines = []
+        for title, stats in (("routine", self.routines), ("statement", self.statements)):
+            rows = sorted(stats.values(), key=lambda row: row.exclusive, reverse=True)[:limit]
+            width = max([len(title)] + [len(row.label) for row in rows])
+            if lines:
+                lines.append("")
+            lines.append(f"{title:<{width}} {'calls':>10} {'inclusive':>12} {'exclusive':>12}")
+            for row in rows:
+                lines.append(f"{row.label:<{width}} {row.calls:>10} "
+                             f"{row.inclusive / 1e9:>11.6f}s {row.exclusive / 1e9:>11.6f}s")
+        return "\n".join(lines)
+
+    def collapsed(self) -> str:
+        """Format the time spent in every stack of routines as collapsed stacks.
+
+        Returns:
+            str: One line per stack, made of the labels of its routines separated
+                by semicolons and the exclusive time of the stack in microseconds,
+                as read by flame graph tools (e.g. flamegraph.pl or speedscope).
+        """
+        lines = []
+        for path, exclusive in sorted(self._stacks.items()):
+            micros = exclusive // 1000
+            if micros:
+                lines.append(f"{';'.join(path)} {micros}")
+        return "\n".join(lines)
+
+    def clear(self):
+        """Forget everything measured so far."""
+        self.routines.clear()
+        self.statements.clear()
+        self._stacks.clear()
+
+    def _enter(self, stack, stats):
+        stats.calls += 1
+        self._active[stats] = self._active.get(stats, 0) + 1
+        stack.append([stats, self._clock(), 0])
+
+    def _exit(self, stack):
+        # return the inclusive and exclusive time of the entry that ends
+        stats, start, inner = stack.pop()
+        inclusive = self._clock() - start
+        exclusive = inclusive - inner
+        stats.exclusive += exclusive
+        self._active[stats] -= 1
+        if not self._active[stats]:
+            stats.inclusive += inclusive  # the outermost call
+        if stack:
+            stack[-1][2] += inclusive
+        return inclusive, exclusive
+
+    def _routine_label(self, routine):
+        if routine is None:
+            return self.PROGRAM
+        if routine.line is None:
+            return routine.name
+        return f"{routine.name} (line {routine.line})"
+
+    def _statement_label(self, stmt):
+        kind = STATEMENT_KINDS.get(type(stmt), type(stmt).__name__)
+        line = "?" if stmt.line is None else stmt.line
+        return f"line {line}: {kind}"
@@ -0,0 +1,268 @@
+"""Purity analysis and memoization for the BLAST language.
+
+This module contains the PurityAnalysis class, which is used by the interpreter to
+find the routines whose value only depends on their arguments, and the Memo class,
+which caches the values of such routines.
+"""
+
+import weakref
+from collections import OrderedDict
+from .token import TokenType
+from .ast import *
+from .symtab import _MISSING
+from .builtins import BUILTINS
+
+
+def memo_key(values):
+    """Get the key of the arguments of a call in the cache of a routine.
+
+    Args:
+        values (Sequence[Any]): The values of the arguments.
+
+    Returns:
+        tuple?: The key, or None if the values cannot be used as a key.
+    """
+    key = []
+    for value in values:
+        kind = type(value)
+        if kind is int or kind is str:
+            key.append(value)
+        elif kind is float:
+            # the type is part of the key, so that 1, 1.0 and True are kept apart,
+            # and so is the sign of zero
+            key.append((float, value.hex()))
+        elif kind is bool:
+            key.append((bool, value))
+        else:
+            return None  # e.g. a list, which cannot be hashed
+    return tuple(key)
+
+
+class Memo:
+    """The cache of the values of a pure routine, by arguments.
+
+    The cache holds at most max_size values; when it is full, the least recently
+    used value is evicted. Threads may use the same cache at once: a value another
+    thread evicts is only computed again.
+    """
+
+    __slots__ = ("max_size", "_values")
+
+    def __init__(self, max_size: int):
+        """Initialize the Memo.
+
+        Args:
+            max_size (int): The maximum number of values.
+        """
+        self.max_size = max_size
+        self._values = OrderedDict()
+
+    def __len__(self):
+        return len(self._values)
+
+    def lookup(self, key):
+        """Get the value of a call.
+
+        Args:
+            key (tuple): The key of the arguments (see memo_key()).
+
+        Returns:
+            Any: The value, or _MISSING if it is not cached.
+        """
+        value = self._values.get(key, _MISSING)
+        if value is not _MISSING:
+            try:
+                self._values.move_to_end(key)
+            except KeyError:
+                pass  # evicted by another thread in the meantime
+        return value
+
+    def store(self, key, value):
+        """Cache the value of a call.
+
+        Args:
+            key (tuple): The key of the arguments (see memo_key()).
+            value (Any): The value of the call.
+        """
+        self._values[key] = value
+        if len(self._values) > self.max_size:
+            try:
+                self._values.popitem(last=False)
+            except KeyError:
+                pass  # emptied by other threads in the meantime
+
+
+class _Facts:
+    # what a routine does by itself: whether its body is pure, apart from the
+    # routines it calls, and the names of the routines it calls
+    __slots__ = ("pure", "calls")
+
+    def __init__(self, pure, calls):
+        self.pure = pure
+        self.calls = calls
+
+
+class PurityAnalysis:
+    """The purity analysis for the BLAST language.
+
+    BLAST is dynamically scoped, so a routine that reads a variable it has not
+    bound itself may see a different value from every caller. A routine is pure
+    if its value only depends on its arguments, which is the case if:
+        - it only reads its parameters, and the variables it has assigned before
+          (every assignment in BLAST is local to the routine)
+        - it does not print, and does not declare routines
+        - it only calls pure routines, by names that have a single definition
+          (so that the call cannot find another routine at run time), and
+          builtin functions (see blast.builtins) whose names no routine has, as
+          a routine of the same name would be called instead once defined
+
+    The facts found about each routine are remembered, so that routines defined
+    by earlier programs are not walked again, for as long as the routine is alive.
+    """
+
+    def __init__(self):
+        """Initialize the PurityAnalysis."""
+        self._facts = weakref.WeakKeyDictionary()  # RoutineStmtAST -> _Facts
+
+    def analyze(self, ast: AST, defined=()) -> set:
+        """Find the pure routines of a program.
+
+        Args:
+            ast (AST): The abstract syntax tree of the program.
+            defined (Iterable[RoutineStmtAST]): The routines defined already, which
+                the program may call.
+
+        Returns:
+            set[RoutineStmtAST]: The pure routines, of the program and of defined.
+        """
+        # the routines declared in the defined ones may be defined later too
+        routines = []
+        for routine in defined:
+            self._collect(routine, routines)
+        self._collect(ast, routines)
+
+        definitions = {}
+        for routine in routines:
+            definitions.setdefault(routine.name, set()).add(routine)
+
+        # assume every routine is pure, and remove the impure ones until none is
+        # left, so that (mutually) recursive routines can be pure
+        pure = {routine for routine in routines if self._facts_of(routine).pure}
+        changed = True
+        while changed:
+            changed = False
+            for routine in list(pure):
+                for name in self._facts_of(routine).calls:
+                    callees = definitions.get(name, ())
+                    if name in BUILTINS and not callees:
+                        continue  # a builtin function, which is pure
+                    if name in BUILTINS or len(callees) != 1 or not callees <= pure:
+                        pure.discard(routine)
+                        changed = True
+                        break
+        return pure
+
+    def shadows_builtin(self, ast: AST) -> bool:
+        """Check whether a program declares a routine with the name of a builtin
+        function, which the routines that called the function call instead.
+
+        Args:
+            ast (AST): The abstract syntax tree of the program.
+
+        Returns:
+            bool: Whether a routine of the program (nested ones included) has the
+                name of a builtin function.
+        """
+        routines = []
+        self._collect(ast, routines)
+        return any(routine.name in BUILTINS for routine in routines)
+
+    def _collect(self, node, routines):
+        # collect the routines declared in a tree (including nested ones)
+        if isinstance(node, RoutineStmtAST):
+            routines.append(node)
+            self._collect(node.body, routines)
+        elif isinstance(node, BlockStmtAST):
+            for statement in node.stmts:
+                self._collect(statement, routines)
+        elif isinstance(node, IfStmtAST):
+            self._collect(node.then_block, routines)
+            if node.else_block:
+                self._collect(node.else_block, routines)
+        elif isinstance(node, WhileStmtAST):
+            self._collect(node.body, routines)
+
+    def _facts_of(self, routine):
+        facts = self._facts.get(routine)
+        if facts is None:
+            checker = _Checker(routine.args)
+            routine.body.accept(checker)
+            facts = self._facts[routine] = _Facts(checker.pure, frozenset(checker.calls))
+        return facts
+
+
+class _Checker:
+    # walks the body of a routine in the order it is evaluated, tracking the
+    # variables that are assigned for sure at each point
+
+    def __init__(self, params):
+        self.pure = True
+        self.calls = set()
+        self._assigned = set(params)
+
+    def visit_binary_expr(self, expr: BinaryExprAST):
+        expr.rhs.accept(self)
+        if expr.op == TokenType.COLON and isinstance(expr.lhs, VariableExprAST):
+            self._assigned.add(expr.lhs.name)
+        else:
+            expr.lhs.accept(self)
+
+    def visit_unary_expr(self, expr: UnaryExprAST):
+        expr.expr.accept(self)
+
+    def visit_number_expr(self, expr: NumberExprAST):
+        pass
+
+    def visit_string_expr(self, expr: StringExprAST):
+        pass
+
+    def visit_variable_expr(self, expr: VariableExprAST):
+        if expr.name not in self._assigned:
+            self.pure = False  # may be a variable of a caller
+
+    def visit_call_expr(self, expr: CallExprAST):
+        if expr.name == "print":
+            self.pure = False
+        self.calls.add(expr.name)
+        for arg in expr.args:
+            arg.accept(self)
+
+    def visit_expr_stmt(self, stmt: ExprStmtAST):
+        stmt.expr.accept(self)
+
+    def visit_block_stmt(self, stmt: BlockStmtAST):
+        for statement in stmt.stmts:
+            statement.accept(self)
+
+    def visit_if_stmt(self, stmt: IfStmtAST):
+        stmt.cond.accept(self)
+        # the variables assigned in a branch may not be assigned after the if
+        self._branch(stmt.then_block)
+        if stmt.else_block:
+            self._branch(stmt.else_block)
+
+    def visit_while_stmt(self, stmt: WhileStmtAST):
+        stmt.cond.accept(self)
+        self._branch(stmt.body)
+
+    def visit_routine_stmt(self, stmt: RoutineStmtAST):
+        self.pure = False
+
+    def visit_return_stmt(self, stmt: ReturnStmtAST):
+        if stmt.value is not None:
+            stmt.value.accept(self)
+
+    def _branch(self, block):
+        assigned = set(self._assigned)
+        block.accept(self)
+        self._assigned = assigned
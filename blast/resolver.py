@@ -0,0 +1,252 @@
+"""Scope resolver for the BLAST language.
+
+This module contains the Resolver class, which is used to find the local variables
+of every routine before a program runs, so that the engines can store them in the
+slots of a Frame, and to report the variables that can never be defined.
+"""
+
+import threading
+import weakref
+from typing import Iterable
+from .token import TokenType
+from .ast import *
+
+"""The lock held while routines are annotated, so that a routine shared by several
+interpreters (e.g. through a ParseCache) is annotated once, by one of them."""
+_LOCK = threading.RLock()
+
+
+def _children(node):
+    # the child nodes of a node, in the order in which they are evaluated
+    if isinstance(node, BinaryExprAST):
+        return node.rhs, node.lhs
+    if isinstance(node, UnaryExprAST):
+        return node.expr,
+    if isinstance(node, CallExprAST):
+        return node.args
+    if isinstance(node, ExprStmtAST):
+        return node.expr,
+    if isinstance(node, BlockStmtAST):
+        return node.stmts
+    if isinstance(node, IfStmtAST):
+        if node.else_block:
+            return node.cond, node.then_block, node.else_block
+        return node.cond, node.then_block
+    if isinstance(node, WhileStmtAST):
+        return node.cond, node.body
+    if isinstance(node, RoutineStmtAST):
+        return node.body,
+    if isinstance(node, ReturnStmtAST) and node.value is not None:
+        return node.value,
+    return ()
+
+
+def _assigned(node, names, routines=True):
+    # collect the names of the variables assigned in a node; the bodies of the
+    # routines declared in it are skipped if routines is False
+    if isinstance(node, BinaryExprAST) and node.op == TokenType.COLON:
+        if isinstance(node.lhs, VariableExprAST):
+            names[node.lhs.name] = None
+    if isinstance(node, RoutineStmtAST):
+        if not routines:
+            return names
+        names.update(dict.fromkeys(node.args))
+    for child in _children(node):
+        _assigned(child, names, routines)
+    return names
+
+
+def _may_be_none(expr, assigned):
+    # whether an expression may evaluate to None; variables cannot be assigned
+    # None, but parameters can be passed None (e.g. the value of print())
+    if isinstance(expr, (NumberExprAST, StringExprAST, BinaryExprAST)):
+        return False
+    if isinstance(expr, VariableExprAST):
+        return expr.name not in assigned
+    if isinstance(expr, UnaryExprAST):
+        return expr.op != TokenType.MINUS and _may_be_none(expr.expr, assigned)
+    return True  # a call
+
+
+def _live(stmt):
+    # the index of the first statement of the body of a routine whose value may be
+    # the value of the routine; as that is the last value of the body that is not
+    # None, the statements before the last one that is never None do not matter
+    live = 0
+    assigned = {}  # the variables assigned for sure, so never None
+    for index, statement in enumerate(stmt.body.stmts):
+        if isinstance(statement, ExprStmtAST):
+            if not _may_be_none(statement.expr, assigned):
+                live = index
+            _assigned(statement.expr, assigned)
+        elif isinstance(statement, (WhileStmtAST, BlockStmtAST)):
+            live = index  # a list
+        elif isinstance(statement, IfStmtAST) and statement.else_block is not None:
+            live = index  # a list, whichever the branch
+    return live
+
+
+def _layout(stmt):
+    # the slots of the local variables of a routine, the number of slots, and the
+    # index of the first statement whose value may be the value of the routine;
+    # the arguments are in the first slots, in order, and a repeated parameter
+    # name refers to the last argument with that name
+    slots = {name: index for index, name in enumerate(stmt.args)}
+    size = len(stmt.args)
+    for name in _assigned(stmt.body, {}, routines=False):
+        if name not in slots:
+            slots[name] = size
+            size += 1
+    return slots, size, _live(stmt)
+
+
+def _publish(stmt, layout, size, live):
+    # the layout is set last, as it marks the routine as resolved
+    stmt.live, stmt.size = live, size
+    stmt.layout = layout
+
+
+def resolve_layout(stmt: RoutineStmtAST) -> dict:
+    """Compute the layout of the local variables of a routine, if not known yet.
+
+    Args:
+        stmt (RoutineStmtAST): The routine.
+
+    Returns:
+        dict[str, int]: The slot of each local variable. The layout and the number
+            of slots are also stored in the routine, and so is the index of the
+            first statement of the body whose value may be the value of the
+            routine (the statements before it run without keeping their values).
+    """
+    if stmt.layout is None:
+        with _LOCK:
+            if stmt.layout is None:
+                _publish(stmt, *_layout(stmt))
+    return stmt.layout
+
+
+class Resolver:
+    """The scope resolver for the BLAST language.
+
+    BLAST is dynamically scoped: a routine sees the variables of its callers, so
+    only the variables a routine binds itself (its parameters and the variables it
+    assigns) are known before it runs. The resolver gives each of them a slot in
+    the layout of the routine, and annotates the variable nodes of the routine with
+    their slot. Every other variable is still looked up by name at run time.
+
+    A variable that is read, but never assigned in the program, not a parameter of
+    any routine, and not defined already, can never be found; the resolver reports
+    it before the program runs, and so is a return statement outside of a routine.
+    A program may also use the variables defined already and those bound by the
+    routines defined already (e.g. in the REPL), which may call it.
+
+    A routine is annotated the first time it is resolved, and its nodes are not
+    written to again, so a tree can be resolved while other threads run it.
+    """
+
+    def __init__(self):
+        """Initialize the Resolver."""
+        self._bound = frozenset()  # the names bound while a program is resolved
+        self._names = weakref.WeakKeyDictionary()  # the names bound by each routine
+        self._layout = None  # the layout of the routine being resolved
+        self._annotate = False  # whether the routine being resolved is annotated
+
+    def resolve(self, ast: AST, defined: Iterable[str] = (),
+                routines: Iterable[RoutineStmtAST] = ()) -> AST:
+        """Resolve the variables of an abstract syntax tree.
+
+        Args:
+            ast (AST): The abstract syntax tree to resolve. Its nodes are annotated
+                in place.
+            defined (Iterable[str]): The names of the variables defined already,
+                e.g. in the global symbol table.
+            routines (Iterable[RoutineStmtAST]): The routines defined already,
+                whose parameters and variables the program may read if they call
+                it.
+
+        Returns:
+            AST: The annotated abstract syntax tree.
+
+        Raises:
+            Exception: If a variable of the program can never be defined.
+        """
+        bound = set(defined)
+        bound.update(_assigned(ast, {}))
+        for routine in routines:
+            names = self._names.get(routine)
+            if names is None:
+                names = self._names[routine] = frozenset(_assigned(routine, {}))
+            bound |= names
+        self._bound = bound
+        self._layout = None
+        self._annotate = False
+        try:
+            with _LOCK:
+                ast.accept(self)
+        finally:
+            self._bound = frozenset()
+        return ast
+
+    def visit_binary_expr(self, expr: BinaryExprAST):
+        expr.rhs.accept(self)
+        if expr.op == TokenType.COLON and isinstance(expr.lhs, VariableExprAST):
+            # an assignment target is not read
+            if self._annotate:
+                expr.lhs.slot = self._layout.get(expr.lhs.name)
+        else:
+            expr.lhs.accept(self)
+
+    def visit_unary_expr(self, expr: UnaryExprAST):
+        expr.expr.accept(self)
+
+    def visit_number_expr(self, expr: NumberExprAST):
+        pass
+
+    def visit_string_expr(self, expr: StringExprAST):
+        pass
+
+    def visit_variable_expr(self, expr: VariableExprAST):
+        if expr.name not in self._bound:
+            raise Exception(f"Undefined variable '{expr.name}'")
+        if self._annotate:
+            expr.slot = self._layout.get(expr.name)
+
+    def visit_call_expr(self, expr: CallExprAST):
+        for arg in expr.args:
+            arg.accept(self)
+
+    def visit_expr_stmt(self, stmt: ExprStmtAST):
+        stmt.expr.accept(self)
+
+    def visit_block_stmt(self, stmt: BlockStmtAST):
+        for statement in stmt.stmts:
+            statement.accept(self)
+
+    def visit_if_stmt(self, stmt: IfStmtAST):
+        stmt.cond.accept(self)
+        stmt.then_block.accept(self)
+        if stmt.else_block:
+            stmt.else_block.accept(self)
+
+    def visit_while_stmt(self, stmt: WhileStmtAST):
+        stmt.cond.accept(self)
+        stmt.body.accept(self)
+
+    def visit_return_stmt(self, stmt: ReturnStmtAST):
+        if self._layout is None:
+            raise Exception("Cannot return outside of a routine")
+        if stmt.value is not None:
+            stmt.value.accept(self)
+
+    def visit_routine_stmt(self, stmt: RoutineStmtAST):
+        enclosing, annotate = self._layout, self._annotate
+        if stmt.layout is not None:
+            # resolved already; the body is only checked
+            self._layout, self._annotate = stmt.layout, False
+            stmt.body.accept(self)
+        else:
+            layout, size, live = _layout(stmt)
+            self._layout, self._annotate = layout, True
+            stmt.body.accept(self)
+            _publish(stmt, layout, size, live)
+        self._layout, self._annotate = enclosing, annotate
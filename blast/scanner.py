@@ -1,23 +1,51 @@
 """Scanner module for lexical analysis of the input stream.
 
 This module contains the Scanner class, which is used to scan the input stream
-and return a list of tokens.
+and return a sequence of tokens, or to produce them lazily one at a time.
 """
 
 import re
-from .token import Token, TokenType
+from sys import intern
+from typing import Iterator
+from .token import LineIndex, Token, TokenBuffer, TokenType
+
+
+def _compile(patterns):
+    """Compile a dictionary of token patterns into a single master regex.
+
+    Every pattern is wrapped in a named group, so the outer group of a match tells
+    which token type matched and the group right after it holds the lexeme.
+
+    Args:
+        patterns (dict[TokenType, str]): The token types and their patterns, in
+            order of priority.
+
+    Returns:
+        tuple[re.Pattern, list[TokenType]]: The master regex and a list mapping
+            the index of each outer group to its token type.
+    """
+    master = re.compile("|".join(f"(?P<{token_type.name}>{pattern})"
+                                 for token_type, pattern in patterns.items()))
+    types = [None] * (master.groups + 1)
+    for token_type in patterns:
+        types[master.groupindex[token_type.name]] = token_type
+    return master, types
 
 
 class Scanner:
     """Scanner class for lexical analysis of the input stream.
 
-    Uses regular expressions to recognize tokens.
+    Uses regular expressions to recognize tokens. All the patterns are compiled
+    once into a single master regex, which is matched in place against the source
+    code, so scanning takes time linear in the size of the source.
     """
 
     """A dictionary of token types and their corresponding regular expressions."""
     PATTERNS = {
         TokenType.NUMBER: r"(\d+(?:\.\d+)?)",
         TokenType.STRING: r"\"([^\"]*)\"",
+        # keywords are matched as identifiers, then looked up in KEYWORDS
+        TokenType.IDENTIFIER: r"(\w+)",
         TokenType.PLUS: r"(\+)",
         TokenType.MINUS: r"(-)",
         # must be before TokenType.MUL to avoid matching **
@@ -31,69 +59,127 @@ class Scanner:
         TokenType.GE: r"(>=)",
         TokenType.LT: r"(<)",
         TokenType.GT: r"(>)",
-        # must be before TokenType.LE and TokenType.GE to avoid matching <= and >=
+        # must be after TokenType.LE and TokenType.GE to avoid matching <= and >=
         TokenType.EQ: r"(=)",
         TokenType.PERIOD: r"(\.)",
         TokenType.LPAREN: r"(\()",
         TokenType.RPAREN: r"(\))",
-        TokenType.IF: r"(if)",
-        TokenType.THEN: r"(then)",
-        TokenType.ELSE: r"(else)",
-        TokenType.END: r"(end)",
-        TokenType.WHILE: r"(while)",
-        TokenType.DO: r"(do)",
-        TokenType.ROUTINE: r"(routine)",
-        # must be last to avoid matching keywords
-        TokenType.IDENTIFIER: r"(\w+)"
     }
 
-    def __init__(self, source: str):
+    """A dictionary of reserved words and their corresponding token types."""
+    KEYWORDS = {
+        "if": TokenType.IF,
+        "then": TokenType.THEN,
+        "else": TokenType.ELSE,
+        "end": TokenType.END,
+        "while": TokenType.WHILE,
+        "do": TokenType.DO,
+        "routine": TokenType.ROUTINE,
+        "return": TokenType.RETURN,
+    }
+
+    _MASTER, _TYPES = _compile(PATTERNS)
+    _WHITESPACE = re.compile(r"\s*")
+
+    def __init__(self, source, chunk_size: int = 64 * 1024):
         """Creates a new scanner instance.
 
         Args:
-            source (str): The source code to be scanned.
+            source (str | TextIO): The source code to be scanned, either as a string
+                or as a file object to read from.
+            chunk_size (int): The number of characters to read from a file object
+                at a time.
         """
         self._source = source
-        self._tokens = []
+        self._chunk_size = chunk_size
         self._current = 0
+        # a string is indexed on demand, a file is indexed as it is read
+        self._lines = LineIndex(source if isinstance(source, str) else None)
+
+    def __iter__(self):
+        return self.iter_tokens()
 
-    def scan_tokens(self) -> list[Token]:
-        """Scans the source code and returns a list of tokens.
+    def scan_tokens(self) -> TokenBuffer:
+        """Scans the source code and returns a sequence of tokens.
 
         Returns:
-            list[Token]: A list of tokens.
+            TokenBuffer: A sequence of tokens.
         """
-        # compile all the patterns
-        while not self._is_at_end():
-            self._scan_token()
-
-        return self._tokens
-
-    def _is_at_end(self):
-        # current index is greater than the length of the source code
-        return self._current >= len(self._source)
+        tokens = TokenBuffer(self._lines)
+        tokens.extend(self._scan())
+        return tokens
 
-    def _advance(self):
-        if self._is_at_end():
-            return  # do not do anything if at end of source code
+    def iter_tokens(self) -> Iterator[Token]:
+        """Scans the source code lazily, yielding one token at a time.
 
-        self._current += 1  # increment current index
+        If the source is a file object, it is read in chunks as the tokens are
+        consumed, so only the current chunk is held in memory.
 
-    def _skip_whitespace(self):
-        while self._source[self._current].isspace():
-            self._advance()
-
-    def _scan_token(self):
-        self._skip_whitespace()
-
-        # match next token to a pattern in PATTERNS dict
-        # if match found, create a token and append to tokens list
-        # if no match found, raise an error
-        for token_type, pattern in self.PATTERNS.items():
-            match = re.match(pattern, self._source[self._current:])
-            if match:
-                self._tokens.append(Token(token_type, match.group(1)))
-                self._current += match.end()
-                return
-
-        raise Exception(f"Unexpected character: {self._source[self._current]}")
+        Yields:
+            Token: The next token.
+        """
+        lines = self._lines
+        for token_type, lexeme, start in self._scan():
+            yield Token(token_type, lexeme, start, lines)
+
+    def _scan(self):
+        # yields (type, lexeme, start) for every token in the source
+        if isinstance(self._source, str):
+            buffer, read = self._source, None
+        else:
+            buffer, read = "", self._source.read
+
+        # look everything up once; this loop runs once per token
+        skip = self._WHITESPACE.match
+        match = self._MASTER.match
+        types = self._TYPES
+        keywords = self.KEYWORDS
+        chunk_size = self._chunk_size
+        lines = self._lines
+
+        base = 0        # offset of the buffer in the source
+        current = 0     # offset of the next token in the buffer
+        length = len(buffer)
+        # a token ending past the limit may continue in the next chunk (the longest
+        # lookahead is a number such as "1.5" cut after the period)
+        limit = length if read is None else length - 2
+
+        while True:
+            current = skip(buffer, current).end()
+            m = match(buffer, current)
+
+            if (m is None or m.end() > limit) and read is not None:
+                # drop the scanned part of the buffer and read the next chunk
+                chunk = read(chunk_size)
+                if not chunk:
+                    read = None
+                lines.feed(chunk, base + length)
+                base += current
+                buffer = buffer[current:] + chunk
+                current = 0
+                length = len(buffer)
+                limit = length if read is None else length - 2
+                continue
+
+            if current >= length:
+                self._current = base + current
+                break
+            # if no pattern matches, raise an error
+            if m is None:
+                self._current = base + current
+                line, column = lines.locate(base + current)
+                raise Exception(f"Unexpected character: {buffer[current]} "
+                                f"at line {line}, column {column}")
+
+            # the outer group is the token type, the one after it is the lexeme
+            index = m.lastindex
+            token_type = types[index]
+            lexeme = m.group(index + 1)
+            if token_type is TokenType.IDENTIFIER:
+                token_type = keywords.get(lexeme, token_type)
+            # share repeated lexemes (string literals are kept as they are)
+            if token_type is not TokenType.STRING:
+                lexeme = intern(lexeme)
+
+            yield token_type, lexeme, base + current
+            current = m.end()
@@ -0,0 +1,295 @@
+"""JSON-lines server for the BLAST language.
+
+This module contains the Server class, which runs BLAST programs sent to it as JSON
+requests, one per line, and answers each with a JSON response on a line of its own.
+It serves its standard input and output, or the connections to a Unix domain socket
+with several worker processes, and keeps its interpreter (and the programs it has
+parsed) warm between requests, so a request does not pay for starting Python.
+
+A request is an object with the keys:
+    - "program" (str): the source code of the program to run
+    - "bindings" (object, optional): the values of variables of the program, by name
+    - "engine" (str, optional): the engine to run the program with
+    - "id" (any, optional): echoed in the response, to match it with the request
+
+The response has the "id" of the request, and either "value" (the list of the
+values of the statements of the program, as evaluate() returns it) and "output"
+(what the program printed), or "error" (the message of the error it raised). Every
+request runs within a budget (see blast.budget), so that no request can hold a
+worker for long, and every response is valid JSON.
+"""
+
+import contextlib
+import io
+import json
+import os
+import selectors
+import signal
+import socket
+import stat
+import sys
+from .arrays import Array
+from .budget import Budget
+from .interpreter import Interpreter
+
+"""The default budget of a request."""
+BUDGET = Budget(seconds=10, memory=256 * 1024 * 1024)
+
+
+def _encode(value):
+    # the JSON representation of the values json cannot encode by itself
+    if isinstance(value, Array):
+        return list(value)
+    return repr(value)
+
+
+def _constant(name):
+    # JSON has no NaN nor infinities, which json reads by default
+    raise ValueError(f"Invalid number {name}")
+
+
+def _dumps(response):
+    # the JSON of a response; a value that is not a valid JSON number (NaN or an
+    # infinity) makes it an error
+    try:
+        return json.dumps(response, default=_encode, allow_nan=False)
+    except ValueError as e:
+        return json.dumps({"id": response["id"], "error": f"Invalid value: {e}"})
+
+
+class _Connection:
+    # a connection to the socket of a server, with the bytes received and not yet
+    # answered, and the responses not yet sent
+    __slots__ = ("socket", "received", "unsent", "ended", "events")
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.received = bytearray()
+        self.unsent = bytearray()
+        self.ended = False  # whether the client has sent everything
+        self.events = selectors.EVENT_READ  # the events the connection waits for
+
+    def receive(self):
+        # read what the client has sent; at its end, an unfinished last line is
+        # a request too
+        try:
+            data = self.socket.recv(65536)
+        except BlockingIOError:
+            return
+        if not data:
+            self.ended = True
+            if self.received and not self.received.endswith(b"\n"):
+                self.received += b"\n"
+        self.received += data
+
+    def request(self):
+        # take the next complete request received, or None
+        end = self.received.find(b"\n")
+        if end < 0:
+            return None
+        line = self.received[:end + 1].decode("utf-8", "replace")
+        del self.received[:end + 1]
+        return line
+
+    def send(self):
+        # send as much of the responses as the socket takes
+        try:
+            sent = self.socket.send(self.unsent)
+        except BlockingIOError:
+            return
+        del self.unsent[:sent]
+
+    def drop(self):
+        # the connection broke: nothing more is answered or sent
+        self.ended = True
+        self.received.clear()
+        self.unsent.clear()
+
+
+class Server:
+    """The JSON-lines server for the BLAST language.
+
+    Every request runs in a fresh symbol table (see Interpreter.evaluate_batch()),
+    so the variables and routines of a request are not seen by the next ones, and
+    within a budget, which stops a request that runs too long or uses too much
+    memory. The trees of the programs are kept in the parse cache of the
+    interpreter, so a program sent again is not parsed again.
+    """
+
+    def __init__(self, interpreter: Interpreter = None, budget: Budget = BUDGET):
+        """Initialize the Server.
+
+        Args:
+            interpreter (Interpreter?): The interpreter running the programs. A new
+                one is created if not provided.
+            budget (Budget?): The limits of the resources a request may use, or None
+                for no limits. Requests with a budget run on the "vm" engine.
+        """
+        self._interpreter = interpreter if interpreter is not None else Interpreter()
+        self._budget = budget
+
+    def handle(self, line: str) -> str:
+        """Run the program of a request.
+
+        Args:
+            line (str): The request, as a JSON object.
+
+        Returns:
+            str: The response, as a JSON object (without a newline).
+        """
+        try:
+            request = json.loads(line, parse_constant=_constant)
+        except ValueError as e:
+            return json.dumps({"id": None, "error": f"Invalid request: {e}"})
+        if not isinstance(request, dict):
+            return json.dumps({"id": None, "error": "Invalid request: expected an object"})
+
+        response = {"id": request.get("id")}
+        bindings = request.get("bindings") or {}
+        if not isinstance(request.get("program"), str) or not isinstance(bindings, dict):
+            response["error"] = "Invalid request: expected a program, and bindings as an object"
+            return _dumps(response)
+
+        output = io.StringIO()
+        try:
+            # what the program prints is part of the response
+            with contextlib.redirect_stdout(output):
+                results = self._interpreter.evaluate_batch(
+                    request["program"], [bindings], request.get("engine"), self._budget)
+            response["value"] = results[0]
+            response["output"] = output.getvalue()
+        except Exception as e:
+            response["error"] = str(e)
+        return _dumps(response)
+
+    def serve(self, reader, writer):
+        """Answer the requests read from a stream until it ends.
+
+        Args:
+            reader (TextIO): The stream to read the requests from, one per line.
+            writer (TextIO): The stream to write the responses to, one per line.
+        """
+        for line in reader:
+            if not line.strip():
+                continue
+            writer.write(self.handle(line) + "\n")
+            writer.flush()
+
+    def serve_unix(self, path: str, workers: int = 1):
+        """Answer the requests sent to a Unix domain socket, until interrupted.
+
+        The socket is created, and the process forks into the given number of
+        worker processes (including itself), which accept the connections to the
+        socket. A worker serves all of its connections at once: it answers one
+        request of each connection that has one in turn, so an idle connection
+        does not hold a worker, and there may be more connections than workers.
+        The workers are forked once everything is imported and the interpreter is
+        created, so they start warm.
+
+        Args:
+            path (str): The path of the socket. A socket left at that path (e.g. by
+                a server that was killed) is replaced.
+            workers (int): The number of worker processes.
+
+        Raises:
+            Exception: The path exists, and is not a socket.
+        """
+        if os.path.exists(path):
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                raise Exception(f"{path} exists and is not a socket")
+            os.unlink(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(128)
+
+        # a terminated server stops its workers and removes its socket, as an
+        # interrupted one does
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        children = []
+        try:
+            for _ in range(workers - 1):
+                pid = os.fork()
+                if pid == 0:
+                    try:
+                        self._accept(listener)
+                    finally:
+                        os._exit(0)
+                children.append(pid)
+            self._accept(listener)
+        finally:
+            for pid in children:
+                with contextlib.suppress(ProcessLookupError):
+                    os.kill(pid, signal.SIGTERM)
+                    os.waitpid(pid, 0)
+            listener.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+
+    def _accept(self, listener):
+        # serve the connections to a listening socket (shared with the other
+        # workers), multiplexing them; a connection is not read from while it has
+        # a request to answer, and its next request is not answered before the
+        # last response is sent, so a client that does not read its responses
+        # only holds itself back
+        listener.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(listener, selectors.EVENT_READ)
+        waiting = {}  # the connections with a request to answer, in turn
+        while True:
+            for key, events in selector.select(0 if waiting else None):
+                if key.fileobj is listener:
+                    try:
+                        sock, _ = listener.accept()
+                    except BlockingIOError:
+                        continue  # accepted by another worker
+                    sock.setblocking(False)
+                    connection = _Connection(sock)
+                    selector.register(sock, connection.events, connection)
+                    continue
+                connection = key.data
+                try:
+                    if events & selectors.EVENT_READ:
+                        connection.receive()
+                    if events & selectors.EVENT_WRITE:
+                        connection.send()
+                except ConnectionError:
+                    connection.drop()
+                self._update(selector, connection, waiting)
+
+            for connection in list(waiting):
+                line = connection.request()
+                if line.strip():
+                    connection.unsent += (self.handle(line) + "\n").encode()
+                    try:
+                        connection.send()
+                    except ConnectionError:
+                        connection.drop()
+                self._update(selector, connection, waiting)
+
+    @staticmethod
+    def _update(selector, connection, waiting):
+        # wait for the events a connection needs now, or close it once it has
+        # ended and everything is answered
+        complete = b"\n" in connection.received
+        if complete and not connection.unsent:
+            waiting[connection] = None
+        else:
+            waiting.pop(connection, None)
+        events = 0
+        if not connection.ended and not complete:
+            events |= selectors.EVENT_READ
+        if connection.unsent:
+            events |= selectors.EVENT_WRITE
+        if not events and not complete:
+            if connection.events:
+                selector.unregister(connection.socket)
+            connection.socket.close()
+        elif events != connection.events:
+            if connection.events:
+                if events:
+                    selector.modify(connection.socket, events, connection)
+                else:
+                    selector.unregister(connection.socket)
+            else:
+                selector.register(connection.socket, events, connection)
+            connection.events = events
@@ -1,13 +1,27 @@
 """Symbol table implementation for use by the interpreter.
 
 This module contains the SymbolTable class, which is used by the interpreter to store
-variables and their values. It is a simple implementation of a symbol table.
+variables and their values. It is a simple implementation of a symbol table. It also
+contains the Frame class, a symbol table for the activation of a routine, which
+stores the local variables of the routine in a fixed-size list.
 """
 
 from enum import IntEnum, auto
 from typing import Any
 
 
+_MISSING = object()  # marks a symbol missing from a table
+
+
+class _Return:
+    # the value of a return statement, passed up by the blocks and loops that the
+    # statement leaves until it reaches the routine (no exception is raised)
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
 class SymbolType(IntEnum):
     """The type of a symbol."""
     VARIABLE = auto()
@@ -21,6 +35,8 @@ class SymbolTable:
         """Initializes the symbol table."""
         self._symbols = {}
         self._parent = parent
+        self._scope = parent  # the nearest enclosing table that may have symbols
+        self._layout = None  # only frames have slots
 
     def __repr__(self):
         return f"{self._symbols!r}"
@@ -38,14 +54,105 @@ class SymbolTable:
         Raises:
             KeyError: The symbol does not exist.
         """
-        try:
-            return self._symbols[(name, type)]
-        except KeyError:
-            if self._parent is not None:
-                return self._parent.get(name, type)
-            else:
-                raise KeyError(
-                    f"Symbol {name!r} of type {type!r} does not exist")
+        key = (name, type)
+        table = self
+        if type != SymbolType.VARIABLE:
+            # walk up the chain of parents until the symbol is found, skipping the
+            # frames that have no symbols outside their slots
+            while table is not None:
+                value = table._symbols.get(key, _MISSING)
+                if value is not _MISSING:
+                    return value
+                table = table._scope
+        else:
+            # the same, but the local variables of a frame are in its slots
+            while table is not None:
+                value = table._symbols.get(key, _MISSING)
+                if value is not _MISSING:
+                    return value
+                if table._layout is not None:
+                    index = table._layout.get(name)
+                    if index is not None and table.slots[index] is not _MISSING:
+                        return table.slots[index]
+                table = table._parent
+        raise KeyError(f"Symbol {name!r} of type {type!r} does not exist")
+
+    def set(self, name, type, value):
+        """Set the value of a symbol.
+
+        Args:
+            name (str): The name of the symbol.
+            type (SymbolType): The type of the symbol.
+            value (Any): The value to set the symbol to.
+        """
+        self._symbols[(name, type)] = value
+
+    def updated(self, table):
+        """Get a copy of this table, with the symbols of another table set in it.
+
+        Args:
+            table (SymbolTable): The table whose symbols are set (its parents are
+                ignored).
+
+        Returns:
+            SymbolTable: The new table, with the same parent as this one.
+        """
+        copy = SymbolTable(self._parent)
+        copy._symbols = {**self._symbols, **table._symbols}
+        return copy
+
+    def names(self, type):
+        """Get the names of the symbols of a type, in this table and its parents.
+
+        Args:
+            type (SymbolType): The type of the symbols.
+
+        Returns:
+            set[str]: The names of the symbols.
+        """
+        names = set()
+        table = self
+        while table is not None:
+            names.update(name for name, symbol_type in table._symbols if symbol_type == type)
+            if table._layout is not None and type == SymbolType.VARIABLE:
+                names.update(name for name, index in table._layout.items()
+                             if table.slots[index] is not _MISSING)
+            table = table._parent
+        return names
+
+
+class Frame(SymbolTable):
+    """The symbol table of the activation of a routine.
+
+    The variables the resolver found to be local to the routine (its parameters and
+    the variables it assigns) are stored in a fixed-size list, at the slots given by
+    the layout of the routine, so the engines read and write them by index. The
+    slots are still looked up by name from the routines it calls.
+    """
+
+    def __init__(self, parent, layout, size, values=()):
+        """Initializes the frame.
+
+        Args:
+            parent (SymbolTable): The symbol table of the caller.
+            layout (dict[str, int]): The slot of each local variable.
+            size (int): The number of slots.
+            values (Iterable[Any]): The values of the first slots (the arguments).
+        """
+        self._symbols = {}
+        self._parent = parent
+        # the tables of the callers do not change while this frame exists, so
+        # the empty ones never need to be searched (e.g. in deep recursion)
+        self._scope = parent if parent._symbols else parent._scope
+        self._layout = layout
+        self.slots = slots = list(values)
+        if len(slots) < size:
+            slots.extend([_MISSING] * (size - len(slots)))
+
+    def __repr__(self):
+        slots = {name: self.slots[index] for name, index in self._layout.items()
+                 if self.slots[index] is not _MISSING}
+        return f"{slots!r} {self._symbols!r}"
 
     def set(self, name, type, value):
         """Set the value of a symbol.
@@ -55,4 +162,9 @@ class SymbolTable:
             type (SymbolType): The type of the symbol.
             value (Any): The value to set the symbol to.
         """
+        if type == SymbolType.VARIABLE:
+            index = self._layout.get(name)
+            if index is not None:
+                self.slots[index] = value
+                return
         self._symbols[(name, type)] = value
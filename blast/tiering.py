@@ -0,0 +1,376 @@
+"""Native tier for the BLAST interpreter.
+
+This module contains the NativeCompiler class, which is used by the interpreter to
+translate hot routines and loops into Python source code, and to compile them into
+Python code objects. Hot code then runs as CPython bytecode instead of being
+walked node by node.
+"""
+
+from .token import TokenType
+from .ast import *
+from .symtab import _MISSING, _Return, SymbolType
+from .builtins import BUILTINS, Builtin, builtin
+
+"""The Python operators implementing the binary operators of BLAST."""
+PYTHON_OPERATORS = {
+    TokenType.PLUS: "+",
+    TokenType.MINUS: "-",
+    TokenType.MUL: "*",
+    TokenType.DIV: "/",
+    TokenType.MOD: "%",
+    TokenType.EXP: "**",
+    TokenType.EQ: "==",
+    TokenType.NE: "!=",
+    TokenType.LT: "<",
+    TokenType.LE: "<=",
+    TokenType.GT: ">",
+    TokenType.GE: ">=",
+}
+
+def _lookup(symtab, key):
+    # look a variable up in the enclosing symbol tables
+    try:
+        return symtab.get(*key)
+    except KeyError:
+        raise Exception(f"Undefined variable '{key[0]}'")
+
+
+def _store(symbols, key, value):
+    # if value is None, throw an error (can't assign None)
+    if value is None:
+        raise Exception("Cannot assign None")
+    symbols[key] = value
+    return value  # return the value assigned (for chaining)
+
+
+def _store_slot(slots, index, value):
+    # if value is None, throw an error (can't assign None)
+    if value is None:
+        raise Exception("Cannot assign None")
+    slots[index] = value
+    return value  # return the value assigned (for chaining)
+
+
+def _invalid_target(value):
+    raise Exception("Invalid assignment target")
+
+
+def _print(*args):
+    print(*args, sep=" ")
+
+
+def _resolve(symtab, name, argc):
+    # look a routine up and check the number of arguments, before they are evaluated
+    try:
+        func = symtab.get(name, SymbolType.FUNCTION)
+    except KeyError:
+        # no routine has the name; it may be a builtin function
+        return builtin(name, argc)
+    if len(func.args) != argc:
+        raise Exception(
+            f"Invalid number of arguments for function '{name}': expected {len(func.args)}, got {argc}")
+    return func
+
+
+def _call(interp, symtab, func, args):
+    # call a routine, or a builtin function (if no routine has its name)
+    if type(func) is Builtin:
+        return func(*args)
+    return interp._invoke(symtab, func, args)
+
+
+def _define(symtab, stmt):
+    symtab.set(stmt.name, SymbolType.FUNCTION, stmt)
+
+
+"""The names available to the generated code."""
+RUNTIME = {
+    "_lookup": _lookup,
+    "_store": _store,
+    "_store_slot": _store_slot,
+    "_invalid_target": _invalid_target,
+    "_print": _print,
+    "_resolve": _resolve,
+    "_call": _call,
+    "_define": _define,
+    "_MISSING": _MISSING,
+    "_Return": _Return,
+}
+
+
+class NativeCompiler:
+    """The native compiler for the BLAST interpreter.
+
+    This class translates the body of a routine, or a while loop, into the source
+    code of a Python function and compiles it. The function evaluates exactly as
+    the Interpreter does: it reads and writes the same symbol tables, produces the
+    same lists of values, and calls other routines through the Execution running
+    the program (see blast.interpreter).
+    Variables with a slot (see blast.resolver) are read and written by index.
+    Every operation of an expression is a statement of its own, which stores its
+    value in a local variable, so the generated code runs the operations in the
+    order the Interpreter does, and is not nested deeper than the statements.
+
+    A return statement is a Python return in the function of a routine; in the
+    function of a loop, it returns the value wrapped for the Interpreter to pass
+    up to the routine.
+    """
+
+    def __init__(self):
+        """Initialize the NativeCompiler."""
+        self._lines = []
+        self._constants = {}
+        self._routine = False
+        self._argc = 0
+        self._uses_slots = False
+        self._counter = 0
+
+    def compile_routine(self, stmt: RoutineStmtAST):
+        """Compile the body of a routine.
+
+        Args:
+            stmt (RoutineStmtAST): The routine to compile.
+
+        Returns:
+            Callable[[Execution, SymbolTable], Any]: The function running the body
+                in the symbol table of the call, which returns the value of the
+                routine (the last value of the body that is not None).
+        """
+        self._reset(argc=len(stmt.args), routine=True)
+        self._line(1, "symbols = symtab._symbols")
+        self._line(1, "slots = symtab.slots")
+        result = self._temp("v")
+        self._line(1, f"{result} = None")
+        for index, statement in enumerate(stmt.body.stmts):
+            # the statements before stmt.live cannot give the value
+            if index < stmt.live or isinstance(statement, (RoutineStmtAST, ReturnStmtAST)):
+                self._execute(statement, 1)
+                continue
+            value = self._statement(statement, 1)
+            self._line(1, f"if {value} is not None: {result} = {value}")
+        self._line(1, f"return {result}")
+        return self._build(f"routine_{stmt.name}", "interp, symtab", stmt.name)
+
+    def compile_loop(self, stmt: WhileStmtAST, values: bool = True):
+        """Compile a while loop, so it can continue after some iterations.
+
+        Args:
+            stmt (WhileStmtAST): The loop to compile.
+            values (bool): Whether the values of the iterations are kept.
+
+        Returns:
+            Callable[[Execution, SymbolTable, list], list]: The function running the
+                loop in a symbol table, which appends the values of the remaining
+                iterations to the given list and returns it. If values is False,
+                the function is given and returns None instead of a list. If a
+                return statement runs, the function returns its value as a
+                _Return instead.
+        """
+        self._reset(argc=0, routine=False)
+        self._line(1, "symbols = symtab._symbols")
+        if values:
+            self._loop(stmt, "results", 1)
+        else:
+            self._execute(stmt, 1)
+        if self._uses_slots:
+            # a loop in the body of a routine
+            self._lines.insert(1, "    slots = symtab.slots")
+        self._line(1, "return results")
+        return self._build("loop", "interp, symtab, results", "while")
+
+    def _reset(self, argc, routine):
+        self._lines = []
+        self._constants = {}
+        self._routine = routine
+        self._argc = argc
+        self._uses_slots = False
+        self._counter = 0
+
+    def _build(self, name, params, label):
+        # wrap the lines in a function definition and compile it
+        source = "\n".join([f"def {name}({params}):", *self._lines])
+        namespace = dict(RUNTIME)
+        for value, constant in self._constants.values():
+            namespace[constant] = value
+        exec(compile(source, f"<blast {label}>", "exec"), namespace)
+        function = namespace[name]
+        function.source = source
+        return function
+
+    def _line(self, indent, text):
+        self._lines.append("    " * indent + text)
+
+    def _temp(self, prefix):
+        self._counter += 1
+        return f"{prefix}{self._counter}"
+
+    def _constant(self, value):
+        # constants are passed to the generated code by name (the type is part of
+        # the key, so that 1, 1.0 and True are kept apart)
+        key = (type(value), value)
+        entry = self._constants.get(key)
+        if entry is None:
+            entry = self._constants[key] = (value, f"K{len(self._constants)}")
+        return entry[1]
+
+    def _is_safe(self, expr):
+        # evaluating a constant or a parameter (the arguments are in the first
+        # slots) has no effect and cannot fail, so it needs no statement
+        return (isinstance(expr, (NumberExprAST, StringExprAST)) or
+                isinstance(expr, VariableExprAST) and expr.slot is not None
+                and expr.slot < self._argc)
+
+    def _block(self, stmt: BlockStmtAST, indent):
+        # emit the statements of a block and return the name of its result list
+        results = self._temp("r")
+        self._line(indent, f"{results} = []")
+        for statement in stmt.stmts:
+            if isinstance(statement, (RoutineStmtAST, ReturnStmtAST)):
+                self._execute(statement, indent)
+                continue
+            value = self._statement(statement, indent)
+            self._line(indent, f"if {value} is not None: {results}.append({value})")
+        return results
+
+    def _statement(self, stmt, indent):
+        # emit a statement and return the name of its value
+        value = self._temp("v")
+        if isinstance(stmt, ExprStmtAST):
+            self._line(indent, f"{value} = {self._expression(stmt.expr, indent)}")
+        elif isinstance(stmt, IfStmtAST):
+            self._line(indent, f"if {self._expression(stmt.cond, indent)}:")
+            self._line(indent + 1, f"{value} = {self._block(stmt.then_block, indent + 1)}")
+            self._line(indent, "else:")
+            if stmt.else_block:
+                self._line(indent + 1, f"{value} = {self._block(stmt.else_block, indent + 1)}")
+            else:
+                self._line(indent + 1, f"{value} = None")
+        elif isinstance(stmt, WhileStmtAST):
+            self._line(indent, f"{value} = []")
+            self._loop(stmt, value, indent)
+        elif isinstance(stmt, BlockStmtAST):
+            self._line(indent, f"{value} = {self._block(stmt, indent)}")
+        else:
+            raise Exception(f"Cannot compile statement {stmt!r}")
+        return value
+
+    def _execute(self, stmt, indent):
+        # emit a statement whose value is not needed, without building the lists
+        # of the values of its blocks and loops
+        if isinstance(stmt, ExprStmtAST):
+            self._expression(stmt.expr, indent)  # its value has no effect
+        elif isinstance(stmt, RoutineStmtAST):
+            self._line(indent, f"_define(symtab, {self._constant(stmt)})")
+        elif isinstance(stmt, ReturnStmtAST):
+            value = self._expression(stmt.value, indent) if stmt.value is not None else "None"
+            self._line(indent, f"return {value}" if self._routine else f"return _Return({value})")
+        elif isinstance(stmt, BlockStmtAST):
+            for statement in stmt.stmts:
+                self._execute(statement, indent)
+        elif isinstance(stmt, IfStmtAST):
+            self._line(indent, f"if {self._expression(stmt.cond, indent)}:")
+            self._suite(stmt.then_block, indent + 1)
+            if stmt.else_block:
+                self._line(indent, "else:")
+                self._suite(stmt.else_block, indent + 1)
+        elif isinstance(stmt, WhileStmtAST):
+            self._while(stmt.cond, indent)
+            self._suite(stmt.body, indent + 1)
+        else:
+            raise Exception(f"Cannot compile statement {stmt!r}")
+
+    def _suite(self, stmt, indent):
+        # emit the body of a compound Python statement, which cannot be empty
+        count = len(self._lines)
+        self._execute(stmt, indent)
+        if len(self._lines) == count:
+            self._line(indent, "pass")
+
+    def _loop(self, stmt: WhileStmtAST, results, indent):
+        self._while(stmt.cond, indent)
+        self._line(indent + 1, f"{results}.append({self._block(stmt.body, indent + 1)})")
+
+    def _while(self, cond, indent):
+        # emit the head of a while loop; a condition that needs statements of its
+        # own runs them at the start of every iteration
+        start = len(self._lines)
+        self._line(indent, "while True:")
+        value = self._expression(cond, indent + 1)
+        if len(self._lines) == start + 1:
+            self._lines[start] = "    " * indent + f"while {value}:"
+        else:
+            self._line(indent + 1, f"if not {value}: break")
+
+    def _expression(self, expr, indent):
+        # emit the operations of expr and return a Python expression of its value,
+        # which has no effect: a constant, a parameter or a local variable
+        if isinstance(expr, (NumberExprAST, StringExprAST)):
+            return self._constant(expr.val)
+        if isinstance(expr, VariableExprAST):
+            key = self._constant((expr.name, SymbolType.VARIABLE))
+            if expr.slot is not None:
+                self._uses_slots = True
+                if expr.slot < self._argc:
+                    return f"slots[{expr.slot}]"
+                return self._read(f"slots[{expr.slot}]", key, indent)
+            return self._read(f"symbols.get({key}, _MISSING)", key, indent)
+        if isinstance(expr, UnaryExprAST):
+            operand = self._expression(expr.expr, indent)
+            if expr.op != TokenType.MINUS:
+                return operand
+            return self._assign(f"-{operand}", indent)
+        if isinstance(expr, BinaryExprAST):
+            return self._binary(expr, indent)
+        if isinstance(expr, CallExprAST):
+            if expr.name == "print":
+                args = "".join(f"{arg}, " for arg in self._operands(expr.args, indent))
+                return self._assign(f"_print({args})", indent)
+            # the routine is looked up (and its arity checked) before the args run
+            func = self._assign(f"_resolve(symtab, {expr.name!r}, {len(expr.args)})", indent)
+            args = "".join(f"{arg}, " for arg in self._operands(expr.args, indent))
+            if expr.name in BUILTINS:
+                # only calls by the names of builtin functions may call them
+                return self._assign(f"_call(interp, symtab, {func}, ({args}))", indent)
+            return self._assign(f"interp._invoke(symtab, {func}, ({args}))", indent)
+        raise Exception(f"Cannot compile expression {expr!r}")
+
+    def _binary(self, expr: BinaryExprAST, indent):
+        if expr.op == TokenType.COLON:
+            rhs = self._expression(expr.rhs, indent)
+            if not isinstance(expr.lhs, VariableExprAST):
+                return self._assign(f"_invalid_target({rhs})", indent)
+            if expr.lhs.slot is not None:
+                self._uses_slots = True
+                return self._assign(f"_store_slot(slots, {expr.lhs.slot}, {rhs})", indent)
+            key = self._constant((expr.lhs.name, SymbolType.VARIABLE))
+            return self._assign(f"_store(symbols, {key}, {rhs})", indent)
+
+        # right-hand side first, as the interpreter does
+        rhs, lhs = self._operands([expr.rhs, expr.lhs], indent)
+        return self._assign(f"{lhs} {PYTHON_OPERATORS[expr.op]} {rhs}", indent)
+
+    def _operands(self, exprs, indent):
+        # emit expressions in order and return the Python expressions of their
+        # values; a parameter read before an expression that may assign it is
+        # copied, so that the later assignment does not change the value read
+        values = []
+        for index, expr in enumerate(exprs):
+            value = self._expression(expr, indent)
+            if (isinstance(expr, VariableExprAST) and self._is_safe(expr)
+                    and not all(self._is_safe(later) for later in exprs[index + 1:])):
+                value = self._assign(value, indent)
+            values.append(value)
+        return values
+
+    def _read(self, source, key, indent):
+        # emit the read of a variable, looked up in the enclosing symbol tables if
+        # it is missing from source
+        temp = self._assign(source, indent)
+        self._line(indent, f"if {temp} is _MISSING: {temp} = _lookup(symtab, {key})")
+        return temp
+
+    def _assign(self, source, indent):
+        # emit an operation, and return the local variable holding its value
+        temp = self._temp("t")
+        self._line(indent, f"{temp} = {source}")
+        return temp
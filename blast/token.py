@@ -1,10 +1,18 @@
 """Token structure and token types.
 
-This module contains the Token class, which represents a token, and the TokenType
-enum, which represents the different types of tokens.
+This module contains the Token class, which represents a token, the TokenType
+enum, which represents the different types of tokens, the TokenBuffer class, which
+stores a sequence of tokens compactly, the LineIndex class, which maps source
+offsets to lines and columns, and the TokenStream class, which is used to consume
+tokens lazily.
 """
 
+from array import array
+from bisect import bisect_right
+from collections import deque
+from collections.abc import Sequence
 from enum import IntEnum, auto
+from typing import Iterable
 
 
 class Token:
@@ -13,14 +21,21 @@ class Token:
     A token is a lexical unit of a programming language. It is a sequence of characters
     that have a meaning in the programming language. For example, the token '1' is a
     NUMBER token, and the token '+' is a PLUS token.
+
+    Tokens only store the offset at which they start in the source code; the line
+    and column are looked up in the LineIndex of the source when asked for.
     """
 
-    def __init__(self, type, lexeme):
+    __slots__ = ("type", "lexeme", "start", "_lines")
+
+    def __init__(self, type, lexeme, start=None, lines=None):
         """Creates a new token.
 
         Args:
             type (TokenType): The type of the token.
             lexeme (Any): The lexeme of the token.
+            start (int?): The offset of the token in the source code.
+            lines (LineIndex?): The line index of the source code.
 
         Notes:
             Technically, the lexeme can be any type, but it is usually a string,
@@ -29,6 +44,8 @@ class Token:
         """
         self.type = type
         self.lexeme = lexeme
+        self.start = start
+        self._lines = lines
 
     def __repr__(self):
         return f"<{self.type}: {self.lexeme}>"
@@ -42,6 +59,164 @@ class Token:
     def __hash__(self):
         return hash((self.type, self.lexeme))
 
+    @property
+    def lines(self):
+        """LineIndex?: The line index of the source code of the token, if known."""
+        return self._lines
+
+    @property
+    def line(self):
+        """int?: The line of the token (starting from 1), if known."""
+        if self.start is None or self._lines is None:
+            return None
+        return self._lines.line(self.start)
+
+    @property
+    def column(self):
+        """int?: The column of the token (starting from 1), if known."""
+        if self.start is None or self._lines is None:
+            return None
+        return self._lines.locate(self.start)[1]
+
+
+class LineIndex:
+    """Class mapping offsets in a source code to lines and columns.
+
+    The index stores the offset at which every line starts. It is either built
+    from the whole source code the first time it is used, or fed chunk by chunk
+    while a file is being scanned.
+    """
+
+    __slots__ = ("_starts", "_pending")
+
+    def __init__(self, source: str = None):
+        """Creates a new line index.
+
+        Args:
+            source (str?): The source code to index. If not provided, the source
+                code must be fed with feed().
+        """
+        self._starts = array("q", [0])
+        self._pending = source  # indexed on first use
+
+    def __getstate__(self):
+        # the index is saved (e.g. with a tree) rather than the source code
+        self._index()
+        return self._starts
+
+    def __setstate__(self, starts):
+        self._starts = starts
+        self._pending = None
+
+    def feed(self, text: str, offset: int):
+        """Records the lines starting in a chunk of the source code.
+
+        Args:
+            text (str): The chunk of source code.
+            offset (int): The offset of the chunk in the source code.
+        """
+        starts = self._starts
+        find = text.find
+        index = find("\n")
+        while index >= 0:
+            starts.append(offset + index + 1)
+            index = find("\n", index + 1)
+
+    def line(self, offset: int) -> int:
+        """Returns the line of an offset in the source code.
+
+        Args:
+            offset (int): The offset in the source code.
+
+        Returns:
+            int: The line, starting from 1.
+        """
+        self._index()
+        return bisect_right(self._starts, offset)
+
+    def locate(self, offset: int):
+        """Returns the line and column of an offset in the source code.
+
+        Args:
+            offset (int): The offset in the source code.
+
+        Returns:
+            tuple[int, int]: The line and column, both starting from 1.
+        """
+        self._index()
+        line = bisect_right(self._starts, offset)
+        return line, offset - self._starts[line - 1] + 1
+
+    def _index(self):
+        # index the source code given to the constructor, on first use
+        if self._pending is not None:
+            self.feed(self._pending, 0)
+            self._pending = None
+
+
+class TokenBuffer(Sequence):
+    """Class storing a sequence of tokens compactly.
+
+    The types, lexemes and start offsets of the tokens are stored in parallel
+    arrays, and Token objects are only created when the tokens are accessed. The
+    lexemes are expected to be interned, so repeated lexemes are stored once.
+    """
+
+    def __init__(self, lines: LineIndex = None):
+        """Creates a new, empty token buffer.
+
+        Args:
+            lines (LineIndex?): The line index of the source code of the tokens.
+        """
+        self._types = array("b")
+        self._lexemes = []
+        self._starts = array("q")
+        self._lines = lines
+
+    def __repr__(self):
+        return f"{list(self)!r}"
+
+    def __len__(self):
+        return len(self._lexemes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return Token(TokenType(self._types[index]), self._lexemes[index],
+                     self._starts[index], self._lines)
+
+    def __iter__(self):
+        lines = self._lines
+        for type, lexeme, start in zip(self._types, self._lexemes, self._starts):
+            yield Token(TokenType(type), lexeme, start, lines)
+
+    def append(self, type, lexeme, start):
+        """Appends a token to the buffer.
+
+        Args:
+            type (TokenType): The type of the token.
+            lexeme (str): The lexeme of the token.
+            start (int): The offset of the token in the source code.
+        """
+        self._types.append(type)
+        self._lexemes.append(lexeme)
+        self._starts.append(start)
+
+    def extend(self, tokens):
+        """Appends several tokens to the buffer.
+
+        Args:
+            tokens (Iterable[tuple[TokenType, str, int]]): The type, lexeme and
+                start offset of each token.
+        """
+        append_type = self._types.append
+        append_lexeme = self._lexemes.append
+        append_start = self._starts.append
+        for type, lexeme, start in tokens:
+            append_type(type)
+            append_lexeme(lexeme)
+            append_start(start)
+
 
 class TokenType(IntEnum):
     """Enum representing the different types of tokens.
@@ -82,3 +257,63 @@ class TokenType(IntEnum):
     DO = auto()         # do keyword
 
     ROUTINE = auto()    # routine keyword (for defining a function)
+    RETURN = auto()     # return keyword (for leaving a function)
+
+
+class TokenStream:
+    """Class representing a lazily consumed stream of tokens.
+
+    Tokens are pulled from the underlying iterable on demand, so only the current
+    token and the ones in the lookahead buffer are held at any time. The iterable
+    can be a list of tokens or a generator such as Scanner.iter_tokens().
+    """
+
+    def __init__(self, tokens: Iterable[Token]):
+        """Creates a new token stream.
+
+        Args:
+            tokens (Iterable[Token]): The tokens to stream.
+        """
+        self._tokens = iter(tokens)
+        self._buffer = deque()  # lookahead tokens, after the current one
+        self.current = next(self._tokens, None)  # None at the end of the stream
+
+    def peek(self, offset=0):
+        """Returns a token ahead of the stream without consuming it.
+
+        Args:
+            offset (int): The position of the token relative to the current one.
+
+        Returns:
+            Token?: The token, or None if the stream ends before it.
+        """
+        if offset == 0:
+            return self.current
+        # fill the lookahead buffer up to the requested token
+        while len(self._buffer) < offset:
+            token = next(self._tokens, None)
+            if token is None:
+                return None
+            self._buffer.append(token)
+        return self._buffer[offset - 1]
+
+    def advance(self):
+        """Consumes the current token and moves to the next one.
+
+        Returns:
+            Token?: The consumed token, or None if at the end of the stream.
+        """
+        token = self.current
+        if self._buffer:
+            self.current = self._buffer.popleft()
+        elif token is not None:
+            self.current = next(self._tokens, None)
+        return token
+
+    def at_end(self):
+        """Checks whether the stream has been consumed entirely.
+
+        Returns:
+            bool: True if there are no more tokens.
+        """
+        return self.current is None
@@ -0,0 +1,399 @@
+"""Virtual machine for the BLAST language.
+
+This module contains the VM class, which runs the bytecode produced by the compiler
+in blast.compiler.
+"""
+
+from .compiler import Code, Compiler, Op
+from .symtab import _MISSING, Frame, SymbolTable, SymbolType
+from .purity import memo_key
+from .builtins import Builtin, builtin
+
+
+class VM:
+    """The virtual machine for the BLAST language.
+
+    The machine runs one instruction at a time in a single dispatch loop, with an
+    operand stack per frame. The frames of the callers are kept on a list rather
+    than on the Python call stack, so the depth of BLAST recursion is not limited
+    by the Python recursion limit.
+
+    A call that is the last statement of a routine, or the value of a return
+    statement, is a tail call: the callee replaces the frame of the routine instead
+    of being pushed on top of it, so tail-recursive routines run in constant stack
+    space. As the value of a routine is the last value of its body that is not
+    None, the frame remembers the value to return if the callee returns None.
+
+    As all of its state is in the machine rather than on the Python stack, a run
+    can also be suspended, between the iterations of a loop or at a call, and
+    resumed later (see steps()).
+    """
+
+    def __init__(self, symtab: SymbolTable = None, codes: dict = None, memos: dict = None,
+                 meter=None):
+        """Initialize the VM.
+
+        Args:
+            symtab (SymbolTable?): The global symbol table. A new one is created if
+                not provided.
+            codes (MutableMapping[RoutineStmtAST, Code]?): A cache of the compiled
+                bodies of routines, shared between runs (e.g. a
+                weakref.WeakKeyDictionary). Routines missing from the cache are
+                compiled when they are first called.
+            memos (dict[RoutineStmtAST, Memo]?): The caches of the values of the
+                pure routines (see blast.purity).
+            meter (Meter?): The meter of the budget of the run (see blast.budget),
+                whose compiler compiles the routines, whose builtin functions are
+                called, and which counts the memory of the frames of the calls.
+                The code run must be compiled with it too, and codes must only
+                hold code compiled with it.
+        """
+        self._symtab = symtab if symtab is not None else SymbolTable()
+        self._codes = codes if codes is not None else {}
+        self._memos = memos if memos is not None else {}
+        self._meter = meter
+        self._compiler = meter.compiler if meter is not None else Compiler
+        self._builtin = meter.builtin if meter is not None else builtin
+
+    def run(self, code: Code):
+        """Run compiled code and return its result.
+
+        Args:
+            code (Code): The code of the program.
+
+        Returns:
+            Any: The value of the program.
+        """
+        # without a quantum, the run is never suspended
+        try:
+            next(self.steps(code))
+        except StopIteration as stop:
+            return stop.value
+
+    def steps(self, code: Code, quantum: int = None):
+        """Run compiled code, suspending the run at regular intervals.
+
+        The run is suspended after every quantum loop iterations and calls, which
+        are what a program can repeat without bound, so that the caller can do
+        something else in between (e.g. let other tasks run). Closing the generator
+        abandons the run.
+
+        Args:
+            code (Code): The code of the program.
+            quantum (int?): The number of loop iterations and calls between two
+                suspensions. None never suspends the run.
+
+        Yields:
+            None: Each time the run is suspended. A number sent to the generator
+                is the number of loop iterations and calls before the next
+                suspension, instead of quantum.
+
+        Returns:
+            Any: The value of the program, as the value of the StopIteration.
+        """
+        # opcodes as locals, in order of frequency
+        BINARY_VAR_CONST = Op.BINARY_VAR_CONST.value
+        BINARY = Op.BINARY.value
+        JUMP_IF_FALSE = Op.JUMP_IF_FALSE.value
+        LOAD_SLOT = Op.LOAD_SLOT.value
+        STORE_APPEND = Op.STORE_APPEND.value
+        STORE_POP = Op.STORE_POP.value
+        LOOP = Op.LOOP.value
+        NEW_LIST = Op.NEW_LIST.value
+        APPEND = Op.APPEND.value
+        LOAD_VAR = Op.LOAD_VAR.value
+        BINARY_SLOT_CONST = Op.BINARY_SLOT_CONST.value
+        STORE_SLOT_POP = Op.STORE_SLOT_POP.value
+        STORE_SLOT_APPEND = Op.STORE_SLOT_APPEND.value
+        LOAD_CONST = Op.LOAD_CONST.value
+        CALL = Op.CALL.value
+        FUNCTION = Op.FUNCTION.value
+        RETURN = Op.RETURN.value
+        LAST = Op.LAST.value
+        BINARY_VAR_VAR = Op.BINARY_VAR_VAR.value
+        STORE_VAR = Op.STORE_VAR.value
+        STORE_SLOT = Op.STORE_SLOT.value
+        POP = Op.POP.value
+        JUMP = Op.JUMP.value
+        TAIL_CALL = Op.TAIL_CALL.value
+        NEGATE = Op.NEGATE.value
+        PRINT = Op.PRINT.value
+        DEFINE = Op.DEFINE.value
+        FAIL = Op.FAIL.value
+
+        MISSING = _MISSING
+        # the bodies of the routines this run has called, taken from the shared
+        # cache the first time
+        codes = {}
+        memos = self._memos
+        # the callers of the current frame, as
+        # (instructions, pc, stack, symtab, slots, fallback, memo, entry)
+        frames = []
+        # with a meter, the memory counted for each of the frames
+        meter = self._meter
+        charges = []
+
+        # the state of the current frame, kept in locals while it runs
+        instructions = code.instructions
+        pc = 0
+        stack = []
+        symtab = self._symtab
+        symbols = symtab._symbols
+        slots = symtab.slots if isinstance(symtab, Frame) else None
+        fallback = None  # the value returned instead of None, after tail calls
+        memo = entry = None  # the cache to store the value of the frame in, and its key
+        push = stack.append
+        pop = stack.pop
+        # the loop iterations and calls left before the run is suspended; it never
+        # reaches 0 from -1
+        countdown = quantum or -1
+
+        while True:
+            op, arg = instructions[pc]
+            pc += 1
+
+            if op == BINARY_VAR_CONST:
+                function, key, value = arg
+                lhs = symbols.get(key, MISSING)
+                if lhs is MISSING:
+                    lhs = self._lookup(symtab, key)
+                push(function(lhs, value))
+            elif op == BINARY:
+                lhs = pop()
+                stack[-1] = arg(lhs, stack[-1])
+            elif op == JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif op == LOAD_SLOT:
+                value = slots[arg[0]]
+                if value is MISSING:
+                    value = self._lookup(symtab, arg[1])
+                push(value)
+            elif op == STORE_APPEND:
+                value = pop()
+                if value is None:
+                    raise Exception("Cannot assign None")
+                symbols[arg] = value
+                stack[-1].append(value)
+            elif op == STORE_POP:
+                value = pop()
+                if value is None:
+                    raise Exception("Cannot assign None")
+                symbols[arg] = value
+            elif op == LOOP:
+                pc = arg
+                countdown -= 1
+                if not countdown:
+                    countdown = (yield) or quantum
+            elif op == NEW_LIST:
+                push([])
+            elif op == APPEND:
+                value = pop()
+                if value is not None:
+                    stack[-1].append(value)
+            elif op == LOAD_VAR:
+                value = symbols.get(arg, MISSING)
+                if value is MISSING:
+                    value = self._lookup(symtab, arg)
+                push(value)
+            elif op == BINARY_SLOT_CONST:
+                function, slot, key, value = arg
+                lhs = slots[slot]
+                if lhs is MISSING:
+                    lhs = self._lookup(symtab, key)
+                push(function(lhs, value))
+            elif op == STORE_SLOT_POP:
+                value = pop()
+                if value is None:
+                    raise Exception("Cannot assign None")
+                slots[arg] = value
+            elif op == STORE_SLOT_APPEND:
+                value = pop()
+                if value is None:
+                    raise Exception("Cannot assign None")
+                slots[arg] = value
+                stack[-1].append(value)
+            elif op == LOAD_CONST:
+                push(arg)
+            elif op == CALL:
+                if arg:
+                    args = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    args = ()
+                func = pop()
+                callee_memo = callee_key = None
+                if memos:
+                    callee_memo = memos.get(func)
+                    if callee_memo is not None:
+                        callee_key = memo_key(args)
+                        if callee_key is None:
+                            callee_memo = None
+                        else:
+                            result = callee_memo.lookup(callee_key)
+                            if result is not MISSING:
+                                push(result)
+                                continue
+                body = codes.get(func)
+                if body is None:
+                    if type(func) is Builtin:
+                        push(func(*args))
+                        continue
+                    body = codes[func] = self._routine(func)
+
+                callee = Frame(symtab, body.layout, body.size, args)
+                if meter is not None:
+                    charges.append(meter.enter(body.size))
+
+                countdown -= 1
+                if not countdown:
+                    countdown = (yield) or quantum
+
+                # save the caller and switch to the callee
+                frames.append((instructions, pc, stack, symtab, slots, fallback, memo, entry))
+                fallback = None
+                memo, entry = callee_memo, callee_key
+
+                instructions = body.instructions
+                pc = 0
+                stack = []
+                push = stack.append
+                pop = stack.pop
+                symtab = callee
+                symbols = callee._symbols
+                slots = callee.slots
+            elif op == FUNCTION:
+                name, argc = arg
+                try:
+                    func = symtab.get(name, SymbolType.FUNCTION)
+                except KeyError:
+                    # no routine has the name; it may be a builtin function
+                    push(self._builtin(name, argc))
+                    continue
+                if len(func.args) != argc:
+                    raise Exception(
+                        f"Invalid number of arguments for function '{name}': expected {len(func.args)}, got {argc}")
+                push(func)
+            elif op == RETURN:
+                result = pop()
+                if result is None:
+                    result = fallback
+                if memo is not None:
+                    memo.store(entry, result)
+                if not frames:
+                    return result
+                if meter is not None:
+                    meter.release(charges.pop())
+
+                # switch back to the caller
+                instructions, pc, stack, symtab, slots, fallback, memo, entry = frames.pop()
+                push = stack.append
+                pop = stack.pop
+                symbols = symtab._symbols
+                push(result)
+            elif op == LAST:
+                result = stack[-1]
+                stack[-1] = result[-1] if result else None
+            elif op == BINARY_VAR_VAR:
+                function, lhs_key, rhs_key = arg
+                # right-hand side first, as the interpreter does
+                rhs = symbols.get(rhs_key, MISSING)
+                if rhs is MISSING:
+                    rhs = self._lookup(symtab, rhs_key)
+                lhs = symbols.get(lhs_key, MISSING)
+                if lhs is MISSING:
+                    lhs = self._lookup(symtab, lhs_key)
+                push(function(lhs, rhs))
+            elif op == STORE_VAR:
+                # the value stays on the stack (for chaining)
+                if stack[-1] is None:
+                    raise Exception("Cannot assign None")
+                symbols[arg] = stack[-1]
+            elif op == STORE_SLOT:
+                if stack[-1] is None:
+                    raise Exception("Cannot assign None")
+                slots[arg] = stack[-1]
+            elif op == POP:
+                pop()
+            elif op == JUMP:
+                pc = arg
+            elif op == TAIL_CALL:
+                if arg:
+                    args = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    args = ()
+                func = pop()
+                if memos and func in memos:
+                    callee_key = memo_key(args)
+                    result = memos[func].lookup(callee_key) if callee_key is not None else MISSING
+                    if result is not MISSING:
+                        # the routine returns the cached value, as a plain call would
+                        if result is not None:
+                            stack[-1].append(result)
+                        continue
+                body = codes.get(func)
+                if body is None:
+                    if type(func) is Builtin:
+                        # the routine returns the value, as a plain call would
+                        result = func(*args)
+                        if result is not None:
+                            stack[-1].append(result)
+                        continue
+                    body = codes[func] = self._routine(func)
+
+                # the caller of the routine gets the value of the callee, or if it
+                # is None, the last value of the routine (or the fallback before)
+                results = pop()
+                if results:
+                    fallback = results[-1]
+                # the callee still sees the variables of the routine, which are
+                # kept until it returns
+                callee = Frame(symtab, body.layout, body.size, args)
+                if meter is not None:
+                    charges[-1] += meter.enter(body.size)
+
+                countdown -= 1
+                if not countdown:
+                    countdown = (yield) or quantum
+
+                # switch to the callee, in place of the routine
+                instructions = body.instructions
+                pc = 0
+                stack = []
+                push = stack.append
+                pop = stack.pop
+                symtab = callee
+                symbols = callee._symbols
+                slots = callee.slots
+            elif op == NEGATE:
+                stack[-1] = -stack[-1]
+            elif op == PRINT:
+                if arg:
+                    args = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    args = ()
+                print(*args, sep=" ")
+                push(None)
+            elif op == DEFINE:
+                stmt, body = arg
+                codes[stmt] = self._codes[stmt] = body
+                symtab.set(stmt.name, SymbolType.FUNCTION, stmt)
+            elif op == FAIL:
+                raise Exception(arg)
+
+    def _routine(self, func):
+        # get the compiled body of a routine from the shared cache, compiling it
+        # the first time
+        body = self._codes.get(func)
+        if body is None:
+            body = self._codes[func] = self._compiler().compile_routine(func)
+        return body
+
+    def _lookup(self, symtab, key):
+        # look a variable up in the enclosing symbol tables
+        try:
+            return symtab.get(*key)
+        except KeyError:
+            raise Exception(f"Undefined variable '{key[0]}'")
@@ -0,0 +1,188 @@
+"""Conformance tests for the execution engines.
+
+Runs BLAST programs on every engine of the Interpreter (and on the tree-walking
+engine with its native tier compiling everything at once, with and without
+memoization), and checks that they all give the results, printed output and
+errors of the tree-walking engine. Some programs are also run by several threads
+at once on one Interpreter, and every thread must get the result of the program
+run alone.
+
+Run with ``python3 -m unittest`` (or ``pytest``) from the repository root.
+"""
+
+import contextlib
+import io
+import pathlib
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+from blast.interpreter import Interpreter  # noqa: E402
+
+"""Programs run on every engine (small, covering every construct)."""
+CONFORMANCE = {
+    'arithmetic': '1 + 2 * 3. 2 ** 3 ** 2. -4 + 10 % 3. 7 / 2. (1 + 2) * 3. 1.5 * 2.',
+    'comparison': '1 < 2. 2 <= 1. 3 = 3. 3 <> 3. 4 > 1. 4 >= 5. "a" = "a".',
+    'strings': '"ab" + "cd". "x" * 3.',
+    'assignment': 'x : 5. y : x * 2. x : y : 3. x + y. z : x + y * x.',
+    'if': 'x : 3. if x > 2 then "big". x. else "small". end. if 0 then 1. end. if 1 then end.',
+    'while': 'i : 0. while i < 5 do i : i + 1. if i = 2 then "two". end. end. while 0 do 1. end.',
+    'routines': 'routine f(a b) a. b. a + b. end. f(1 2). routine g() print("g"). end. g().',
+    'dynamic scope': 'routine g() z. end. routine f(z) g(). end. f(42).',
+    'nested routines': 'routine outer(n) routine inner(m) m + n. end. inner(1). end. outer(5).',
+    'return': 'routine f(x) if x then return "yes". end. while 1 do return. end. end. f(1). f(0).',
+    'return outside': 'return 1.',
+    'print': 'print("hi" 1 2). x : 1. print(x + 1).',
+    'undefined variable': 'x + 1.',
+    'undefined function': 'nope(1).',
+    'wrong arity': 'routine f(a) a. end. f(1 2).',
+    'assign none': 'routine f() print(). end. x : f().',
+    'bad target': '1 : 2.',
+    'type error': '1 + "a".',
+    'division by zero': '1 / 0.',
+    'arrays': 'a : array(1 2 (-3.5)). a * 2 - 1. 1 / a. a ** 2 < 4. len(a). at(a 1). sum(range(5) * a). '
+              'routine len(x) 0. end. len(a).',
+    'array errors': 'array(1 2) + range(3).',
+    'evaluation order': 'routine f(a b) a * 10 + b. end. '
+                        'routine g(n) (n : 5) + n + f(n n : 7) + n - -n. end. g(1). g(2).',
+    'hot loop': 'i : 0. s : 0. while i < 300 do s : s + i * 2 % 7. i : i + 1. end. s.',
+    'hot routine': 'routine fib(n) if n < 2 then return n. end. fib(n - 1) + fib(n - 2). end. fib(15).',
+    'builtin shadowed later': 'routine f(s) len(s). end. '
+                              'routine g() routine len(x) 99. end. f("abc"). end. f("abc"). g().',
+    'builtin shadowed in a loop': 'routine f(s) len(s). end. i : 0. t : 0. while i < 200 do '
+                                  'if i = 100 then routine len(x) 99. end. end. t : t + f("ab"). '
+                                  'i : i + 1. end. t.',
+    'long chain': 'routine f(x) ' + ' + '.join(['x'] * 250) + '. end. '
+                  'i : 0. s : 0. while i < 150 do s : s + f(i). i : i + 1. end. s.',
+    'long chain of calls': 'routine g(x) x + 1. end. routine f(x) '
+                           + ' * '.join(['g(x)'] * 120) + ' % 1000. end. f(1). f(2).',
+}
+
+"""Programs run by several threads at once."""
+THREADED = {
+    'global loop': 'i : 0. s : 0. while i < 3000 do s : s + 1. i : i + 1. end. s.',
+    'recursion': 'routine fib(n) r : n. if n > 1 then r : fib(n - 1) + fib(n - 2). end. r. end. fib(12).',
+    'dynamic scope': 'routine g() z * 2. end. routine f(z) g(). end. i : 0. t : 0. '
+                     'while i < 300 do t : t + f(i). i : i + 1. end. t.',
+}
+
+"""The ways to run a program, by name: the arguments of the Interpreter."""
+CONFIGURATIONS = {
+    'tree': {'engine': 'tree', 'memo_size': None, 'tier_threshold': None},
+    'tree tiered': {'engine': 'tree', 'memo_size': None, 'tier_threshold': 1},
+    'tree memoized': {'engine': 'tree'},
+    'vm': {'engine': 'vm', 'memo_size': None},
+    'vm memoized': {'engine': 'vm'},
+    'closure': {'engine': 'closure', 'memo_size': None},
+    'closure memoized': {'engine': 'closure'},
+}
+
+
+def run(sources, **options):
+    """Run programs one after the other on one Interpreter.
+
+    Args:
+        sources (Iterable[str]): The source code of the programs.
+        **options: The arguments of the Interpreter.
+
+    Returns:
+        list[tuple[str, str]]: The result (or error) and the printed output of
+            each program.
+    """
+    interpreter = Interpreter(**options)
+    outcomes = []
+    for source in sources:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            try:
+                result = repr(interpreter.evaluate(source))
+            except Exception as e:
+                result = f"{type(e).__name__}: {e}"
+        outcomes.append((result, output.getvalue()))
+    return outcomes
+
+
+def run_threads(source, count, **options):
+    """Run a program in several threads at once, on the same Interpreter.
+
+    Args:
+        source (str): The source code of the program.
+        count (int): The number of threads.
+        **options: The arguments of the Interpreter.
+
+    Returns:
+        list[str]: The result (or error) of each thread.
+    """
+    interpreter = Interpreter(**options)
+    results = []
+
+    def target():
+        try:
+            results.append(repr(interpreter.evaluate(source)))
+        except Exception as e:
+            results.append(f"{type(e).__name__}: {e}")
+
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    # switch threads often, so that the runs interleave
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    return results
+
+
+class ConformanceTest(unittest.TestCase):
+
+    def assertConforms(self, sources):
+        expected = run(sources, **CONFIGURATIONS['tree'])
+        for name, options in CONFIGURATIONS.items():
+            with self.subTest(configuration=name):
+                self.assertEqual(run(sources, **options), expected)
+
+    def test_programs(self):
+        for name, source in CONFORMANCE.items():
+            with self.subTest(program=name):
+                self.assertConforms([source])
+
+    def test_builtin_shadowed_by_a_later_program(self):
+        sources = ['routine f(s) len(s). end. f("abc").', 'routine len(x) 99. end. f("abc").']
+        self.assertConforms(sources)
+        for name, options in CONFIGURATIONS.items():
+            with self.subTest(configuration=name):
+                self.assertEqual([result for result, _ in run(sources, **options)],
+                                 ['[3]', '[99]'])
+
+    def test_builtin_shadowed_by_a_nested_routine(self):
+        source = CONFORMANCE['builtin shadowed later']
+        for name, options in CONFIGURATIONS.items():
+            with self.subTest(configuration=name):
+                self.assertEqual(run([source], **options), [('[3, 99]', '')])
+
+    def test_long_chain(self):
+        total = 0
+        iterations = []
+        for i in range(150):
+            total += 250 * i
+            iterations.append([total, i + 1])
+        expected = [(repr([0, 0, iterations, total]), '')]
+        for name, options in CONFIGURATIONS.items():
+            with self.subTest(configuration=name):
+                self.assertEqual(run([CONFORMANCE['long chain']], **options), expected)
+
+    def test_threads(self):
+        for name, source in THREADED.items():
+            [(expected, _)] = run([source], **CONFIGURATIONS['tree'])
+            for configuration, options in CONFIGURATIONS.items():
+                with self.subTest(program=name, configuration=configuration):
+                    self.assertEqual(run_threads(source, 4, **options), [expected] * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()